@@ -3,6 +3,8 @@ import os
 from os import path
 import shutil
 
+from timestream.parse.validate import TS_V1_FMT
+
 
 LOG = logging.getLogger("timestreamlib")
 LGHNDLR = logging.NullHandler()
@@ -70,3 +72,17 @@ TS_MANIFOLD_DATES = [
 if path.exists(FILES["empty_dir"]):
     shutil.rmtree(FILES["empty_dir"])
 os.mkdir(FILES["empty_dir"])
+
+
+def make_timestream(root, name, times, ext="JPG", n=0, data=b""):
+    """Create a V1 timestream of (by default empty) image files named for
+    each datetime in ``times``, returning the timestream path."""
+    ts_path = path.join(root, name)
+    for time in times:
+        img = path.join(ts_path, time.strftime(TS_V1_FMT.format(
+            tsname=name, ext=ext, n=n)))
+        if not path.isdir(path.dirname(img)):
+            os.makedirs(path.dirname(img))
+        with open(img, "wb") as fh:
+            fh.write(data)
+    return ts_path
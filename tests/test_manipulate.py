@@ -0,0 +1,88 @@
+import json
+import logging
+import multiprocessing
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase, skip, skipIf, skipUnless
+
+from timestream.manipulate import (
+    ProgressReporter,
+    ts_parallel_map,
+)
+
+
+def _square(args):
+    return args[0] ** 2
+
+
+class TestProgressReporter(TestCase):
+
+    """Tests for timestream.manipulate.ProgressReporter"""
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.status = path.join(self.tmpdir, "status.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_status(self):
+        prog = ProgressReporter(total=10, name="test", interval=1000,
+                                status_file=self.status, status_interval=0)
+        prog.update(4, nbytes=4000)
+        prog.set_queue("pool", 3)
+        prog.add_stage_time("decode", 1.5)
+        st = prog.status()
+        self.assertEqual(st["done"], 4)
+        self.assertEqual(st["percent"], 40.0)
+        self.assertDictEqual(st["queues"], {"pool": 3})
+        self.assertDictEqual(st["stages"], {"decode": 1.5})
+        self.assertIsNotNone(st["eta_seconds"])
+        self.assertIn("4/10 (40.0%)", prog.message())
+        self.assertIn("queued pool=3", prog.message())
+        with open(self.status) as fh:
+            self.assertEqual(json.load(fh)["done"], 4)
+        prog.update(6)
+        prog.finish()
+        with open(self.status) as fh:
+            st = json.load(fh)
+        self.assertTrue(st["finished"])
+        self.assertEqual(st["done"], 10)
+
+    def test_no_total(self):
+        prog = ProgressReporter(interval=1000)
+        prog.update()
+        self.assertIsNone(prog.status()["eta_seconds"])
+        self.assertNotIn("ETA", prog.message())
+
+
+class TestParallelMap(TestCase):
+
+    """Tests for timestream.manipulate.ts_parallel_map"""
+
+    def test_parallel_map_progress(self):
+        prog = ProgressReporter(total=20, interval=1000)
+        res = list(ts_parallel_map(range(20), _square, [], procs=2,
+                                   progress=prog))
+        self.assertListEqual(res, [x ** 2 for x in range(20)])
+        self.assertEqual(prog.done, 20)
+        self.assertEqual(prog.queues["pool"], 0)
+
+    def test_parallel_map_bounded(self):
+        prog = ProgressReporter(total=20, interval=1000)
+        res = []
+        for ret in ts_parallel_map(range(20), _square, [], procs=2,
+                                   progress=prog, max_pending=3):
+            self.assertLess(prog.queues["pool"], 3)
+            res.append(ret)
+        self.assertListEqual(res, [x ** 2 for x in range(20)])
+
+    def test_parallel_map_closed_early(self):
+        """Test the pool is torn down when the consumer stops early"""
+        results = ts_parallel_map(range(20), _square, [], procs=2,
+                                  max_pending=3)
+        self.assertEqual(next(results), 0)
+        results.close()
+        self.assertEqual(multiprocessing.active_children(), [])
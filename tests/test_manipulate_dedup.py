@@ -0,0 +1,125 @@
+import datetime as dt
+import multiprocessing
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from timestream.manipulate import (
+    ts_parallel_map,
+)
+from timestream.manipulate.dedup import (
+    ts_dedup,
+    ts_phash,
+    ts_phash_distance,
+    ts_read_dedup,
+)
+from timestream.manipulate.video import (
+    ts_to_video,
+)
+from timestream.parse import (
+    ts_get_duplicates,
+    ts_get_index,
+    ts_index_invalidate,
+    ts_iter_bursts,
+    ts_iter_images,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+def _basename(args):
+    return path.basename(args[0])
+
+
+class TestDedup(TestCase):
+
+    """Tests for timestream.manipulate.dedup"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts_path = path.join(self.tmpdir, "SYN01-Cam01~fullres-orig")
+        ts_make_synthetic(self.ts_path, dt.datetime(2014, 1, 1, 0),
+                          dt.datetime(2014, 1, 1, 2, 45), interval=15,
+                          shape=(48, 64, 3))
+        self.imgs = ts_get_index(self.ts_path)["paths"]
+        # Synthetic images are all the same, so give each its own
+        rng = np.random.RandomState(0)
+        for img in self.imgs:
+            mat = rng.randint(0, 256, size=(6, 8, 3)).astype("u1")
+            cv2.imwrite(img, cv2.resize(mat, (64, 48),
+                                        interpolation=cv2.INTER_CUBIC))
+        # A stuck camera: images 3 to 5 are copies of image 2
+        for img in self.imgs[3:6]:
+            shutil.copy(self.imgs[2], img)
+        # Image 8 is image 7 re-encoded, so nearly identical
+        mat = cv2.imread(self.imgs[7])
+        cv2.imwrite(self.imgs[8], mat, [cv2.IMWRITE_JPEG_QUALITY, 80])
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def test_phash(self):
+        """Test perceptual hashes are stable and comparable"""
+        mat = cv2.imread(self.imgs[0])
+        phash = ts_phash(mat)
+        self.assertEqual(len(phash), 16)
+        self.assertLessEqual(ts_phash_distance(
+            ts_phash(cv2.resize(mat, (32, 24))), phash), 4)
+        self.assertGreater(ts_phash_distance(
+            ts_phash(cv2.imread(self.imgs[1])), phash), 8)
+        self.assertEqual(ts_phash_distance(phash, phash), 0)
+        self.assertEqual(ts_phash_distance("0" * 16, "f" * 16), 64)
+
+    def test_dedup_exact(self):
+        """Test exact duplicates are found, and recorded in the sidecar"""
+        with self.assertRaises(IOError):
+            ts_get_duplicates(self.ts_path)
+        rows = ts_dedup(self.ts_path, procs=2)
+        dups = [row["image"] for row in rows if row["duplicate_of"]]
+        self.assertEqual(len(dups), 3)
+        self.assertTrue(all(row["duplicate_of"] ==
+                            path.relpath(self.imgs[2], self.ts_path)
+                            for row in rows if row["duplicate_of"]))
+        self.assertEqual(ts_read_dedup(self.ts_path), rows)
+        self.assertEqual(ts_get_duplicates(self.ts_path),
+                         set(path.normpath(x) for x in self.imgs[3:6]))
+        # No pool workers are left behind
+        self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_dedup_near(self):
+        """Test near duplicates are found with max_distance, without
+        rehashing"""
+        ts_dedup(self.ts_path, procs=2)
+        rows = ts_dedup(self.ts_path, max_distance=4, procs=2)
+        dup_of = dict((row["image"], row["duplicate_of"]) for row in rows)
+        self.assertEqual(dup_of[path.relpath(self.imgs[8], self.ts_path)],
+                         path.relpath(self.imgs[7], self.ts_path))
+        self.assertEqual(dup_of[path.relpath(self.imgs[7], self.ts_path)],
+                         "")
+
+    def test_skip_duplicates(self):
+        """Test iterators, ts_parallel_map and exporters skip duplicates"""
+        # Without a table, skipping duplicates is an error
+        with self.assertRaises(IOError):
+            list(ts_parallel_map(self.imgs, _basename, [], procs=2,
+                                 skip_duplicates=True))
+        ts_dedup(self.ts_path, procs=2)
+        kept = [x for x in self.imgs if x not in self.imgs[3:6]]
+        self.assertEqual(sorted(ts_iter_images(self.ts_path,
+                                               skip_duplicates=True)),
+                         sorted(kept))
+        bursts = list(ts_iter_bursts(self.ts_path, skip_duplicates=True))
+        self.assertEqual(len(bursts), len(kept))
+        mapped = list(ts_parallel_map(self.imgs, _basename, [], procs=2,
+                                      skip_duplicates=True))
+        self.assertEqual(mapped, [path.basename(x) for x in kept])
+        video = path.join(self.tmpdir, "timelapse.avi")
+        written = ts_to_video(self.ts_path, video, fourcc="MJPG",
+                              skip_duplicates=True, procs=2)
+        self.assertEqual(written, len(kept))
@@ -0,0 +1,178 @@
+import datetime as dt
+import os
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from tests import helpers
+from timestream.manipulate.ingest import (
+    ts_ingest,
+)
+from timestream.parse import (
+    ts_get_manifest,
+)
+from timestream.util import (
+    files,
+)
+from timestream.util.files import (
+    place_file,
+)
+from timestream.util.imgmeta import (
+    get_exif_datetime,
+)
+
+EXIF_TIME = dt.datetime(2013, 11, 12, 20, 53, 9)
+
+
+class TestPlaceFile(TestCase):
+
+    """Tests for timestream.util.files.place_file"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = path.join(self.tmpdir, "src.JPG")
+        with open(self.src, "wb") as ofh:
+            ofh.write(b"image data")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_place_link(self):
+        """Test place_file hard links, making parent directories"""
+        dst = path.join(self.tmpdir, "a", "b", "dst.JPG")
+        self.assertEqual(place_file(self.src, dst), "link")
+        self.assertTrue(path.samefile(self.src, dst))
+
+    def test_place_copy(self):
+        """Test place_file in copy mode gives an independent file"""
+        dst = path.join(self.tmpdir, "dst.JPG")
+        self.assertIn(place_file(self.src, dst, "copy"),
+                      ("reflink", "copy_range", "copy"))
+        self.assertFalse(path.samefile(self.src, dst))
+        with open(dst, "rb") as ifh:
+            self.assertEqual(ifh.read(), b"image data")
+
+    def test_place_bad(self):
+        """Test place_file with an existing destination or bad mode"""
+        with self.assertRaises(OSError):
+            place_file(self.src, self.src)
+        with self.assertRaises(ValueError):
+            place_file(self.src, path.join(self.tmpdir, "x"), "move")
+
+    def test_place_no_link(self):
+        """Test place_file without os.link, as on Windows under Python 2"""
+        link = files._PLACERS["link"]
+        files._PLACERS["link"] = None
+        try:
+            with self.assertRaises(ValueError):
+                place_file(self.src, path.join(self.tmpdir, "x"))
+            self.assertNotEqual(place_file(self.src,
+                                           path.join(self.tmpdir, "y"),
+                                           "copy"), "link")
+        finally:
+            files._PLACERS["link"] = link
+
+
+class TestIngest(TestCase):
+
+    """Tests for timestream.manipulate.ingest.ts_ingest"""
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dump = path.join(self.tmpdir, "DCIM")
+        self.ts_path = path.join(self.tmpdir, "BVZ0001-Cam01~fullres-orig")
+        os.mkdir(self.dump)
+        # Three frames of one burst, all with the same EXIF time
+        for iii in range(3):
+            shutil.copy(helpers.FILES["basic_jpg"],
+                        path.join(self.dump, "IMG_{:04d}.JPG".format(iii)))
+        with open(path.join(self.dump, "NOTES.TXT"), "w") as ofh:
+            ofh.write("not an image")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_exif_datetime(self):
+        """Test get_exif_datetime on a camera JPG"""
+        self.assertEqual(get_exif_datetime(helpers.FILES["basic_jpg"]),
+                         EXIF_TIME)
+
+    def test_ingest(self):
+        """Test ts_ingest assigns n counters and writes the manifest"""
+        res = ts_ingest(self.dump, self.ts_path, threads=2)
+        self.assertEqual(len(res["ingested"]), 3)
+        self.assertEqual(res["skipped"], [])
+        hour_dir = path.join(self.ts_path, "2013", "2013_11", "2013_11_12",
+                             "2013_11_12_20")
+        self.assertEqual(sorted(os.listdir(hour_dir)), [
+            "BVZ0001-Cam01~fullres-orig_2013_11_12_20_53_09_{:02d}.JPG"
+            .format(n) for n in range(3)])
+        # Bursts keep the order of their source file names
+        src, dst = res["ingested"][0]
+        self.assertEqual(path.basename(src), "IMG_0000.JPG")
+        self.assertTrue(dst.endswith("_00.JPG"))
+        self.assertTrue(path.samefile(src, dst))
+        manifest = ts_get_manifest(self.ts_path)
+        self.assertEqual(manifest["name"], "BVZ0001-Cam01~fullres-orig")
+        self.assertEqual(manifest["extension"], "JPG")
+        self.assertEqual(manifest["start_datetime"], EXIF_TIME)
+        self.assertEqual(manifest["end_datetime"], EXIF_TIME)
+
+    def test_ingest_repeat(self):
+        """Test re-running ts_ingest adds only new images"""
+        ts_ingest(self.dump, self.ts_path, mode="copy", threads=2)
+        with open(path.join(self.dump, "IMG_0003.JPG"), "wb") as ofh:
+            with open(helpers.FILES["basic_jpg"], "rb") as ifh:
+                ofh.write(ifh.read() + b"\0")
+        res = ts_ingest(self.dump, self.ts_path, threads=2)
+        self.assertEqual(len(res["existing"]), 3)
+        self.assertEqual(len(res["ingested"]), 1)
+        self.assertTrue(res["ingested"][0][1].endswith("_03.JPG"))
+
+    def test_ingest_no_exif(self):
+        """Test ts_ingest skips, or uses mtimes of, images without EXIF"""
+        noexif = path.join(self.dump, "IMG_0009.JPG")
+        with open(noexif, "wb") as ofh:
+            ofh.write(b"no exif here")
+        os.utime(noexif, (1400000000, 1400000000))
+        res = ts_ingest(self.dump, self.ts_path, threads=2)
+        self.assertEqual(res["skipped"], [noexif])
+        res = ts_ingest(self.dump, self.ts_path, threads=2, use_mtime=True)
+        self.assertEqual([x[0] for x in res["ingested"]], [noexif])
+        manifest = ts_get_manifest(self.ts_path)
+        self.assertEqual(manifest["end_datetime"],
+                         dt.datetime.fromtimestamp(1400000000))
+
+    def test_ingest_missing(self):
+        """Test ts_ingest lists missing timepoints, and keeps the list up to
+        date as gaps are filled"""
+        dump = path.join(self.tmpdir, "mtimes")
+        os.mkdir(dump)
+        start = 1400000000 - 1400000000 % 300
+
+        def add(minute):
+            img = path.join(dump, "IMG_{:04d}.JPG".format(minute))
+            with open(img, "wb") as ofh:
+                ofh.write(b"no exif, minute {:d}".format(minute))
+            os.utime(img, (start + minute * 60, start + minute * 60))
+
+        for minute in (0, 5, 15, 20):
+            add(minute)
+        ts_ingest(dump, self.ts_path, threads=2, use_mtime=True)
+        manifest = ts_get_manifest(self.ts_path)
+        gap = dt.datetime.fromtimestamp(start + 600)
+        self.assertEqual(manifest["interval"], 5)
+        self.assertEqual(manifest["missing"],
+                         [gap.strftime("%Y_%m_%d_%H_%M_%S")])
+        add(10)
+        ts_ingest(dump, self.ts_path, threads=2, use_mtime=True)
+        self.assertEqual(ts_get_manifest(self.ts_path)["missing"], [])
+
+    def test_ingest_bad_ext(self):
+        """Test ts_ingest won't change a timestream's extension"""
+        ts_ingest(self.dump, self.ts_path, threads=2)
+        ts_ingest(self.dump, self.ts_path, ext="jpg", threads=2)
+        with self.assertRaises(ValueError):
+            ts_ingest(self.dump, self.ts_path, ext="png", threads=2)
@@ -0,0 +1,75 @@
+import datetime as dt
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+import netCDF4 as ncdf
+
+from timestream.manipulate.netcdf import (
+    TSNC_TIME_CHUNK,
+    ts_rechunk_tsnc,
+    ts_to_tsnc,
+    tsnc_chunks,
+)
+from timestream.parse import (
+    ts_imread,
+    ts_iter_images,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+class TestTsnc(TestCase):
+
+    """Tests for timestream.manipulate.netcdf"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts_path = path.join(self.tmpdir, "SYN01-Cam01~fullres-orig")
+        ts_make_synthetic(self.ts_path, dt.datetime(2014, 1, 1, 10),
+                          dt.datetime(2014, 1, 1, 13), interval=5,
+                          ext="png", shape=(40, 72, 3))
+        self.imgs = sorted(ts_iter_images(self.ts_path))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_chunks(self):
+        """Test tsnc_chunks layouts are clipped to the array shape"""
+        shape = (10, 40, 72, 3)
+        self.assertEqual(tsnc_chunks("frame", shape), [1, 40, 72, 3])
+        self.assertEqual(tsnc_chunks("time", shape), [10, 40, 64, 3])
+        self.assertEqual(tsnc_chunks((4, 8, 8, 1), shape), [4, 8, 8, 1])
+        with self.assertRaises(ValueError):
+            tsnc_chunks("pixel", shape)
+
+    def _check(self, tsnc, chunks):
+        root = ncdf.Dataset(tsnc)
+        try:
+            pixels = root.variables["pixel"]
+            self.assertEqual(pixels.chunking(), chunks)
+            self.assertEqual(pixels.shape, (37, 40, 72, 3))
+            self.assertEqual(len(root.variables["time"]), 37)
+            self.assertTrue((pixels[36] == ts_imread(self.imgs[36])).all())
+            self.assertTrue((pixels[:, 5, 7, 1] ==
+                             [ts_imread(x)[5, 7, 1] for x in self.imgs]).all())
+        finally:
+            root.close()
+
+    def test_to_tsnc_time_major(self):
+        """Test ts_to_tsnc with time-major chunks"""
+        tsnc = path.join(self.tmpdir, "time.tsnc")
+        ts_to_tsnc(self.ts_path, tsnc, layout=(16, 16, 16, 3))
+        self._check(tsnc, [16, 16, 16, 3])
+
+    def test_rechunk(self):
+        """Test ts_rechunk_tsnc in small blocks"""
+        frame = path.join(self.tmpdir, "frame.tsnc")
+        tsnc = path.join(self.tmpdir, "time.tsnc")
+        ts_to_tsnc(self.ts_path, frame)
+        self._check(frame, [1, 40, 72, 3])
+        chunks = ts_rechunk_tsnc(frame, tsnc, max_memory=0)
+        self.assertEqual(chunks, [TSNC_TIME_CHUNK, 40, 64, 3])
+        self._check(tsnc, chunks)
@@ -0,0 +1,96 @@
+import datetime as dt
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from timestream.manipulate.pots import (
+    ts_extract_pots,
+    ts_load_pots,
+)
+from timestream.parse import (
+    ts_get_index,
+    ts_index_invalidate,
+)
+from timestream.util.layouts import (
+    tray_pot_rois,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+class TestExtractPots(TestCase):
+
+    """Tests for timestream.manipulate.pots"""
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts_path = path.join(self.tmpdir, "SYN01-Cam01~fullres-orig")
+        self.out = path.join(self.tmpdir, "pots")
+        ts_make_synthetic(self.ts_path, dt.datetime(2014, 1, 1, 10),
+                          dt.datetime(2014, 1, 1, 12), interval=30,
+                          ext="png", shape=(64, 96, 3))
+        self.imgs = ts_get_index(self.ts_path)["paths"]
+        # Each frame's pixels are its frame number, so crops can be checked
+        for t, img in enumerate(self.imgs):
+            mat = np.full((64, 96, 3), t, dtype="u1")
+            mat[:, :48] += 100
+            cv2.imwrite(img, mat)
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def test_extract_pots(self):
+        """Test ts_extract_pots writes per-pot time series"""
+        rois = tray_pot_rois({1: (0, 0, 96, 60)}, cols=4, rows=5)
+        meta = ts_extract_pots(self.ts_path, self.out, rois, procs=2)
+        self.assertEqual(meta["valid"], [True] * 5)
+        meta, pots = ts_load_pots(self.out)
+        self.assertEqual(len(pots), 20)
+        self.assertEqual(meta["times"][1], dt.datetime(2014, 1, 1, 10, 30))
+        self.assertEqual(meta["pots"]["1B2"]["chamber_index"], 7)
+        stack = pots["1A1"]
+        self.assertIsInstance(stack, np.memmap)
+        self.assertEqual(stack.shape, (5, 12, 24, 3))
+        self.assertEqual(list(stack[:, 0, 0, 0]), [100, 101, 102, 103, 104])
+        self.assertEqual(list(pots["1D5"][:, -1, -1, 2]), [0, 1, 2, 3, 4])
+
+    def test_extract_pots_scaled(self):
+        """Test ts_extract_pots with a range and scaled decoding"""
+        rois = {"1A1": (48, 0, 48, 64)}
+        meta = ts_extract_pots(self.ts_path, self.out, rois,
+                               start=dt.datetime(2014, 1, 1, 11), scale=2,
+                               procs=2)
+        self.assertEqual(len(meta["times"]), 3)
+        meta, pots = ts_load_pots(self.out)
+        self.assertEqual(pots["1A1"].shape, (3, 32, 24, 3))
+        self.assertEqual(list(pots["1A1"][:, 5, 5, 0]), [2, 3, 4])
+        with self.assertRaises(ValueError):
+            ts_extract_pots(self.ts_path, self.out, {})
+
+    def test_extract_pots_layout(self):
+        """Test chamber indices follow the tray layout, and frames with a pot
+        outside them or that won't decode are invalid and left untouched"""
+        rois = tray_pot_rois({1: (0, 0, 96, 60)}, cols=3, rows=2)
+        meta = ts_extract_pots(self.ts_path, self.out, rois, procs=2,
+                               cols=3, rows=2)
+        self.assertEqual(meta["tray_shape"], [3, 2])
+        self.assertEqual(meta["pots"]["1B2"]["chamber_index"], 4)
+        self.assertEqual(sorted(x["chamber_index"]
+                                for x in meta["pots"].values()),
+                         list(range(1, 7)))
+        # The first frame won't decode, and the second is too small for 1C2
+        with open(self.imgs[0], "wb") as ofh:
+            ofh.write(b"not a png")
+        cv2.imwrite(self.imgs[1], np.full((40, 96, 3), 7, dtype="u1"))
+        meta = ts_extract_pots(self.ts_path, self.out, rois, procs=2,
+                               cols=3, rows=2)
+        self.assertEqual(meta["valid"], [False, False, True, True, True])
+        meta, pots = ts_load_pots(self.out)
+        self.assertEqual(list(pots["1A1"][:2, 0, 0, 0]), [0, 0])
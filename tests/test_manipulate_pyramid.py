@@ -0,0 +1,89 @@
+import datetime as dt
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase, skip, skipIf, skipUnless
+
+from timestream.manipulate.pyramid import (
+    ts_make_pyramid,
+    ts_pyramid_name,
+)
+from timestream.parse import (
+    all_files_with_ext,
+    ts_get_manifest,
+    ts_imread,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+class TestMakePyramid(TestCase):
+
+    """Tests for timestream.manipulate.pyramid.ts_make_pyramid"""
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = path.join(self.tmpdir, "SYN01-Cam01~fullres-orig")
+        self.out = path.join(self.tmpdir, "derived")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_pyramid_name(self):
+        self.assertEqual(
+            ts_pyramid_name("BVZ0022-GC05L-CN650D-Cam07~fullres-orig", 720,
+                            "JPG"),
+            "BVZ0022-GC05L-CN650D-Cam07~720-jpg")
+
+    def test_make_pyramid_incremental(self):
+        start = dt.datetime(2014, 1, 1, 0)
+        ts_make_synthetic(self.src, start, dt.datetime(2014, 1, 1, 2),
+                          interval=30, shape=(64, 128, 3))
+        levels = [(32, "jpg"), (16, "png")]
+        res = ts_make_pyramid(self.src, self.out, levels, procs=2)
+        jpg_ts = path.join(self.out, "SYN01-Cam01~32-jpg")
+        png_ts = path.join(self.out, "SYN01-Cam01~16-png")
+        self.assertDictEqual(res, {jpg_ts: 5, png_ts: 5})
+        imgs = sorted(all_files_with_ext(png_ts, "png"))
+        self.assertEqual(len(imgs), 5)
+        self.assertEqual(ts_imread(imgs[0]).shape, (8, 16, 3))
+        manifest = ts_get_manifest(jpg_ts)
+        self.assertEqual(manifest["name"], "SYN01-Cam01~32-jpg")
+        self.assertEqual(manifest["end_datetime"], dt.datetime(2014, 1, 1, 2))
+        # Nothing to do when up to date
+        res = ts_make_pyramid(self.src, self.out, levels, procs=2)
+        self.assertDictEqual(res, {jpg_ts: 0, png_ts: 0})
+        # Only new images are made
+        ts_make_synthetic(self.src, start, dt.datetime(2014, 1, 1, 3),
+                          interval=30, shape=(64, 128, 3))
+        res = ts_make_pyramid(self.src, self.out, levels, procs=2)
+        self.assertDictEqual(res, {jpg_ts: 2, png_ts: 2})
+        manifest = ts_get_manifest(png_ts)
+        self.assertEqual(manifest["end_datetime"], dt.datetime(2014, 1, 1, 3))
+
+    def test_make_pyramid_corrupt_first(self):
+        ts_make_synthetic(self.src, dt.datetime(2014, 1, 1, 0),
+                          dt.datetime(2014, 1, 1, 2), interval=30,
+                          shape=(64, 128, 3))
+        imgs = sorted(all_files_with_ext(self.src, "jpg"))
+        with open(imgs[0], "wb") as ofh:
+            ofh.write(b"not an image")
+        res = ts_make_pyramid(self.src, self.out, [(32, "jpg")], procs=2)
+        jpg_ts = path.join(self.out, "SYN01-Cam01~32-jpg")
+        self.assertDictEqual(res, {jpg_ts: 5})
+        self.assertEqual(len(list(all_files_with_ext(jpg_ts, "jpg"))), 4)
+        # Nothing can be read at all
+        for img in imgs[1:]:
+            with open(img, "wb") as ofh:
+                ofh.write(b"not an image")
+        with self.assertRaises(ValueError):
+            ts_make_pyramid(self.src, path.join(self.tmpdir, "other"),
+                            [(32, "jpg")], procs=2)
+
+    def test_bad_levels(self):
+        with self.assertRaises(ValueError):
+            ts_make_pyramid(self.src, self.out, [])
+        with self.assertRaises(ValueError):
+            ts_make_pyramid(self.src, self.out, [(32, "gif")])
@@ -0,0 +1,129 @@
+import datetime as dt
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from timestream.manipulate.netcdf import (
+    ncdf,
+    ts_to_tsnc,
+)
+from timestream.manipulate.shard import (
+    ts_load_shard_plan,
+    ts_merge_shards,
+    ts_plan_shards,
+    ts_run_shard,
+    ts_run_shards_local,
+    ts_shard_output,
+)
+from timestream.manipulate.stats import (
+    ts_frame_stats,
+)
+from timestream.parse import (
+    ts_get_index,
+    ts_index_invalidate,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+class TestShard(TestCase):
+
+    """Tests for timestream.manipulate.shard"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts_path = path.join(self.tmpdir, "SYN01-Cam01~fullres-orig")
+        self.shard_dir = path.join(self.tmpdir, "shards")
+        ts_make_synthetic(self.ts_path, dt.datetime(2014, 1, 1, 0),
+                          dt.datetime(2014, 1, 1, 5, 45), interval=15,
+                          shape=(32, 48, 3), burst=2)
+        self.index = ts_get_index(self.ts_path)
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def test_plan(self):
+        """Test shards cover the stream in order, balanced, without
+        splitting bursts"""
+        plan = ts_plan_shards(self.ts_path, self.shard_dir, 5)
+        self.assertEqual(plan, ts_load_shard_plan(self.shard_dir))
+        shards = plan["shards"]
+        self.assertEqual([x["index"] for x in shards], list(range(5)))
+        self.assertEqual(sum(x["images"] for x in shards),
+                         len(self.index["paths"]))
+        counts = [x["images"] for x in shards]
+        self.assertLessEqual(max(counts) - min(counts), 2)
+        self.assertTrue(all(x % 2 == 0 for x in counts))
+        self.assertTrue(all(a["end"] < b["start"]
+                            for a, b in zip(shards, shards[1:])))
+        # By bytes, a shard of large images holds fewer of them
+        with open(self.index["paths"][0], "ab") as ofh:
+            ofh.write(b"\0" * 100000)
+        plan = ts_plan_shards(self.ts_path, self.shard_dir, 4,
+                              balance="bytes")
+        shards = plan["shards"]
+        self.assertEqual(shards[0]["images"], 2)
+        self.assertEqual(sum(x["bytes"] for x in shards),
+                         sum(path.getsize(x) for x in self.index["paths"]))
+        # Never more shards than timepoints
+        plan = ts_plan_shards(self.ts_path, self.shard_dir, 100,
+                              end=dt.datetime(2014, 1, 1, 0, 45))
+        self.assertEqual(len(plan["shards"]), 4)
+        with self.assertRaises(ValueError):
+            ts_plan_shards(self.ts_path, self.shard_dir, 2, balance="nope")
+
+    def test_frame_stats(self):
+        """Test shards of frame statistics run in separate processes merge
+        to the same table as an unsharded run"""
+        ts_plan_shards(self.ts_path, self.shard_dir, 3)
+        with self.assertRaises(IOError):
+            ts_merge_shards(self.shard_dir, "frame_stats",
+                            path.join(self.tmpdir, "merged.csv"))
+        outs = ts_run_shards_local(self.shard_dir, "frame_stats", procs=2)
+        self.assertTrue(all(path.isfile(x) for x in outs))
+        expect = ts_frame_stats(self.ts_path, procs=2,
+                                table=path.join(self.tmpdir, "whole.csv"))
+        merged = path.join(self.tmpdir, "merged.csv")
+        ts_merge_shards(self.shard_dir, "frame_stats", merged)
+        with open(merged) as ifh:
+            got = ifh.read()
+        with open(path.join(self.tmpdir, "whole.csv")) as ifh:
+            self.assertEqual(got, ifh.read())
+
+    def test_tsnc(self):
+        """Test netCDF slices of each shard concatenate to the whole
+        stream"""
+        ts_plan_shards(self.ts_path, self.shard_dir, 2)
+        for index in range(2):
+            ts_run_shard(self.shard_dir, index, "tsnc")
+        self.assertTrue(path.isfile(ts_shard_output(self.shard_dir, "tsnc",
+                                                    1)))
+        merged = path.join(self.tmpdir, "merged.tsnc")
+        whole = path.join(self.tmpdir, "whole.tsnc")
+        ts_merge_shards(self.shard_dir, "tsnc", merged)
+        ts_to_tsnc(self.ts_path, whole)
+        got = ncdf.Dataset(merged, "r")
+        expect = ncdf.Dataset(whole, "r")
+        try:
+            self.assertEqual(got.variables["pixel"].shape,
+                             expect.variables["pixel"].shape)
+            # Each file is in ts_iter_images order, so compare by time
+            got_times = got.variables["time"][:]
+            expect_times = expect.variables["time"][:]
+            # Shards are concatenated in order
+            self.assertLess(got_times[:24].max(), got_times[24:].min())
+            np.testing.assert_array_equal(np.sort(got_times),
+                                          np.sort(expect_times))
+            got_order = np.argsort(got_times, kind="mergesort")
+            expect_order = np.argsort(expect_times, kind="mergesort")
+            np.testing.assert_array_equal(
+                got.variables["pixel"][:][got_order],
+                expect.variables["pixel"][:][expect_order])
+        finally:
+            got.close()
+            expect.close()
@@ -0,0 +1,127 @@
+import datetime as dt
+import os
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from timestream.manipulate.splice import (
+    ts_extract_range,
+    ts_merge,
+)
+from timestream.parse import (
+    all_files_with_ext,
+    ts_get_manifest,
+    ts_index_invalidate,
+)
+from timestream.util import (
+    instrument,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+NAME = "SYN01-Cam01~fullres-orig"
+
+
+class TestExtractRange(TestCase):
+
+    """Tests for timestream.manipulate.splice.ts_extract_range"""
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = path.join(self.tmpdir, NAME)
+        self.out = path.join(self.tmpdir, "SYN01-Cam01~fullres-window")
+        ts_make_synthetic(self.src, dt.datetime(2014, 1, 1, 0),
+                          dt.datetime(2014, 1, 3, 23, 30), interval=30,
+                          gaps=[(dt.datetime(2014, 1, 2, 12, 30),
+                                 dt.datetime(2014, 1, 2, 13))])
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def test_extract(self):
+        """Test ts_extract_range links a window and writes its manifest"""
+        instrument.reset()
+        instrument.enable(True)
+        try:
+            info = ts_extract_range(self.src, self.out,
+                                    "2014_01_02_10_00_00",
+                                    dt.datetime(2014, 1, 2, 15), threads=2)
+            listed = instrument.get_stats()["counters"]["listdir.calls"]
+        finally:
+            instrument.enable(False)
+        # The manifest lookup, then root, year, month, one day and its
+        # in-range hour directories
+        self.assertEqual(listed, 1 + 4 + 6)
+        self.assertEqual(info["name"], "SYN01-Cam01~fullres-window")
+        self.assertEqual(info["start_datetime"], dt.datetime(2014, 1, 2, 10))
+        self.assertEqual(info["end_datetime"], dt.datetime(2014, 1, 2, 15))
+        self.assertEqual(info["missing"], ["2014_01_02_12_30_00",
+                                           "2014_01_02_13_00_00"])
+        imgs = sorted(all_files_with_ext(self.out, "JPG"))
+        self.assertEqual(len(imgs), 9)
+        self.assertTrue(path.basename(imgs[0]).startswith(
+            "SYN01-Cam01~fullres-window_2014_01_02_10_00_00"))
+        self.assertEqual(os.stat(imgs[0]).st_nlink, 2)
+        manifest = ts_get_manifest(self.out)
+        self.assertEqual(manifest["missing"], info["missing"])
+        self.assertEqual(manifest["interval"], 30)
+
+    def test_extract_bad(self):
+        """Test ts_extract_range with an empty range or existing output"""
+        with self.assertRaises(ValueError):
+            ts_extract_range(self.src, self.out, dt.datetime(2015, 1, 1))
+        with self.assertRaises(ValueError):
+            ts_extract_range(self.src, self.tmpdir)
+
+
+class TestMerge(TestCase):
+
+    """Tests for timestream.manipulate.splice.ts_merge"""
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.first = path.join(self.tmpdir, "a", NAME)
+        self.second = path.join(self.tmpdir, "b", NAME)
+        self.out = path.join(self.tmpdir, "merged", NAME)
+        # A camera swap at 11:00, the new camera's first image clashing with
+        # the old one's last
+        ts_make_synthetic(self.first, dt.datetime(2014, 1, 1, 10),
+                          dt.datetime(2014, 1, 1, 11), interval=15, seed=1)
+        ts_make_synthetic(self.second, dt.datetime(2014, 1, 1, 11),
+                          dt.datetime(2014, 1, 1, 13), interval=15, seed=2,
+                          mode="tiny", shape=(8, 8, 3))
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def test_merge(self):
+        """Test ts_merge combines streams, renumbering clashing images"""
+        info = ts_merge([self.first, self.second], self.out, threads=2)
+        self.assertEqual(info["name"], NAME)
+        self.assertEqual(info["start_datetime"], dt.datetime(2014, 1, 1, 10))
+        self.assertEqual(info["end_datetime"], dt.datetime(2014, 1, 1, 13))
+        self.assertEqual(info["missing"], [])
+        imgs = sorted(path.basename(x) for x in
+                      all_files_with_ext(self.out, "JPG"))
+        self.assertEqual(len(imgs), 14)
+        self.assertIn(NAME + "_2014_01_01_11_00_00_01.JPG", imgs)
+
+    def test_merge_duplicates(self):
+        """Test ts_merge drops identical images"""
+        info = ts_merge([self.first, self.first], self.out, threads=2)
+        self.assertEqual(len(list(all_files_with_ext(self.out, "JPG"))), 5)
+        self.assertEqual(info["end_datetime"], dt.datetime(2014, 1, 1, 11))
+
+    def test_merge_mismatch(self):
+        """Test ts_merge refuses streams with different names"""
+        other = path.join(self.tmpdir, "SYN02-Cam01~fullres-orig")
+        ts_make_synthetic(other, dt.datetime(2014, 1, 1, 10),
+                          dt.datetime(2014, 1, 1, 11))
+        with self.assertRaises(ValueError):
+            ts_merge([self.first, other], self.out)
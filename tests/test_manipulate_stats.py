@@ -0,0 +1,108 @@
+import datetime as dt
+import multiprocessing
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from timestream.manipulate.stats import (
+    FRAME_STATS_FILENAME,
+    HIST_BINS,
+    ts_filter_frames,
+    ts_frame_stats,
+    ts_read_frame_stats,
+)
+from timestream.parse import (
+    ts_get_index,
+    ts_index_invalidate,
+)
+from timestream.util import (
+    instrument,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+class TestFrameStats(TestCase):
+
+    """Tests for timestream.manipulate.stats"""
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts_path = path.join(self.tmpdir, "SYN01-Cam01~fullres-orig")
+        ts_make_synthetic(self.ts_path, dt.datetime(2014, 1, 1, 10),
+                          dt.datetime(2014, 1, 1, 11), interval=15,
+                          shape=(64, 64, 3))
+        self.imgs = ts_get_index(self.ts_path)["paths"]
+        # A night frame, a sharp checkerboard and that board blurred
+        cv2.imwrite(self.imgs[0], np.zeros((64, 64, 3), dtype="u1"))
+        board = np.kron([[0, 255] * 4, [255, 0] * 4] * 4,
+                        np.ones((8, 8))).astype("u1")
+        cv2.imwrite(self.imgs[1], cv2.merge([board] * 3))
+        cv2.imwrite(self.imgs[2],
+                    cv2.GaussianBlur(cv2.merge([board] * 3), (15, 15), 5))
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def test_frame_stats(self):
+        """Test ts_frame_stats computes and stores statistics"""
+        rows = ts_frame_stats(self.ts_path, scale=1, procs=2)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]["time"], dt.datetime(2014, 1, 1, 10))
+        self.assertEqual(rows[0]["brightness"], 0)
+        self.assertEqual(rows[0]["sharpness"], 0)
+        self.assertGreater(rows[1]["sharpness"], rows[2]["sharpness"])
+        self.assertAlmostEqual(rows[1]["brightness"], 127.5, delta=2)
+        stored = ts_read_frame_stats(self.ts_path)
+        self.assertEqual([x["image"] for x in stored],
+                         [x["image"] for x in rows])
+        self.assertAlmostEqual(stored[1]["sharpness"], rows[1]["sharpness"],
+                               delta=rows[1]["sharpness"] * 1e-5)
+
+    def test_frame_stats_incremental(self):
+        """Test ts_frame_stats only decodes new images, unless the
+        statistics change"""
+        ts_frame_stats(self.ts_path, procs=2)
+        instrument.reset()
+        instrument.enable(True)
+        try:
+            ts_frame_stats(self.ts_path, procs=2)
+            self.assertNotIn("decode.images",
+                             instrument.get_stats()["counters"])
+        finally:
+            instrument.enable(False)
+        rows = ts_frame_stats(self.ts_path, ["histogram"], procs=2)
+        self.assertEqual(len(rows[0]), 4 + 3 * HIST_BINS)
+        self.assertEqual(rows[0]["hist_b0"], 1.0)
+        with open(path.join(self.ts_path, FRAME_STATS_FILENAME)) as ifh:
+            self.assertTrue(ifh.readline().startswith(
+                "time,n,image,scale,hist_b0"))
+        # No pool workers are left behind
+        self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_frame_stats_scale(self):
+        """Test ts_frame_stats remakes the table at a different scale"""
+        rows = ts_frame_stats(self.ts_path, scale=8, procs=2)
+        self.assertEqual(set(row["scale"] for row in rows), set([8]))
+        sharp = rows[1]["sharpness"]
+        rows = ts_frame_stats(self.ts_path, scale=1, procs=2)
+        self.assertEqual(set(row["scale"] for row in rows), set([1]))
+        self.assertNotAlmostEqual(rows[1]["sharpness"], sharp)
+        self.assertEqual(ts_read_frame_stats(self.ts_path)[1]["scale"], 1)
+
+    def test_filter_frames(self):
+        """Test ts_filter_frames drops dark frames"""
+        rows = ts_frame_stats(self.ts_path, procs=2)
+        rows[2]["brightness"] = None
+        kept = ts_filter_frames(rows, brightness=(10, None))
+        self.assertEqual([x["n"] for x in kept], [0, 0, 0])
+        self.assertEqual([x["time"].minute for x in kept], [15, 45, 0])
+        with self.assertRaises(ValueError):
+            ts_frame_stats(self.ts_path, ["nonsense"])
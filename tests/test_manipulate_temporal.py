@@ -0,0 +1,158 @@
+import datetime as dt
+import glob
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from timestream.manipulate.temporal import (
+    RunningMinMax,
+    RunningMoments,
+    WindowedMedian,
+    ts_iter_reduced,
+    ts_reduce,
+    ts_reduced_name,
+)
+from timestream.parse import (
+    ts_get_index,
+    ts_get_manifest,
+    ts_index_invalidate,
+    ts_iter_images,
+    ts_iter_numpy,
+    ts_parse_date_path,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+class TestReducers(TestCase):
+
+    """Tests for the reducers of timestream.manipulate.temporal"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.frames = rng.randint(0, 256, size=(9, 12, 17, 3)).astype("u1")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _reduce(self, reducer, frames):
+        for frame in frames:
+            reducer.update(frame)
+        try:
+            return reducer.result()
+        finally:
+            reducer.close()
+
+    def test_moments(self):
+        """Test running moments over tiles match numpy"""
+        result = self._reduce(RunningMoments(tile=5), self.frames)
+        np.testing.assert_allclose(result["mean"], self.frames.mean(axis=0),
+                                   rtol=1e-5)
+        np.testing.assert_allclose(result["var"], self.frames.var(axis=0),
+                                   rtol=1e-4)
+        np.testing.assert_allclose(result["std"], self.frames.std(axis=0),
+                                   rtol=1e-4)
+        with self.assertRaises(ValueError):
+            RunningMoments().result()
+        reducer = RunningMoments()
+        reducer.update(self.frames[0])
+        with self.assertRaises(ValueError):
+            reducer.update(self.frames[0, :5])
+
+    def test_minmax(self):
+        """Test running minima and maxima of greyscale frames"""
+        grey = self.frames[:, :, :, 0]
+        result = self._reduce(RunningMinMax(tile=4), grey)
+        np.testing.assert_array_equal(result["min"], grey.min(axis=0))
+        np.testing.assert_array_equal(result["max"], grey.max(axis=0))
+        self.assertEqual(result["min"].dtype, grey.dtype)
+
+    def test_median(self):
+        """Test the median is exact within max_frames, and of evenly spaced
+        frames beyond, with its scratch file removed"""
+        reducer = WindowedMedian(tile=5, max_frames=10, tmpdir=self.tmpdir)
+        result = self._reduce(reducer, self.frames)
+        np.testing.assert_array_equal(result["median"],
+                                      np.median(self.frames, axis=0))
+        self.assertEqual(glob.glob(path.join(self.tmpdir, "*")), [])
+        # Frames 0, 4 and 8 are kept of 10 with room for 4
+        frames = [np.full((3, 4), x, "u1") for x in range(10)]
+        reducer = WindowedMedian(max_frames=4, tmpdir=self.tmpdir)
+        result = self._reduce(reducer, frames)
+        self.assertEqual(reducer.kept, 3)
+        self.assertTrue((result["median"] == 4).all())
+        with self.assertRaises(ValueError):
+            WindowedMedian(max_frames=5)
+
+
+class TestTemporal(TestCase):
+
+    """Tests for reducing timestreams with timestream.manipulate.temporal"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts_path = path.join(self.tmpdir, "SYN01-Cam01~fullres-orig")
+        ts_make_synthetic(self.ts_path, dt.datetime(2014, 1, 1, 12),
+                          dt.datetime(2014, 1, 3, 11), interval=60,
+                          ext="png", gaps=[(dt.datetime(2014, 1, 2, 0),
+                                            dt.datetime(2014, 1, 2, 23))])
+        # Each image's pixels are its hour
+        for img in ts_get_index(self.ts_path)["paths"]:
+            cv2.imwrite(img, np.full((24, 32, 3), ts_parse_date_path(img).hour,
+                                     "u1"))
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def test_iter_reduced(self):
+        """Test frames are reduced over daily windows, or all together"""
+        imgs = ts_get_index(self.ts_path)["paths"]
+        frames = ((img, cv2.imread(img)) for img in imgs)
+        windows = list(ts_iter_reduced(frames, ["mean", "min", "median"],
+                                       window=dt.timedelta(days=1), tile=10))
+        self.assertEqual([x[0] for x in windows],
+                         [dt.datetime(2014, 1, 1), dt.datetime(2014, 1, 3)])
+        first = windows[0][1]
+        self.assertEqual(sorted(first), ["mean", "median", "min"])
+        self.assertTrue(np.allclose(first["mean"], 17.5))
+        self.assertTrue((first["min"] == 12).all())
+        self.assertTrue((windows[1][1]["median"] == 5.5).all())
+        # All together, straight from ts_iter_numpy
+        frames = ts_iter_numpy(sorted(ts_iter_images(self.ts_path)))
+        windows = list(ts_iter_reduced(frames, ["max"]))
+        self.assertEqual(len(windows), 1)
+        self.assertEqual(windows[0][0], dt.datetime(2014, 1, 1, 12))
+        self.assertTrue((windows[0][1]["max"] == 23).all())
+        with self.assertRaises(ValueError):
+            list(ts_iter_reduced(iter([]), ["nonesuch"]))
+        with self.assertRaises(ValueError):
+            list(ts_iter_reduced(((img, cv2.imread(img))
+                                  for img in imgs[::-1]), ["mean"], 86400))
+
+    def test_reduce(self):
+        """Test reductions are written as derived timestreams"""
+        out_root = path.join(self.tmpdir, "derived")
+        written = ts_reduce(self.ts_path, out_root, ["median", "max"],
+                            threads=2)
+        median_path = path.join(out_root, ts_reduced_name(
+            "SYN01-Cam01~fullres-orig", "median", "png"))
+        self.assertEqual(path.basename(median_path),
+                         "SYN01-Cam01~median-png")
+        self.assertEqual(written[median_path], 2)
+        info = ts_get_manifest(median_path)
+        self.assertEqual(info["interval"], 24 * 60)
+        self.assertEqual(info["missing"], ["2014_01_02_00_00_00"])
+        imgs = sorted(ts_iter_images(median_path))
+        self.assertEqual(len(imgs), 2)
+        mat = cv2.imread(imgs[0])
+        self.assertEqual(mat.shape, (24, 32, 3))
+        self.assertTrue((mat == 18).all())
+        with self.assertRaises(ValueError):
+            ts_reduce(self.ts_path, out_root, ["var"])
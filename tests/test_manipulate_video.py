@@ -0,0 +1,100 @@
+import datetime as dt
+import multiprocessing
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+import cv2
+
+from timestream.manipulate.video import (
+    VIDEO_TIMESTAMP_FMT,
+    ts_to_video,
+)
+from timestream.parse import (
+    ts_get_index,
+    ts_index_invalidate,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+class TestToVideo(TestCase):
+
+    """Tests for timestream.manipulate.video.ts_to_video"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts_path = path.join(self.tmpdir, "SYN01-Cam01~fullres-orig")
+        self.video = path.join(self.tmpdir, "timelapse.avi")
+        ts_make_synthetic(self.ts_path, dt.datetime(2014, 1, 1, 0),
+                          dt.datetime(2014, 1, 2, 23, 45), interval=15,
+                          shape=(96, 128, 3),
+                          gaps=[(dt.datetime(2014, 1, 2, 11, 30),
+                                 dt.datetime(2014, 1, 2, 12, 30))])
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def _read_video(self):
+        cap = cv2.VideoCapture(self.video)
+        frames = []
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+        cap.release()
+        return frames
+
+    def test_video_all_images(self):
+        """Test ts_to_video writes every image, resized and stamped"""
+        n = ts_to_video(self.ts_path, self.video, fps=10, width=64,
+                        timestamp=VIDEO_TIMESTAMP_FMT, fourcc="MJPG",
+                        start=dt.datetime(2014, 1, 1, 6),
+                        end=dt.datetime(2014, 1, 1, 12), procs=2)
+        self.assertEqual(n, 25)
+        frames = self._read_video()
+        self.assertEqual(len(frames), 25)
+        self.assertEqual(frames[0].shape, (48, 64, 3))
+        # No pool workers are left behind
+        self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_video_resampled(self):
+        """Test ts_to_video resamples daily, filling missing frames"""
+        n = ts_to_video(self.ts_path, self.video, fourcc="MJPG",
+                        times_of_day=[dt.time(6), dt.time(12)],
+                        tolerance=dt.timedelta(minutes=10),
+                        crop=(32, 16, 64, 48), procs=2)
+        self.assertEqual(n, 3)
+        n = ts_to_video(self.ts_path, self.video, fourcc="MJPG",
+                        times_of_day=[dt.time(6), dt.time(12)],
+                        tolerance=dt.timedelta(minutes=10),
+                        crop=(32, 16, 64, 48), fill_missing=True, procs=2)
+        self.assertEqual(n, 4)
+        self.assertEqual(self._read_video()[0].shape, (48, 64, 3))
+
+    def test_video_bad(self):
+        """Test ts_to_video with a bad crop or no images"""
+        with self.assertRaises(ValueError):
+            ts_to_video(self.ts_path, self.video, crop=(0, 0, 10))
+        with self.assertRaises(ValueError):
+            ts_to_video(self.ts_path, self.video, crop=(-1, 0, 64, 48))
+        # Region runs past the right edge of the 128x96 images
+        with self.assertRaises(ValueError):
+            ts_to_video(self.ts_path, self.video, crop=(100, 0, 64, 48))
+        with self.assertRaises(ValueError):
+            ts_to_video(self.ts_path, self.video,
+                        start=dt.datetime(2015, 1, 1))
+
+    def test_video_corrupt_first(self):
+        """Test ts_to_video sizes frames from the first readable image"""
+        index = ts_get_index(self.ts_path)
+        with open(index["paths"][0], "wb") as ofh:
+            ofh.write(b"not an image")
+        n = ts_to_video(self.ts_path, self.video, fourcc="MJPG",
+                        end=dt.datetime(2014, 1, 1, 1), procs=2)
+        self.assertEqual(n, 4)
+        self.assertEqual(self._read_video()[0].shape, (96, 128, 3))
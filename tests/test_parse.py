@@ -5,8 +5,12 @@ from inspect import (
 import json
 import os
 from os import path
+import shutil
+import tempfile
 from unittest import TestCase, skip, skipIf, skipUnless
 
+import cv2
+
 from tests import helpers
 from timestream.parse import (
     _ts_has_manifest,
@@ -18,6 +22,22 @@ from timestream.parse import (
     ts_parse_date,
     ts_parse_date_path,
     ts_format_date,
+    ts_get_manifest,
+    ts_num_timepoints,
+    ts_image_size,
+    ts_imread,
+    ts_parse_n_path,
+    ts_get_index,
+    ts_index_invalidate,
+    ts_iter_resampled,
+    ts_get_nearest_image,
+    ts_get_nearest_images,
+    ts_iter_bursts,
+    ts_iter_hour_dirs,
+    ts_read_burst,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
 )
 
 
@@ -246,3 +266,194 @@ class TestParseDate(TestCase):
         date_str = "2013_12_11"
         with self.assertRaises(ValueError):
             ts_parse_date(date_str)
+
+
+class TestNumTimepoints(TestCase):
+
+    """Test function timestream.parse.ts_num_timepoints"""
+
+    def test_num_timepoints(self):
+        ts_info = ts_get_manifest(helpers.FILES["timestream_manifold"])
+        self.assertEqual(ts_num_timepoints(ts_info), 7)
+        ts_info["missing"] = ["2013_10_30_03_30_00"]
+        self.assertEqual(ts_num_timepoints(ts_info), 6)
+
+
+class TestImread(TestCase):
+
+    """Test function timestream.parse.ts_imread"""
+
+    def test_imread_scales(self):
+        img = helpers.TS_MANIFOLD_FILES_JPG[0]
+        full = ts_imread(img)
+        for scale in (2, 3, 8):
+            res = ts_imread(img, scale)
+            self.assertEqual(res.shape[2], 3)
+            self.assertAlmostEqual(res.shape[1], full.shape[1] / scale,
+                                   delta=1)
+
+    def test_image_size(self):
+        """Test ts_image_size reads JPEG and PNG headers"""
+        img = helpers.TS_MANIFOLD_FILES_JPG[0]
+        full = ts_imread(img)
+        self.assertEqual(ts_image_size(img), (full.shape[1], full.shape[0]))
+        tmpdir = tempfile.mkdtemp()
+        try:
+            png = path.join(tmpdir, "a.png")
+            cv2.imwrite(png, full[:30, :40])
+            self.assertEqual(ts_image_size(png), (40, 30))
+            bad = path.join(tmpdir, "bad.jpg")
+            with open(bad, "wb") as ofh:
+                ofh.write(b"not an image")
+            self.assertIsNone(ts_image_size(bad))
+            self.assertIsNone(ts_image_size(path.join(tmpdir, "none.jpg")))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_parse_n_path(self):
+        self.assertEqual(ts_parse_n_path(helpers.TS_MANIFOLD_FILES_JPG[0]), 0)
+        self.assertEqual(ts_parse_n_path("a_2013_10_30_03_00_00_42.JPG"), 42)
+
+
+class TestResample(TestCase):
+
+    """Tests for the time index and timestream.parse.ts_iter_resampled"""
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts = path.join(self.tmpdir, "SYN01-Cam01~tiny-orig")
+        # Every 5 minutes for two days, a few seconds late, with a gap
+        start = dt.datetime(2014, 1, 1, 0, 0, 7)
+        end = dt.datetime(2014, 1, 2, 23, 59)
+        gap = (dt.datetime(2014, 1, 2, 11), dt.datetime(2014, 1, 2, 13))
+        ts_make_synthetic(self.ts, start, end, mode="empty", gaps=[gap])
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_index(self):
+        index = ts_get_index(self.ts)
+        self.assertEqual(len(index["times"]), 2 * 288 - 24)
+        self.assertEqual(index["times"], sorted(index["times"]))
+        self.assertTrue(index["paths"][0].endswith(
+            "_2014_01_01_00_00_07_00.JPG"))
+        self.assertIs(ts_get_index(self.ts), index)
+        self.assertIsNot(ts_get_index(self.ts, refresh=True), index)
+
+    def test_resample_interval(self):
+        res = list(ts_iter_resampled(self.ts, dt.timedelta(hours=1)))
+        # midnight at the end is within tolerance of the last image
+        self.assertEqual(len(res), 49)
+        self.assertEqual(ts_parse_date_path(res[-1][1]),
+                         dt.datetime(2014, 1, 2, 23, 55, 7))
+        self.assertEqual(res[0][0], dt.datetime(2014, 1, 1, 0))
+        self.assertEqual(ts_parse_date_path(res[0][1]),
+                         dt.datetime(2014, 1, 1, 0, 0, 7))
+        # hours in the gap have nothing within half an hour
+        self.assertEqual(res[36], (dt.datetime(2014, 1, 2, 12), None))
+        self.assertIsNotNone(res[35][1])
+
+    def test_resample_times_of_day(self):
+        res = list(ts_iter_resampled(self.ts,
+                                     times_of_day=[dt.time(12), dt.time(6)],
+                                     tolerance=dt.timedelta(minutes=10)))
+        self.assertListEqual([x[0] for x in res], [
+            dt.datetime(2014, 1, 1, 6), dt.datetime(2014, 1, 1, 12),
+            dt.datetime(2014, 1, 2, 6), dt.datetime(2014, 1, 2, 12),
+        ])
+        self.assertEqual(ts_parse_date_path(res[1][1]),
+                         dt.datetime(2014, 1, 1, 12, 0, 7))
+        self.assertIsNone(res[3][1])
+        res = list(ts_iter_resampled(self.ts, times_of_day=[dt.time(12)],
+                                     start=dt.datetime(2014, 1, 2)))
+        self.assertEqual(len(res), 1)
+
+    def test_resample_bad_params(self):
+        with self.assertRaises(ValueError):
+            list(ts_iter_resampled(self.ts))
+        with self.assertRaises(TypeError):
+            list(ts_iter_resampled(self.ts, interval=60))
+        with self.assertRaises(ValueError):
+            list(ts_iter_resampled(self.ts, interval=dt.timedelta(0)))
+        with self.assertRaises(ValueError):
+            list(ts_iter_resampled(self.ts, interval=dt.timedelta(hours=-1)))
+        with self.assertRaises(ValueError):
+            list(ts_iter_resampled(self.ts, times_of_day=[]))
+
+
+class TestNearestImage(TestCase):
+
+    """Tests for timestream.parse.ts_get_nearest_image(s)"""
+
+    def tearDown(self):
+        ts_index_invalidate()
+
+    def test_nearest_image(self):
+        ts = helpers.FILES["timestream_manifold"]
+        img, offset = ts_get_nearest_image(ts, "2013_10_30_03_29_50")
+        self.assertEqual(img, helpers.TS_MANIFOLD_FILES_JPG[1])
+        self.assertEqual(offset, dt.timedelta(seconds=10))
+        img, offset = ts_get_nearest_image(ts, dt.datetime(2013, 10, 30, 4,
+                                                           1))
+        self.assertEqual(img, helpers.TS_MANIFOLD_FILES_JPG[2])
+        self.assertEqual(offset, dt.timedelta(seconds=-60))
+        res = ts_get_nearest_image(ts, "2013_10_30_04_10_00")
+        self.assertEqual(res, (None, None))
+        res = ts_get_nearest_image(ts, "2013_10_30_04_10_00",
+                                   tolerance=dt.timedelta(minutes=15))
+        self.assertEqual(res[0], helpers.TS_MANIFOLD_FILES_JPG[2])
+        with self.assertRaises(TypeError):
+            ts_get_nearest_image(ts, "2013_10_30_04_10_00", tolerance="1m")
+
+    def test_nearest_images(self):
+        ts = helpers.FILES["timestream_manifold"]
+        dates = [ts_parse_date(x) + dt.timedelta(seconds=5)
+                 for x in helpers.TS_MANIFOLD_DATES]
+        dates.append(dt.datetime(2000, 1, 1))
+        res = ts_get_nearest_images(ts, dates, tolerance=5)
+        self.assertListEqual([x[0] for x in res],
+                             helpers.TS_MANIFOLD_FILES_JPG + [None])
+
+
+class TestBursts(TestCase):
+
+    """Tests for timestream.parse.ts_iter_bursts and friends"""
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts = path.join(self.tmpdir, "SYN01-Cam01~tiny-orig")
+        ts_make_synthetic(self.ts, dt.datetime(2014, 1, 1, 22),
+                          dt.datetime(2014, 1, 2, 2), interval=30, burst=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_iter_hour_dirs(self):
+        res = list(ts_iter_hour_dirs(self.ts))
+        self.assertEqual(len(res), 5)
+        self.assertTrue(res[0].endswith(path.join("2014_01_01",
+                                                  "2014_01_01_22")))
+        res = list(ts_iter_hour_dirs(self.ts, start="2014_01_01_23_30_00",
+                                     end=dt.datetime(2014, 1, 2, 0, 10)))
+        self.assertEqual([path.basename(x) for x in res],
+                         ["2014_01_01_23", "2014_01_02_00"])
+
+    def test_iter_bursts(self):
+        res = list(ts_iter_bursts(self.ts))
+        self.assertEqual(len(res), 9)
+        time, imgs = res[0]
+        self.assertEqual(time, dt.datetime(2014, 1, 1, 22))
+        self.assertEqual([ts_parse_n_path(x) for x in imgs], [0, 1, 2])
+        res = list(ts_iter_bursts(self.ts, start=dt.datetime(2014, 1, 1, 23),
+                                  end=dt.datetime(2014, 1, 2, 0)))
+        self.assertEqual([x[0].hour for x in res], [23, 23, 0])
+
+    def test_read_burst(self):
+        time, imgs = next(ts_iter_bursts(self.ts))
+        res = ts_read_burst(imgs)
+        self.assertEqual(res.shape, (3, 48, 64, 3))
+        res = ts_read_burst(imgs, scale=2)
+        self.assertEqual(res.shape, (3, 24, 32, 3))
@@ -0,0 +1,69 @@
+import datetime as dt
+from unittest import TestCase, skip, skipIf, skipUnless
+
+from tests import helpers
+try:
+    from timestream.parse import aio
+except ImportError:
+    aio = None
+from timestream.parse import (
+    ts_index_invalidate,
+)
+
+
+@skipIf(aio is None, "Test requires asyncio or trollius")
+class TestAsyncIO(TestCase):
+
+    """Tests for timestream.parse.aio"""
+    maxDiff = None
+
+    def setUp(self):
+        self.loop = aio.asyncio.new_event_loop()
+        self.ts = helpers.FILES["timestream_manifold"]
+
+    def tearDown(self):
+        self.loop.close()
+        ts_index_invalidate()
+
+    def run_loop(self, fut):
+        return self.loop.run_until_complete(fut)
+
+    def test_get_manifest(self):
+        res = self.run_loop(aio.ts_aio_get_manifest(self.ts, loop=self.loop))
+        self.assertEqual(res["extension"], "JPG")
+
+    def test_list_range(self):
+        fut = aio.ts_aio_list_range(self.ts, loop=self.loop)
+        res = self.run_loop(fut)
+        self.assertListEqual([x[1] for x in res],
+                             helpers.TS_MANIFOLD_FILES_JPG)
+        fut = aio.ts_aio_list_range(self.ts, "2013_10_30_03_30_00",
+                                    dt.datetime(2013, 10, 30, 4, 0),
+                                    loop=self.loop)
+        res = self.run_loop(fut)
+        self.assertListEqual([x[1] for x in res],
+                             helpers.TS_MANIFOLD_FILES_JPG[1:3])
+        fut = aio.ts_aio_list_range(self.ts, "2014_01_01_00_00_00",
+                                    loop=self.loop)
+        self.assertListEqual(self.run_loop(fut), [])
+
+    def test_list_range_error(self):
+        fut = aio.ts_aio_list_range(helpers.FILES["not_a_timestream"],
+                                    loop=self.loop)
+        with self.assertRaises(Exception):
+            self.run_loop(fut)
+
+    def test_nearest_and_read(self):
+        aio.ts_aio_set_concurrency(4)
+        fut = aio.ts_aio_get_nearest_image(self.ts, "2013_10_30_04_00_10",
+                                           loop=self.loop)
+        img, offset = self.run_loop(fut)
+        self.assertEqual(img, helpers.TS_MANIFOLD_FILES_JPG[2])
+        imgs = helpers.TS_MANIFOLD_FILES_JPG[:3]
+        res = self.run_loop(aio.ts_aio_read_many(imgs, loop=self.loop))
+        with open(imgs[1], "rb") as fh:
+            self.assertEqual(res[1], fh.read())
+        self.assertEqual(self.run_loop(aio.ts_aio_read_many(
+            [], loop=self.loop)), [])
+        with self.assertRaises(ValueError):
+            aio.ts_aio_set_concurrency(0)
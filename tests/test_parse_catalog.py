@@ -0,0 +1,107 @@
+import datetime as dt
+import json
+import os
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase, skip, skipIf, skipUnless
+
+from tests import helpers
+from timestream.parse import (
+    ts_parse_name,
+)
+from timestream.parse.catalog import (
+    ts_catalog_load,
+    ts_catalog_query,
+    ts_catalog_update,
+    ts_find_timestreams,
+)
+
+
+class TestParseName(TestCase):
+
+    """Test function timestream.parse.ts_parse_name"""
+
+    def test_parse_name_full(self):
+        res = ts_parse_name("BVZ0022-GC05L-CN650D-Cam07~fullres-orig")
+        self.assertDictEqual(res, {
+            "name": "BVZ0022-GC05L-CN650D-Cam07~fullres-orig",
+            "experiment": "BVZ0022",
+            "camera": "Cam07",
+            "resolution": "fullres-orig",
+        })
+
+    def test_parse_name_bare(self):
+        res = ts_parse_name("nomanifold")
+        self.assertEqual(res["experiment"], "nomanifold")
+        self.assertIsNone(res["camera"])
+        self.assertIsNone(res["resolution"])
+        with self.assertRaises(TypeError):
+            ts_parse_name(None)
+
+
+class TestCatalog(TestCase):
+
+    """Tests for timestream.parse.catalog"""
+    _multiprocess_can_split_ = True
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.catalog = path.join(self.tmpdir, "catalog.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_find_timestreams(self):
+        root = path.join(helpers.TESTS_DIR, "data", "timestreams")
+        res = ts_find_timestreams(root)
+        expt = sorted([
+            helpers.FILES["timestream_manifold"],
+            helpers.FILES["timestream_nomanifold"],
+            helpers.FILES["timestream_bad"],
+        ])
+        self.assertListEqual(res, expt)
+
+    def test_update_and_query(self):
+        root = path.join(helpers.TESTS_DIR, "data", "timestreams")
+        cat = ts_catalog_update(root, self.catalog)
+        self.assertIn("BVZ0022-GC05L-CN650D-Cam07~fullres-orig",
+                      cat["timestreams"])
+        entry = cat["timestreams"]["BVZ0022-GC05L-CN650D-Cam07~fullres-orig"]
+        self.assertEqual(entry["camera"], "Cam07")
+        self.assertEqual(entry["extension"], "JPG")
+        self.assertEqual(entry["start_datetime"], "2013_10_30_03_00_00")
+        self.assertEqual(entry["end_datetime"], "2013_10_30_06_00_00")
+        # the catalog is persisted
+        self.assertDictEqual(ts_catalog_load(self.catalog), cat)
+        res = ts_catalog_query(cat, name="BVZ0022-*~fullres-orig")
+        self.assertEqual(len(res), 1)
+        res = ts_catalog_query(cat, start=dt.datetime(2013, 10, 30, 5),
+                               end="2013_10_30_05_30_00")
+        self.assertEqual(len(res), 3)
+        res = ts_catalog_query(cat, start=dt.datetime(2014, 1, 1))
+        self.assertListEqual(res, [])
+
+    def test_update_refreshes_changed(self):
+        times = [dt.datetime(2014, 1, 1, h) for h in range(4)]
+        ts = helpers.make_timestream(self.tmpdir, "EXP01-Cam01~720-jpg",
+                                     times)
+        cat = ts_catalog_update(self.tmpdir, self.catalog)
+        entry = cat["timestreams"]["EXP01-Cam01~720-jpg"]
+        self.assertEqual(entry["end_datetime"], "2014_01_01_03_00_00")
+        # unchanged streams are not re-read
+        entry["end_datetime"] = "sentinel"
+        with open(self.catalog, "w") as fh:
+            json.dump(cat, fh)
+        cat = ts_catalog_update(self.tmpdir, self.catalog)
+        entry = cat["timestreams"]["EXP01-Cam01~720-jpg"]
+        self.assertEqual(entry["end_datetime"], "sentinel")
+        # but changed ones are
+        later = dt.datetime(2015, 1, 1)
+        helpers.make_timestream(self.tmpdir, "EXP01-Cam01~720-jpg", [later])
+        mtime = os.stat(ts).st_mtime + 10
+        os.utime(ts, (mtime, mtime))
+        cat = ts_catalog_update(self.tmpdir, self.catalog)
+        entry = cat["timestreams"]["EXP01-Cam01~720-jpg"]
+        self.assertEqual(entry["end_datetime"], "2015_01_01_00_00_00")
@@ -0,0 +1,106 @@
+import datetime as dt
+import hashlib
+import os
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from timestream.parse import (
+    all_files_with_ext,
+)
+from timestream.parse.checksum import (
+    ts_checksum_manifest_path,
+    ts_hash_file,
+    ts_read_checksums,
+    ts_verify_checksums,
+    ts_write_checksums,
+)
+from timestream.util import (
+    instrument,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+class TestChecksums(TestCase):
+
+    """Tests for timestream.parse.checksum"""
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts_path = path.join(self.tmpdir, "SYN01-Cam01~fullres-orig")
+        ts_make_synthetic(self.ts_path, dt.datetime(2014, 1, 1, 10),
+                          dt.datetime(2014, 1, 1, 11), interval=15)
+        self.imgs = sorted(path.relpath(x, self.ts_path) for x in
+                           all_files_with_ext(self.ts_path, "JPG"))
+        instrument.reset()
+        instrument.enable(True)
+
+    def tearDown(self):
+        instrument.enable(False)
+        shutil.rmtree(self.tmpdir)
+
+    def test_hash_file(self):
+        """Test ts_hash_file matches hashlib, with small reads"""
+        img = path.join(self.ts_path, self.imgs[0])
+        with open(img, "rb") as ifh:
+            expect = hashlib.sha256(ifh.read()).hexdigest()
+        self.assertEqual(ts_hash_file(img, bufsize=7), expect)
+        with self.assertRaises(ValueError):
+            ts_hash_file(img, "crc32")
+
+    def test_write_incremental(self):
+        """Test ts_write_checksums only re-hashes changed images"""
+        res = ts_write_checksums(self.ts_path, threads=2)
+        self.assertEqual(res["hashed"], self.imgs)
+        manifest = ts_read_checksums(ts_checksum_manifest_path(self.ts_path))
+        self.assertEqual(sorted(manifest), self.imgs)
+        with open(ts_checksum_manifest_path(self.ts_path)) as ifh:
+            line = ifh.readline()
+        self.assertEqual(line, "{}  {}\n".format(manifest[self.imgs[0]],
+                                                 self.imgs[0]))
+        os.unlink(path.join(self.ts_path, self.imgs[0]))
+        with open(path.join(self.ts_path, self.imgs[1]), "ab") as ofh:
+            ofh.write(b"\0")
+        res = ts_write_checksums(self.ts_path, threads=2)
+        self.assertEqual(res["hashed"], [self.imgs[1]])
+        self.assertEqual(res["removed"], [self.imgs[0]])
+        self.assertEqual(res["unchanged"], self.imgs[2:])
+
+    def test_verify(self):
+        """Test ts_verify_checksums finds missing, extra and corrupt images"""
+        with self.assertRaises(ValueError):
+            ts_verify_checksums(self.ts_path)
+        ts_write_checksums(self.ts_path, threads=2)
+        res = ts_verify_checksums(self.ts_path, threads=2)
+        self.assertEqual(res["verified"], self.imgs)
+        self.assertEqual(res["corrupt"], [])
+        # Nothing changed, so nothing was re-hashed
+        self.assertEqual(instrument.get_stats()["counters"]["checksum.files"],
+                         len(self.imgs))
+        os.unlink(path.join(self.ts_path, self.imgs[0]))
+        shutil.copy(path.join(self.ts_path, self.imgs[1]),
+                    path.join(self.ts_path, self.imgs[1] + ".JPG"))
+        with open(path.join(self.ts_path, self.imgs[2]), "r+b") as ofh:
+            ofh.write(b"\xff\xd8\x00")
+        res = ts_verify_checksums(self.ts_path, threads=2)
+        self.assertEqual(res["missing"], [self.imgs[0]])
+        self.assertEqual(res["extra"], [self.imgs[1] + ".JPG"])
+        self.assertEqual(res["corrupt"], [self.imgs[2]])
+        self.assertEqual(res["verified"], [self.imgs[1]] + self.imgs[3:])
+
+    def test_verify_full(self):
+        """Test full verification finds corruption that kept its mtime"""
+        img = path.join(self.ts_path, self.imgs[0])
+        os.utime(img, (1400000000, 1400000000))
+        ts_write_checksums(self.ts_path, threads=2)
+        with open(img, "r+b") as ofh:
+            ofh.seek(10)
+            ofh.write(b"Z")
+        os.utime(img, (1400000000, 1400000000))
+        self.assertEqual(ts_verify_checksums(self.ts_path)["corrupt"], [])
+        self.assertEqual(ts_verify_checksums(self.ts_path, full=True)
+                         ["corrupt"], [self.imgs[0]])
@@ -0,0 +1,86 @@
+from os import path
+import shutil
+import struct
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from timestream.parse import (
+    ts_iter_numpy,
+)
+from timestream.parse.raw import (
+    ts_imread_raw,
+    ts_raw_preview_bytes,
+)
+
+
+def _ifd(entries, next_ifd):
+    """A little-endian TIFF directory of single-valued LONG or SHORT tags"""
+    data = struct.pack("<H", len(entries))
+    for tag, typ, value in sorted(entries):
+        fmt = "<HHIH2x" if typ == 3 else "<HHII"
+        data += struct.pack(fmt, tag, typ, 1, value)
+    return data + struct.pack("<I", next_ifd)
+
+
+def make_cr2(fname, preview, thumb, raw):
+    """Write a CR2-like file: IFD0 holds the full-size preview as a JPEG
+    strip, its sub-IFD a thumbnail, and IFD1 the raw data"""
+    ifd0, sub, ifd1 = 16, 100, 200
+    data_start = 300
+    pos = [data_start, data_start + len(preview),
+           data_start + len(preview) + len(thumb)]
+    out = b"II*\x00" + struct.pack("<I", ifd0) + b"CR\x02\x00\x00\x00\x00\x00"
+    blocks = [
+        (ifd0, _ifd([(0x0103, 3, 6), (0x0111, 4, pos[0]),
+                     (0x0117, 4, len(preview)), (0x014A, 4, sub)], ifd1)),
+        (sub, _ifd([(0x0201, 4, pos[1]), (0x0202, 4, len(thumb))], 0)),
+        (ifd1, _ifd([(0x0103, 3, 6), (0x0111, 4, pos[2]),
+                     (0x0117, 4, len(raw))], 0)),
+        (data_start, preview + thumb + raw),
+    ]
+    for offset, block in blocks:
+        out += b"\x00" * (offset - len(out)) + block
+    with open(fname, "wb") as ofh:
+        ofh.write(out)
+
+
+class TestRawPreview(TestCase):
+
+    """Tests for timestream.parse.raw"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.img = path.join(self.tmpdir, "IMG_0001.CR2")
+        self.mat = np.zeros((48, 64, 3), dtype="u1")
+        self.mat[:, 32:] = (0, 0, 255)
+        self.preview = cv2.imencode(".jpg", self.mat)[1].tostring()
+        thumb = cv2.imencode(".jpg", self.mat[::4, ::4])[1].tostring()
+        # Lossless JPEG, as raw sensor data is stored, can't be a preview
+        raw = b"\xff\xd8\xff\xc3\x00\x02" + b"\x00" * 4096
+        make_cr2(self.img, self.preview, thumb, raw)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_preview_bytes(self):
+        """Test ts_raw_preview_bytes finds the full-size preview"""
+        self.assertEqual(ts_raw_preview_bytes(self.img), self.preview)
+        notraw = path.join(self.tmpdir, "notraw.CR2")
+        with open(notraw, "wb") as ofh:
+            ofh.write(b"\x00" * 64)
+        self.assertIsNone(ts_raw_preview_bytes(notraw))
+
+    def test_imread_preview(self):
+        """Test ts_imread_raw and ts_iter_numpy in preview mode"""
+        mat = ts_imread_raw(self.img)
+        self.assertEqual(mat.shape, (48, 64, 3))
+        self.assertEqual(mat.dtype, np.uint8)
+        self.assertGreater(mat[24, 60, 2], 200)
+        img, mat = next(ts_iter_numpy([self.img], raw_mode="preview"))
+        self.assertEqual(img, self.img)
+        self.assertEqual(mat.shape, (48, 64, 3))
+        with self.assertRaises(ValueError):
+            ts_imread_raw(self.img, "quarter")
@@ -0,0 +1,80 @@
+import datetime as dt
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from timestream.parse import (
+    ts_index_invalidate,
+    ts_parse_date_path,
+)
+from timestream.parse.sync import (
+    ts_iter_synced,
+    ts_sync_times,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+class TestSync(TestCase):
+
+    """Tests for timestream.parse.sync"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cam1 = path.join(self.tmpdir, "SYN01-Cam01~fullres-orig")
+        self.cam2 = path.join(self.tmpdir, "SYN01-Cam02~fullres-orig")
+        # Cam02 runs 30s behind Cam01, and is down for an hour
+        ts_make_synthetic(self.cam1, dt.datetime(2014, 1, 1, 0),
+                          dt.datetime(2014, 1, 1, 5, 45), interval=15,
+                          shape=(24, 32, 3))
+        ts_make_synthetic(self.cam2, dt.datetime(2014, 1, 1, 0, 0, 30),
+                          dt.datetime(2014, 1, 1, 5, 45, 30), interval=15,
+                          shape=(24, 32, 3),
+                          gaps=[(dt.datetime(2014, 1, 1, 2),
+                                 dt.datetime(2014, 1, 1, 2, 50))])
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def test_sync_times(self):
+        """Test frames are grouped within the tolerance"""
+        groups = list(ts_sync_times([self.cam1, self.cam2], tolerance=60))
+        self.assertEqual(len(groups), 24)
+        time, imgs = groups[0]
+        self.assertEqual(time, dt.datetime(2014, 1, 1, 0))
+        self.assertEqual(sorted(imgs), [path.basename(self.cam1),
+                                        path.basename(self.cam2)])
+        self.assertEqual(ts_parse_date_path(imgs[path.basename(self.cam2)]),
+                         dt.datetime(2014, 1, 1, 0, 0, 30))
+        self.assertEqual(sum(len(x[1]) == 1 for x in groups), 4)
+        # Too tight a tolerance never groups them
+        groups = list(ts_sync_times({"a": self.cam1, "b": self.cam2},
+                                    tolerance=10))
+        self.assertEqual(len(groups), 44)
+        self.assertTrue(all(len(x[1]) == 1 for x in groups))
+
+    def test_sync_complete(self):
+        """Test complete groups only, in a time range"""
+        groups = list(ts_sync_times({"a": self.cam1, "b": self.cam2},
+                                    tolerance=60, complete=True,
+                                    end=dt.datetime(2014, 1, 1, 3)))
+        self.assertEqual(len(groups), 8)
+        self.assertTrue(all(sorted(x[1]) == ["a", "b"] for x in groups))
+
+    def test_iter_synced_decode(self):
+        """Test decoded frames are prefetched in order"""
+        paths = list(ts_iter_synced({"a": self.cam1, "b": self.cam2},
+                                    tolerance=60))
+        decoded = list(ts_iter_synced({"a": self.cam1, "b": self.cam2},
+                                      tolerance=60, decode=True, scale=2,
+                                      prefetch=3))
+        self.assertEqual([x[0] for x in paths], [x[0] for x in decoded])
+        for (_, imgs), (_, frames) in zip(paths, decoded):
+            self.assertEqual(sorted(imgs), sorted(frames))
+            for frame in frames.values():
+                self.assertEqual(frame.shape, (12, 16, 3))
+        with self.assertRaises(ValueError):
+            list(ts_iter_synced([self.cam1, self.cam1]))
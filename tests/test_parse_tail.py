@@ -0,0 +1,71 @@
+import datetime as dt
+from os import path
+import shutil
+import sys
+import tempfile
+import threading
+from unittest import TestCase, skip, skipIf, skipUnless
+
+from tests import helpers
+from timestream.parse import (
+    ts_get_index,
+    ts_get_manifest,
+    ts_index_invalidate,
+    ts_parse_date_path,
+)
+from timestream.parse.tail import (
+    ts_tail,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+class TestTail(TestCase):
+
+    """Tests for timestream.parse.tail.ts_tail"""
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts = path.join(self.tmpdir, "SYN01-Cam01~tiny-orig")
+        self.start = dt.datetime(2014, 1, 1, 23, 0)
+        ts_make_synthetic(self.ts, self.start, dt.datetime(2014, 1, 1, 23, 50),
+                          interval=10, mode="empty")
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def add_images(self):
+        # crosses into a new day, so new hour and day directories are made
+        new = [dt.datetime(2014, 1, 2, 0, 0), dt.datetime(2014, 1, 2, 0, 10)]
+        helpers.make_timestream(self.tmpdir, "SYN01-Cam01~tiny-orig", new)
+
+    def tail(self, use_inotify):
+        index = ts_get_index(self.ts)
+        timer = threading.Timer(0.2, self.add_images)
+        timer.start()
+        res = list(ts_tail(self.ts, poll_interval=0.05, idle_timeout=0.5,
+                           use_inotify=use_inotify))
+        timer.join()
+        self.assertListEqual([x[0] for x in res], [
+            dt.datetime(2014, 1, 2, 0, 0), dt.datetime(2014, 1, 2, 0, 10)])
+        self.assertEqual(ts_parse_date_path(res[1][1]), res[1][0])
+        # The manifest and index are kept up to date
+        manifest = ts_get_manifest(self.ts)
+        self.assertEqual(manifest["end_datetime"], res[1][0])
+        self.assertEqual(index["times"][-1], res[1][0])
+        self.assertEqual(len(index["times"]), 8)
+
+    def test_tail_polling(self):
+        self.tail(False)
+
+    @skipUnless(sys.platform.startswith("linux"), helpers.SKIP_NEED_LINUX)
+    def test_tail_inotify(self):
+        self.tail(True)
+
+    def test_tail_since(self):
+        res = list(ts_tail(self.ts, since=dt.datetime(2014, 1, 1, 23, 35),
+                           poll_interval=0.01, idle_timeout=0.05))
+        self.assertListEqual([x[0].minute for x in res], [40, 50])
@@ -0,0 +1,118 @@
+import datetime as dt
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from timestream.parse import (
+    _ts_date_to_path,
+    ts_get_manifest,
+    ts_index_invalidate,
+    ts_iter_times,
+)
+from timestream.parse.timeaxis import (
+    ts_coverage,
+    ts_expected_times,
+    ts_gap_runs,
+    ts_presence_mask,
+    ts_relpaths,
+    ts_scan_times,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+class TestTimeAxis(TestCase):
+
+    """Tests for timestream.parse.timeaxis"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts_path = path.join(self.tmpdir, "SYN01-Cam01~fullres-orig")
+        self.gap = (dt.datetime(2014, 1, 2, 3, 0),
+                    dt.datetime(2014, 1, 2, 5, 55))
+        ts_make_synthetic(self.ts_path, dt.datetime(2014, 1, 1, 0),
+                          dt.datetime(2014, 1, 3, 23, 55), interval=5,
+                          mode="empty", gaps=[self.gap], missing_rate=0.05)
+        self.manifest = ts_get_manifest(self.ts_path)
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def test_expected_times(self):
+        """Test ts_expected_times matches ts_iter_times"""
+        expected = ts_expected_times(self.ts_path)
+        self.assertEqual(expected.dtype, np.dtype("M8[s]"))
+        self.assertEqual(expected.astype(object).tolist(),
+                         list(ts_iter_times(self.ts_path)))
+
+    def test_presence_mask(self):
+        """Test the presence mask agrees with the manifest's missing list,
+        from both the index and a directory scan"""
+        expected, present = ts_presence_mask(self.ts_path)
+        missing = set(dt.datetime.strptime(x, "%Y_%m_%d_%H_%M_%S")
+                      for x in self.manifest["missing"])
+        self.assertEqual(set(expected[~present].astype(object).tolist()),
+                         missing)
+        _, scanned = ts_presence_mask(self.ts_path, source="scan")
+        np.testing.assert_array_equal(present, scanned)
+        times, ns = ts_scan_times(self.ts_path)
+        self.assertEqual(len(times), present.sum())
+        self.assertTrue((ns == 0).all())
+        with self.assertRaises(ValueError):
+            ts_presence_mask(self.ts_path, source="nonesuch")
+
+    def test_coverage(self):
+        """Test coverage statistics find the longest gap and daily
+        completeness"""
+        expected, present = ts_presence_mask(self.ts_path)
+        stats = ts_coverage(expected, present)
+        self.assertEqual(stats["expected"], 3 * 288)
+        self.assertEqual(stats["present"], present.sum())
+        self.assertAlmostEqual(stats["coverage"], present.mean())
+        longest = stats["longest_gap"]
+        self.assertGreaterEqual(longest["length"], 36)
+        self.assertLessEqual(longest["start"],
+                             np.datetime64(self.gap[0], "s"))
+        self.assertGreaterEqual(longest["end"],
+                                np.datetime64(self.gap[1], "s"))
+        self.assertEqual(len(stats["days"]), 3)
+        self.assertLess(stats["daily_coverage"][1],
+                        stats["daily_coverage"][0])
+        for day, frac in zip(stats["days"], stats["daily_coverage"]):
+            in_day = expected.astype("M8[D]") == day
+            self.assertAlmostEqual(frac, present[in_day].mean())
+
+    def test_gap_runs(self):
+        """Test ts_gap_runs on a small mask"""
+        starts, lengths = ts_gap_runs([False, True, False, False, True,
+                                       False])
+        self.assertEqual(starts.tolist(), [0, 2, 5])
+        self.assertEqual(lengths.tolist(), [1, 2, 1])
+        starts, lengths = ts_gap_runs([True, True])
+        self.assertEqual(len(starts), 0)
+
+    def test_relpaths(self):
+        """Test bulk relative paths match _ts_date_to_path"""
+        expected = ts_expected_times(self.manifest)
+        chosen = expected[::37]
+        times = chosen.astype(object).tolist()
+        self.assertEqual(ts_relpaths(self.manifest, chosen),
+                         [_ts_date_to_path(self.manifest, t)
+                          for t in times])
+        ns = np.arange(len(chosen)) % 3
+        self.assertEqual(ts_relpaths(self.manifest, chosen, ns),
+                         [_ts_date_to_path(self.manifest, t, n)
+                          for t, n in zip(times, ns)])
+        # Counters of differing widths
+        self.assertEqual(ts_relpaths(self.manifest, chosen[:2], [5, 100]),
+                         [_ts_date_to_path(self.manifest, times[0], 5),
+                          _ts_date_to_path(self.manifest, times[1], 100)])
+        self.assertEqual(ts_relpaths(self.manifest, chosen[:0]), [])
+        img = path.join(self.ts_path, ts_relpaths(self.ts_path,
+                                                  expected[:1])[0])
+        self.assertTrue(path.isfile(img))
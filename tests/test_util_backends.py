@@ -0,0 +1,69 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+from timestream.util import backends
+from timestream.util.backends import (
+    BACKENDS,
+    backend_available,
+    get_backend,
+    lazy_backend,
+    loaded_backends,
+    register_backend,
+)
+
+# Modules the core path and manifest API must not load when imported
+HEAVY_MODULES = ["cv2", "numpy", "exifread", "wand.image", "netCDF4",
+                 "rawpy"]
+
+
+class TestBackends(TestCase):
+
+    """Tests for timestream.util.backends"""
+
+    def tearDown(self):
+        for name in ("test_json", "test_missing"):
+            BACKENDS.pop(name, None)
+            backends._LOADED.pop(name, None)
+
+    def test_lazy_backend(self):
+        """Test backends are imported on first attribute access"""
+        register_backend("test_json", ["json"])
+        mod = lazy_backend("test_json")
+        self.assertNotIn("test_json", loaded_backends())
+        self.assertEqual(mod.dumps([1]), "[1]")
+        self.assertEqual(loaded_backends()["test_json"], "json")
+        self.assertIs(get_backend("test_json"), sys.modules["json"])
+
+    def test_alternatives(self):
+        """Test the first importable alternative module is used"""
+        register_backend("test_json", ["no_such_module_xyz", "json"])
+        self.assertEqual(get_backend("test_json").__name__, "json")
+
+    def test_missing(self):
+        """Test unavailable backends raise a helpful ImportError"""
+        register_backend("test_missing", "no_such_module_xyz",
+                         "the xyz package")
+        self.assertFalse(backend_available("test_missing"))
+        with self.assertRaises(ImportError) as ctx:
+            lazy_backend("test_missing").anything
+        self.assertIn("the xyz package", str(ctx.exception))
+        with self.assertRaises(KeyError):
+            get_backend("test_unregistered")
+        with self.assertRaises(ValueError):
+            register_backend("test_missing", [])
+
+    def test_core_import_is_light(self):
+        """Test importing the core API loads no heavy backends"""
+        script = ("import sys\n"
+                  "import timestream.parse, timestream.parse.catalog\n"
+                  "import timestream.manipulate, timestream.util.imgmeta\n"
+                  "import timestream.manipulate.netcdf\n"
+                  "import timestream.manipulate.temporal\n"
+                  "import timestream.manipulate.pyramid\n"
+                  "import timestream.manipulate.video\n"
+                  "import timestream.manipulate.pots, timestream.webapi\n"
+                  "print(','.join(m for m in {!r} if m in sys.modules))\n"
+                  .format(HEAVY_MODULES))
+        out = subprocess.check_output([sys.executable, "-c", script])
+        self.assertEqual(out.decode("utf-8").strip(), "")
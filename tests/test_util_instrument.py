@@ -0,0 +1,52 @@
+import json
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase, skip, skipIf, skipUnless
+
+from tests import helpers
+from timestream.parse import (
+    ts_get_image,
+    ts_iter_numpy,
+)
+from timestream.util import (
+    instrument,  # module
+)
+
+
+class TestInstrument(TestCase):
+
+    """Tests for timestream.util.instrument"""
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_disabled_by_default(self):
+        instrument.reset()
+        self.assertFalse(instrument.enabled())
+        instrument.incr("test.counter")
+        with instrument.timer("test.timer"):
+            pass
+        self.assertDictEqual(instrument.get_stats(),
+                             {"counters": {}, "timers": {}})
+
+    def test_instrumented_block(self):
+        dump = path.join(self.tmpdir, "stats.json")
+        ts = helpers.FILES["timestream_manifold"]
+        with instrument.instrumented(dump) as stats:
+            self.assertTrue(instrument.enabled())
+            ts_get_image(ts, helpers.TS_MANIFOLD_DATES[0])
+            list(ts_iter_numpy(helpers.TS_MANIFOLD_FILES_JPG[:1]))
+        self.assertFalse(instrument.enabled())
+        self.assertEqual(stats["counters"]["manifest.loads"], 1)
+        self.assertEqual(stats["counters"]["stat.calls"], 1)
+        self.assertEqual(stats["counters"]["decode.images"], 1)
+        self.assertEqual(stats["counters"]["read.bytes"],
+                         path.getsize(helpers.TS_MANIFOLD_FILES_JPG[0]))
+        self.assertEqual(stats["timers"]["manifest.parse"]["calls"], 1)
+        with open(dump) as fh:
+            self.assertDictEqual(json.load(fh), stats)
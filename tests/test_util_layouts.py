@@ -27,3 +27,23 @@ class TestTrayPosToChamberIndex(TestCase):
             layouts.traypos_to_chamber_index("24A")
         with self.assertRaises(ValueError):
             layouts.traypos_to_chamber_index("A2")
+
+
+class TestTrayPotRois(TestCase):
+    _multiprocess_can_split_ = True
+    maxDiff = None
+
+    def test_tray_pot_rois(self):
+        """Tests for ts.util.layouts.tray_pot_rois"""
+        rois = layouts.tray_pot_rois({1: (0, 0, 40, 50), 2: (40, 0, 40, 50)},
+                                     margin=1)
+        self.assertEqual(len(rois), 40)
+        self.assertEqual(list(rois)[:6], ["1A1", "1A2", "1A3", "1A4", "1A5",
+                                          "1B1"])
+        self.assertEqual(rois["1A1"], (1, 1, 8, 8))
+        self.assertEqual(rois["1B2"], (11, 11, 8, 8))
+        self.assertEqual(rois["2D5"], (71, 41, 8, 8))
+        with self.assertRaises(ValueError):
+            layouts.tray_pot_rois({1: (0, 0, 4, 5)}, margin=1)
+        with self.assertRaises(TypeError):
+            layouts.tray_pot_rois([(0, 0, 4, 5)])
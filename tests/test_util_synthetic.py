@@ -0,0 +1,56 @@
+import datetime as dt
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase, skip, skipIf, skipUnless
+
+from timestream.parse import (
+    all_files_with_ext,
+    ts_get_manifest,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+
+
+class TestMakeSynthetic(TestCase):
+
+    """Tests for timestream.util.synthetic.ts_make_synthetic"""
+    _multiprocess_can_split_ = True
+    maxDiff = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts = path.join(self.tmpdir, "SYN01-Cam01~tiny-orig")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_gaps_and_burst(self):
+        start = dt.datetime(2014, 1, 1, 0)
+        end = dt.datetime(2014, 1, 1, 3)
+        gap = (dt.datetime(2014, 1, 1, 1), dt.datetime(2014, 1, 1, 1, 30))
+        res = ts_make_synthetic(self.ts, start, end, interval=30,
+                                mode="empty", burst=2, gaps=[gap])
+        self.assertEqual(res["missing"], ["2014_01_01_01_00_00",
+                                          "2014_01_01_01_30_00"])
+        imgs = sorted(all_files_with_ext(self.ts, "jpg"))
+        # 7 timepoints, 2 missing, 2 images at each
+        self.assertEqual(len(imgs), 10)
+        self.assertTrue(imgs[1].endswith("_2014_01_01_00_00_00_01.JPG"))
+        manifest = ts_get_manifest(self.ts)
+        self.assertEqual(manifest["end_datetime"], end)
+        self.assertEqual(manifest["interval"], 30)
+
+    def test_sparse(self):
+        start = dt.datetime(2014, 1, 1, 0)
+        ts_make_synthetic(self.ts, start, start, mode="sparse", size=12345)
+        img = next(all_files_with_ext(self.ts, "jpg"))
+        self.assertEqual(path.getsize(img), 12345)
+
+    def test_bad_params(self):
+        start = dt.datetime(2014, 1, 1, 0)
+        with self.assertRaises(ValueError):
+            ts_make_synthetic(self.ts, start, start, mode="huge")
+        with self.assertRaises(ValueError):
+            ts_make_synthetic(self.ts, start, start, burst=101)
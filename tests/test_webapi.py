@@ -0,0 +1,186 @@
+import datetime as dt
+import json
+from os import path
+import shutil
+import tempfile
+from unittest import TestCase
+from wsgiref.util import setup_testing_defaults
+
+import cv2
+import numpy as np
+
+from timestream.parse import (
+    ts_index_invalidate,
+)
+from timestream.util import (
+    instrument,
+)
+from timestream.util.synthetic import (
+    ts_make_synthetic,
+)
+from timestream.webapi import (
+    LRUCache,
+    TimestreamApp,
+)
+
+STREAM = "BVZ0001/BVZ0001-Cam01~fullres-orig"
+
+
+class TestLRUCache(TestCase):
+
+    """Tests for timestream.webapi.LRUCache"""
+
+    def test_lru_evicts_oldest(self):
+        """Test LRUCache evicts least recently used values past its size"""
+        cache = LRUCache(40)
+        cache.put("a", b"x" * 10)
+        cache.put("b", b"x" * 10)
+        cache.put("c", b"x" * 10)
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("d", b"x" * 10)
+        cache.put("e", b"x" * 10)
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.nbytes, 40)
+        # Values over a quarter of the cache aren't kept
+        cache.put("f", b"x" * 11)
+        self.assertIsNone(cache.get("f"))
+
+
+class TestTimestreamApp(TestCase):
+
+    """Tests for timestream.webapi.TimestreamApp"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ts_path = path.join(self.tmpdir, STREAM)
+        ts_make_synthetic(self.ts_path, dt.datetime(2014, 1, 1, 0),
+                          dt.datetime(2014, 1, 1, 5, 45), interval=15,
+                          shape=(96, 128, 3))
+        self.app = TimestreamApp(self.tmpdir)
+
+    def tearDown(self):
+        ts_index_invalidate()
+        shutil.rmtree(self.tmpdir)
+
+    def _get(self, url, query="", **headers):
+        environ = {"PATH_INFO": url, "QUERY_STRING": query}
+        for key, val in headers.items():
+            environ["HTTP_" + key.upper()] = val
+        setup_testing_defaults(environ)
+        started = {}
+
+        def start_response(status, headers):
+            started["status"] = int(status.split()[0])
+            started["headers"] = dict(headers)
+        body = b"".join(self.app(environ, start_response))
+        return started["status"], started["headers"], body
+
+    def test_list_and_manifest(self):
+        """Test the stream list and manifest endpoints"""
+        status, headers, body = self._get("/streams")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body.decode("utf-8")),
+                         {"streams": [STREAM]})
+        status, headers, body = self._get("/streams/{}/manifest".format(
+            STREAM))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Type"], "application/json")
+        manifest = json.loads(body.decode("utf-8"))
+        self.assertEqual(manifest["start_datetime"], "2014_01_01_00_00_00")
+        self.assertEqual(manifest["interval"], 15)
+        status, _, _ = self._get("/streams/nonesuch/manifest")
+        self.assertEqual(status, 404)
+
+    def test_index(self):
+        """Test the time index endpoint, with a time range"""
+        status, _, body = self._get("/streams/{}/index".format(STREAM),
+                                    "start=2014_01_01_01_00_00&"
+                                    "end=2014-01-01T02:00:00")
+        self.assertEqual(status, 200)
+        index = json.loads(body.decode("utf-8"))
+        self.assertEqual(len(index["times"]), 5)
+        self.assertEqual(index["times"][0], "2014_01_01_01_00_00")
+        self.assertTrue(path.isfile(path.join(self.ts_path,
+                                              index["images"][0])))
+
+    def test_nearest_image(self):
+        """Test images are served by nearest datetime"""
+        url = "/streams/{}/image/2014-01-01T01:07:00".format(STREAM)
+        status, headers, body = self._get(url)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Type"], "image/jpeg")
+        self.assertEqual(headers["X-Timestream-Offset"], "-420")
+        self.assertIn("2014_01_01_01_00_00",
+                      headers["X-Timestream-Image"])
+        img = path.join(self.ts_path, "2014", "2014_01", "2014_01_01",
+                        "2014_01_01_01", headers["X-Timestream-Image"])
+        with open(img, "rb") as ifh:
+            self.assertEqual(body, ifh.read())
+        status, _, _ = self._get(url, "tolerance=60")
+        self.assertEqual(status, 404)
+        status, _, _ = self._get("/streams/{}/image/yesterday".format(
+            STREAM))
+        self.assertEqual(status, 400)
+
+    def test_thumbnail(self):
+        """Test thumbnails are scaled to the requested width"""
+        url = "/streams/{}/thumb/2014_01_01_03_00_00".format(STREAM)
+        status, headers, body = self._get(url, "width=32")
+        self.assertEqual(status, 200)
+        mat = cv2.imdecode(np.frombuffer(body, dtype="u1"), cv2.IMREAD_COLOR)
+        self.assertEqual(mat.shape, (24, 32, 3))
+        # Later thumbnails of the stream decode each image only once
+        instrument.reset()
+        instrument.enable(True)
+        try:
+            status, _, body = self._get(url.replace("03_00", "04_00"),
+                                        "width=32")
+            self.assertEqual(status, 200)
+            self.assertEqual(
+                instrument.get_stats()["counters"]["decode.images"], 1)
+        finally:
+            instrument.enable(False)
+        status, _, _ = self._get(url, "width=0")
+        self.assertEqual(status, 400)
+
+    def test_conditional(self):
+        """Test ETag and Last-Modified give 304 responses"""
+        url = "/streams/{}/image/2014_01_01_03_00_00".format(STREAM)
+        status, headers, body = self._get(url)
+        status, _, body = self._get(url, if_none_match=headers["ETag"])
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b"")
+        status, _, _ = self._get(url, if_none_match='"other"')
+        self.assertEqual(status, 200)
+        status, _, _ = self._get(url,
+                                 if_modified_since=headers["Last-Modified"])
+        self.assertEqual(status, 304)
+        status, _, _ = self._get(
+            url, if_modified_since="Mon, 01 Jan 2001 00:00:00 GMT")
+        self.assertEqual(status, 200)
+
+    def test_range(self):
+        """Test byte range requests"""
+        url = "/streams/{}/image/2014_01_01_03_00_00".format(STREAM)
+        _, headers, full = self._get(url)
+        self.assertEqual(headers["Accept-Ranges"], "bytes")
+        status, headers, body = self._get(url, range="bytes=10-19")
+        self.assertEqual(status, 206)
+        self.assertEqual(body, full[10:20])
+        self.assertEqual(headers["Content-Range"],
+                         "bytes 10-19/{:d}".format(len(full)))
+        status, _, body = self._get(url, range="bytes=-5")
+        self.assertEqual(body, full[-5:])
+        status, headers, _ = self._get(url, range="bytes=100000-")
+        self.assertEqual(status, 416)
+
+    def test_cached(self):
+        """Test encoded responses are cached"""
+        url = "/streams/{}/thumb/2014_01_01_03_00_00".format(STREAM)
+        self.assertEqual(len(self.app.cache), 0)
+        _, _, first = self._get(url, "width=32")
+        self.assertEqual(len(self.app.cache), 1)
+        _, _, second = self._get(url, "width=32")
+        self.assertEqual(len(self.app.cache), 1)
+        self.assertEqual(first, second)
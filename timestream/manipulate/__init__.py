@@ -1,9 +1,21 @@
+from collections import deque
 from itertools import (
         cycle,
         izip,
         )
+from datetime import datetime
+import json
 import logging
 import multiprocessing
+import os
+import time
+
+from timestream.parse import (
+        ts_filter_duplicates,
+        )
+from timestream.util import (
+        instrument,
+        )
 
 
 NOEOL = logging.INFO+1
@@ -68,21 +80,198 @@ def setup_console_logger():
     log.setLevel(logging.INFO)
 
 
-def ts_parallel_map(ts_iter, func, args, procs=None):
-    """Map ``func(item, *args)`` for each item in ``ts_iter`` in parallel"""
+class ProgressReporter(object):
+    """Track throughput and ETA of a long-running job.
+
+    Progress lines go to the ``CONSOLE`` logger at most every ``interval``
+    seconds, and if ``status_file`` is given, a JSON status document is
+    rewritten there at most every ``status_interval`` seconds, for
+    schedulers and dashboards to poll.
+
+    :param int total: Number of items expected, e.g. from
+                      ``timestream.parse.ts_num_timepoints``. May be ``None``,
+                      in which case no ETA is given.
+    :param str name: Job name, used in messages and the status file.
+    :param float interval: Minimum seconds between terminal updates.
+    :param str status_file: Path to write the JSON status to.
+    :param float status_interval: Minimum seconds between status writes.
+    """
+
+    def __init__(self, total=None, name="job", interval=1.0,
+            status_file=None, status_interval=10.0):
+        self.total = total
+        self.name = name
+        self.interval = interval
+        self.status_file = status_file
+        self.status_interval = status_interval
+        self.done = 0
+        self.nbytes = 0
+        self.queues = {}
+        self.stages = {}
+        self.start = time.time()
+        self._last_log = 0.0
+        self._last_status = 0.0
+        self._log = logging.getLogger("CONSOLE")
+
+    def update(self, count=1, nbytes=0):
+        """Record ``count`` more items done, having read ``nbytes`` bytes"""
+        self.done += count
+        self.nbytes += nbytes
+        now = time.time()
+        if now - self._last_log >= self.interval:
+            self._last_log = now
+            self._log.log(NOEOL, self.message() + "\r")
+        if self.status_file and \
+                now - self._last_status >= self.status_interval:
+            self._last_status = now
+            self.write_status()
+
+    def set_queue(self, name, depth):
+        """Record the current depth of the queue called ``name``"""
+        self.queues[name] = depth
+
+    def add_stage_time(self, stage, seconds):
+        """Add ``seconds`` to the time spent in ``stage``"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def status(self):
+        """Get the current progress as a ``dict``"""
+        elapsed = time.time() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        percent = None
+        if self.total:
+            percent = 100.0 * self.done / self.total
+            if rate > 0:
+                eta = max(0, self.total - self.done) / rate
+        return {
+            "name": self.name,
+            "done": self.done,
+            "total": self.total,
+            "percent": percent,
+            "elapsed": elapsed,
+            "images_per_sec": rate,
+            "mb_per_sec": self.nbytes / elapsed / 1e6 if elapsed > 0 else 0.0,
+            "eta_seconds": eta,
+            "queues": dict(self.queues),
+            "stages": dict(self.stages),
+            "updated": datetime.now().isoformat(),
+        }
+
+    def message(self):
+        """Format the current progress as a one-line message"""
+        st = self.status()
+        if self.total:
+            done = "{:d}/{:d} ({:.1f}%)".format(st["done"], st["total"],
+                    st["percent"])
+        else:
+            done = "{:d}".format(st["done"])
+        msg = "{}: processed {} images, {:.1f} img/s, {:.1f} MB/s".format(
+                self.name, done, st["images_per_sec"], st["mb_per_sec"])
+        if st["queues"]:
+            msg += ", queued " + ", ".join("{}={:d}".format(k, v)
+                    for k, v in sorted(st["queues"].items()))
+        if st["eta_seconds"] is not None:
+            eta = int(st["eta_seconds"])
+            msg += ", ETA {:d}:{:02d}:{:02d}".format(eta // 3600,
+                    eta % 3600 // 60, eta % 60)
+        return msg
+
+    def write_status(self, finished=False):
+        """Atomically write the JSON status to ``status_file``"""
+        if not self.status_file:
+            return
+        st = self.status()
+        st["finished"] = finished
+        tmp = self.status_file + ".tmp"
+        with open(tmp, "w") as ofh:
+            json.dump(st, ofh, indent=2)
+        os.rename(tmp, self.status_file)
+
+    def finish(self):
+        """Log final throughput and write the final status"""
+        self._log.info(self.message() + ". Finished!")
+        if self.stages:
+            self._log.info("{}: time per stage: {}".format(self.name,
+                    ", ".join("{}={:.1f}s".format(k, v)
+                    for k, v in sorted(self.stages.items()))))
+        self.write_status(finished=True)
+
+
+def _bounded_imap(pool, func, items, max_pending):
+    """Like ``pool.imap``, but with at most ``max_pending`` items submitted
+    and not yet consumed"""
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def ts_parallel_map(ts_iter, func, args, procs=None, progress=None,
+                    max_pending=None, skip_duplicates=False):
+    """Map ``func(item, *args)`` for each item in ``ts_iter`` in parallel
+
+    Results are yielded in the order of ``ts_iter``. The pool reads ahead
+    through all of ``ts_iter``, and results wait in memory until consumed,
+    unless ``max_pending`` limits the items in flight, e.g. when results are
+    large and the consumer slow.
+
+    If ``progress`` is a ``ProgressReporter``, it is updated as each result
+    arrives, along with the number of items queued for the pool.
+
+    With ``skip_duplicates``, items must be image paths, and those recorded
+    as duplicate frames by ``timestream.manipulate.dedup.ts_dedup`` are
+    dropped without being mapped. Results then don't line up with
+    ``ts_iter``, so ``func`` should return its image path, and the total of
+    ``progress`` should count only the images kept."""
     log = logging.getLogger("CONSOLE")
+    # Filter here rather than in the pool's feeder thread, which would
+    # swallow the IOError of a timestream without a duplicate table
+    if skip_duplicates:
+        ts_iter = list(ts_filter_duplicates(ts_iter))
     # Setup pool
     if procs == None:
-        procs = int(multiprocessing.cpu_count() * 0.9)
+        procs = max(1, int(multiprocessing.cpu_count() * 0.9))
     pool = multiprocessing.Pool(procs)
     log.debug("Made pool with {:d} processes".format(procs))
     # Setup args
+    submitted = [0]
+    if progress is not None:
+        def counted(items):
+            for item in items:
+                submitted[0] += 1
+                yield item
+        ts_iter = counted(ts_iter)
     func_args = [ts_iter,]
     func_args.extend([cycle(arg) for arg in args])
     func_args = izip(*func_args)
     log.debug("Made argument list")
-    # Run imap
-    for ret in pool.imap(func, func_args):
-        yield ret
-    pool.close()
-    pool.join()
+    # Run imap. The time spent waiting on results covers IPC and any worker
+    # time not overlapped with our consumer. The pool is torn down however
+    # the consumer stops, e.g. by closing the generator early.
+    try:
+        if max_pending is None:
+            results = pool.imap(func, func_args)
+        else:
+            results = _bounded_imap(pool, func, func_args,
+                                    max(1, max_pending))
+        n_done = 0
+        while True:
+            with instrument.timer("parallel_map.wait"):
+                try:
+                    ret = next(results)
+                except StopIteration:
+                    break
+            instrument.incr("parallel_map.items")
+            n_done += 1
+            if progress is not None:
+                progress.set_queue("pool", submitted[0] - n_done)
+                progress.update()
+            yield ret
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
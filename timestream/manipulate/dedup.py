@@ -0,0 +1,186 @@
+"""Find runs of identical or near-identical frames, from stuck cameras and
+paused experiments, so later stages can skip them.
+
+Every image gets an exact content hash, and a perceptual difference hash of
+a reduced-scale decode: 64 bits, one per pair of neighbouring pixels of an
+8x9 greyscale thumbnail, set where brightness increases. Images whose
+content hash, or with ``max_distance``, whose perceptual hash is within
+that many bits, matches the first frame of the current run are duplicates.
+Comparing to the first frame of the run rather than the previous frame
+means slow changes are never lost.
+
+The hashes are kept in a CSV sidecar table, ``dedup.csv`` in the timestream
+root, and later runs only hash images not yet in it. Iterators and
+exporters then skip duplicates with ``skip_duplicates=True``; see
+``timestream.parse.ts_get_duplicates``.
+"""
+import csv
+import logging
+import os
+from os import path
+
+from timestream.manipulate import (
+        ProgressReporter,
+        ts_parallel_map,
+        )
+from timestream.parse import (
+        DEDUP_FILENAME,
+        ts_format_date,
+        ts_get_index,
+        ts_imread,
+        ts_parse_date,
+        )
+from timestream.parse.checksum import (
+        ts_hash_file,
+        )
+from timestream.util.backends import (
+        lazy_backend,
+        )
+
+cv2 = lazy_backend("cv2")
+LOG = logging.getLogger("timestreamlib")
+#: Content hash algorithm, see ``timestream.parse.checksum``
+DEDUP_HASH = "sha1"
+_TABLE_KEYS = ["time", "n", "image", "size", "sha1", "phash",
+               "duplicate_of"]
+
+
+def ts_phash(mat):
+    """Perceptual difference hash of an image.
+
+    :param numpy.ndarray mat: BGR or greyscale image.
+    :returns: str -- 64 bit hash, as 16 hex digits.
+    """
+    if mat.ndim == 3:
+        mat = cv2.cvtColor(mat, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(mat, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return "{:016x}".format(value)
+
+
+def ts_phash_distance(hash1, hash2):
+    """Number of bits differing between two perceptual hashes"""
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count("1")
+
+
+def _image_hashes(args):
+    """Worker: ``(img, scale)`` to ``(content hash, perceptual hash)``, the
+    latter ``""`` if ``img`` can't be decoded."""
+    img, scale = args
+    digest = ts_hash_file(img, DEDUP_HASH)
+    mat = ts_imread(img, scale)
+    if mat is None:
+        LOG.warn("Couldn't decode {}".format(img))
+        return (digest, "")
+    return (digest, ts_phash(mat))
+
+
+def ts_read_dedup(ts_path):
+    """Read the duplicate frame table of ``ts_path``.
+
+    :param str ts_path: Path to the root of a timestream.
+    :returns: list -- One ``dict`` per image, sorted by time then ``n``, with
+              keys ``time`` (a ``datetime``), ``n``, ``image`` (path relative
+              to ``ts_path``), ``size``, ``sha1``, ``phash`` and
+              ``duplicate_of``, the image starting its run of duplicates or
+              ``""``.
+    """
+    table = path.join(ts_path, DEDUP_FILENAME)
+    rows = []
+    if not path.isfile(table):
+        return rows
+    with open(table) as ifh:
+        for row in csv.DictReader(ifh):
+            row["time"] = ts_parse_date(row["time"])
+            row["n"] = int(row["n"])
+            row["size"] = int(row["size"])
+            rows.append(row)
+    return rows
+
+
+def _write_table(ts_path, rows):
+    table = path.join(ts_path, DEDUP_FILENAME)
+    tmp_path = table + ".tmp"
+    with open(tmp_path, "w") as ofh:
+        writer = csv.writer(ofh, lineterminator="\n")
+        writer.writerow(_TABLE_KEYS)
+        for row in rows:
+            writer.writerow([ts_format_date(row["time"])] +
+                            [row[key] for key in _TABLE_KEYS[1:]])
+    os.rename(tmp_path, table)
+
+
+def _mark_duplicates(rows, max_distance):
+    """Set ``duplicate_of`` of each row, comparing it to the first row of
+    the current run with the same ``n``. Returns the number of
+    duplicates."""
+    firsts = {}
+    count = 0
+    for row in rows:
+        row["duplicate_of"] = ""
+        first = firsts.get(row["n"])
+        if first is not None:
+            same = row["sha1"] == first["sha1"]
+            if not same and max_distance is not None and row["phash"] and \
+                    first["phash"]:
+                same = ts_phash_distance(row["phash"], first["phash"]) <= \
+                    max_distance
+            if same:
+                row["duplicate_of"] = first["image"]
+                count += 1
+                continue
+        firsts[row["n"]] = row
+    return count
+
+
+def ts_dedup(ts_path, max_distance=None, scale=8, procs=None,
+             status_file=None):
+    """Hash every image of ``ts_path`` in parallel and record which frames
+    duplicate an earlier one, updating its sidecar table.
+
+    Only images missing from the table, or whose size has changed, are
+    hashed. Duplicates are remarked on every run, so ``max_distance`` may be
+    changed cheaply. Images of a burst are compared to those with the same
+    ``n`` counter.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param int max_distance: Largest number of differing perceptual hash
+                             bits between near-duplicates. ``None`` marks
+                             only identical files.
+    :param int scale: Downscaling factor to decode at, see
+                      ``timestream.parse.ts_imread``.
+    :param int procs: Number of worker processes.
+    :param str status_file: Optional JSON progress status file.
+    :returns: list -- The table, as per ``ts_read_dedup``.
+    """
+    done = dict((row["image"], row) for row in ts_read_dedup(ts_path))
+    index = ts_get_index(ts_path)
+    rows = []
+    todo = []
+    for time, n, img in zip(index["times"], index["n"], index["paths"]):
+        relpath = path.relpath(img, ts_path)
+        size = path.getsize(img)
+        row = done.get(relpath)
+        if row is None or row["size"] != size:
+            row = {"time": time, "n": n, "image": relpath, "size": size}
+            todo.append((img, row))
+        rows.append(row)
+    if todo:
+        LOG.info("Hashing {:d} images".format(len(todo)))
+        progress = ProgressReporter(total=len(todo), name="ts_dedup",
+                                    status_file=status_file)
+        results = ts_parallel_map([img for img, _ in todo], _image_hashes,
+                                  [[scale]], procs=procs, progress=progress)
+        # Consume every result, so the map runs to its end
+        for iii, (digest, phash) in enumerate(results):
+            todo[iii][1]["sha1"] = digest
+            todo[iii][1]["phash"] = phash
+        progress.finish()
+    count = _mark_duplicates(rows, max_distance)
+    LOG.info("{:d} of {:d} images of {} are duplicates".format(
+        count, len(rows), ts_path))
+    _write_table(ts_path, rows)
+    return rows
@@ -0,0 +1,228 @@
+"""Ingest flat directories of camera images into V1 timestreams.
+
+Cameras and card readers give flat directories of ``IMG_0001.JPG``-style
+files. Each image's capture time is read from its EXIF header, and the image
+is placed at its path in the V1 hierarchy, hard linked or cloned where the
+filesystem allows. Images taken in the same second get increasing ``n``
+counters, in the order of their source file names.
+"""
+import collections
+from datetime import datetime
+import filecmp
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+from os import path
+
+from timestream.manipulate import (
+        ProgressReporter,
+        )
+from timestream.parse import (
+        _ts_date_to_path,
+        _ts_has_manifest,
+        all_files_with_ext,
+        ts_get_manifest,
+        ts_index_invalidate,
+        ts_parse_date_path,
+        ts_parse_n_path,
+        ts_update_manifest,
+        )
+from timestream.manipulate.splice import (
+        _missing,
+        )
+from timestream.parse.validate import (
+        IMAGE_EXT_CONSTANTS,
+        IMAGE_EXT_TO_TYPE,
+        )
+from timestream.util import (
+        PARAM_TYPE_ERR,
+        )
+from timestream.util.files import (
+        PLACE_METHODS,
+        place_file,
+        )
+from timestream.util.imgmeta import (
+        get_exif_datetime,
+        )
+
+LOG = logging.getLogger("timestreamlib")
+
+
+def _default_threads():
+    # Reading headers and linking files waits on the disk, not the CPU
+    return min(32, 4 * multiprocessing.cpu_count())
+
+
+def _capture_time(args):
+    """Worker: ``(src, use_mtime)`` to ``(src, time)``, where time is
+    ``None`` if it can't be found."""
+    src, use_mtime = args
+    try:
+        time = get_exif_datetime(src)
+    except Exception as exc:
+        LOG.debug("Couldn't read EXIF of {}: {}".format(src, exc))
+        time = None
+    if time is None and use_mtime:
+        time = datetime.fromtimestamp(int(os.stat(src).st_mtime))
+    return (src, time)
+
+
+def _place(args):
+    src, dst, mode = args
+    return place_file(src, dst, mode)
+
+
+def _guess_interval(times):
+    """Most common gap between distinct ``times``, in whole minutes"""
+    intervals = collections.Counter()
+    times = sorted(set(times))
+    for iii in range(len(times) - 1):
+        minutes = int((times[iii + 1] - times[iii]).total_seconds() // 60)
+        if minutes > 0:
+            intervals[minutes] += 1
+    if not intervals:
+        return 1
+    return intervals.most_common(1)[0][0]
+
+
+def ts_ingest(src_dir, ts_path, name=None, ext=None, mode="link",
+              threads=None, use_mtime=False, status_file=None):
+    """Ingest the images in the flat directory ``src_dir`` into the V1
+    timestream at ``ts_path``, creating it if need be.
+
+    Capture times are read from EXIF headers in parallel, stopping at the
+    ``DateTimeOriginal`` tag, so only the start of each file is read. Images
+    are then placed in parallel, by hard link, reflink, ``copy_file_range``
+    or copy, whichever the filesystem allows first (see
+    ``timestream.util.files.place_file``). Ingest may be repeated as more
+    images arrive: images already in the timestream are left alone, and the
+    manifest is updated to cover old and new images alike.
+
+    :param str src_dir: Directory of camera images.
+    :param str ts_path: Timestream to ingest into.
+    :param str name: Timestream name. Defaults to the manifest's name, or the
+                     basename of ``ts_path``.
+    :param str ext: Extension of images to ingest, matched without regard to
+                    case. Defaults to the manifest's extension, or the most
+                    common image extension in ``src_dir``. An existing
+                    timestream's extension can't be changed.
+    :param str mode: ``"link"`` to hard link images where possible, or
+                     ``"copy"`` to always give the timestream its own copy.
+    :param int threads: Number of threads reading and placing images.
+    :param bool use_mtime: Use the file modification time of images without
+                           an EXIF capture time, rather than skipping them.
+    :param str status_file: Optional JSON progress status file.
+    :returns: dict -- with keys ``ingested``, a list of ``(src, dst)``
+              tuples, ``existing``, a list of images already ingested, and
+              ``skipped``, a list of images without a capture time.
+    """
+    if not path.isdir(src_dir):
+        msg = PARAM_TYPE_ERR.format(param="src_dir", func="ts_ingest",
+                                    type="directory")
+        LOG.error(msg)
+        raise ValueError(msg)
+    if mode not in PLACE_METHODS:
+        msg = PARAM_TYPE_ERR.format(param="mode", func="ts_ingest",
+                                    type=" or ".join(sorted(PLACE_METHODS)))
+        LOG.error(msg)
+        raise ValueError(msg)
+    if threads is None:
+        threads = _default_threads()
+    ts_info = None
+    if path.isdir(ts_path) and _ts_has_manifest(ts_path):
+        ts_info = ts_get_manifest(ts_path)
+        if ext is not None and ext.lower() != ts_info["extension"].lower():
+            msg = "Timestream {} holds '{}' images, not '{}'".format(
+                ts_path, ts_info["extension"], ext)
+            LOG.error(msg)
+            raise ValueError(msg)
+        ext = ts_info["extension"]
+    files = sorted(x for x in os.listdir(src_dir)
+                   if path.isfile(path.join(src_dir, x)))
+    if ext is None:
+        exts = collections.Counter(
+            path.splitext(x)[1][1:] for x in files
+            if path.splitext(x)[1][1:] in IMAGE_EXT_CONSTANTS)
+        if not exts:
+            raise ValueError("No images found in {}".format(src_dir))
+        ext = exts.most_common(1)[0][0]
+    if ext not in IMAGE_EXT_TO_TYPE:
+        raise ValueError("Unsupported image extension '{}'".format(ext))
+    srcs = [path.join(src_dir, x) for x in files
+            if path.splitext(x)[1][1:].lower() == ext.lower()]
+    if ts_info is None:
+        if name is None:
+            name = path.basename(ts_path.rstrip(os.sep))
+        ts_info = {
+            "name": name,
+            "version": 1,
+            "image_type": IMAGE_EXT_TO_TYPE[ext],
+            "extension": ext,
+        }
+    # Slots already taken, from images ingested earlier
+    taken = {}
+    if path.isdir(ts_path):
+        for img in all_files_with_ext(ts_path, ext, cs=True):
+            try:
+                taken[(ts_parse_date_path(img), ts_parse_n_path(img))] = img
+            except ValueError:
+                LOG.warn("Skipping badly named image {}".format(img))
+    # An interval guessed from fewer than two timepoints is meaningless
+    guess_interval = "interval" not in ts_info or \
+        len(set(time for time, _ in taken)) < 2
+    pool = ThreadPool(threads)
+    try:
+        times = pool.map(_capture_time, [(src, use_mtime) for src in srcs])
+        skipped = [src for src, time in times if time is None]
+        for src in skipped:
+            LOG.warn("No capture time for {}, skipping".format(src))
+        # Sorting by time then file name orders each burst as it was taken
+        timed = sorted((time, path.basename(src), src)
+                       for src, time in times if time is not None)
+        jobs = []
+        existing = []
+        next_n = collections.defaultdict(int)
+        for time, _, src in timed:
+            n = next_n[time]
+            while (time, n) in taken:
+                # Re-ingesting the same image must not add a copy of it
+                if filecmp.cmp(src, taken[(time, n)], shallow=False):
+                    break
+                n += 1
+            next_n[time] = n + 1
+            if (time, n) in taken:
+                existing.append(src)
+                continue
+            dst = path.join(ts_path, _ts_date_to_path(ts_info, time, n))
+            taken[(time, n)] = dst
+            jobs.append((src, dst, mode))
+        LOG.info("Ingesting {:d} images into {}".format(len(jobs), ts_path))
+        progress = ProgressReporter(total=len(jobs), name="ts_ingest",
+                                    status_file=status_file)
+        methods = collections.Counter()
+        for method in pool.imap_unordered(_place, jobs):
+            methods[method] += 1
+            progress.update()
+        progress.finish()
+    finally:
+        pool.close()
+        pool.join()
+    if methods:
+        LOG.info("Placed images by {}".format(", ".join(
+            "{}: {:d}".format(k, v) for k, v in sorted(methods.items()))))
+    all_times = sorted(set(time for time, _ in taken))
+    if all_times:
+        ts_info["start_datetime"] = all_times[0]
+        ts_info["end_datetime"] = all_times[-1]
+        if guess_interval:
+            ts_info["interval"] = _guess_interval(all_times)
+        # Recomputed every time, as new images may fill old gaps
+        ts_info["missing"] = _missing(all_times, ts_info["interval"])
+        ts_update_manifest(ts_path, ts_info)
+    ts_index_invalidate(ts_path)
+    return {
+        "ingested": [(src, dst) for src, dst, _ in jobs],
+        "existing": existing,
+        "skipped": skipped,
+    }
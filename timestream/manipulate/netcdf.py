@@ -1,20 +1,87 @@
 import logging
-import netCDF4 as ncdf
-from netCDF4 import num2date, date2num, date2index
+from os import path
+import time as timemod
 
 from timestream.manipulate import (
-        NOEOL,
+        ProgressReporter,
         )
 from timestream.parse import (
         ts_iter_images,
         ts_iter_numpy,
+        ts_parse_date,
         ts_parse_date_path,
         )
+from timestream.util import (
+        PARAM_TYPE_ERR,
+        instrument,
+        )
+from timestream.util.backends import (
+        lazy_backend,
+        )
+
+LOG = logging.getLogger("timestreamlib")
+ncdf = lazy_backend("netcdf")
+np = lazy_backend("numpy")
+#: Chunk layouts of the ``pixel`` variable. ``"frame"`` chunks are whole
+#: frames, best for reading frames; ``"time"`` chunks are
+#: ``(TSNC_TIME_CHUNK, TSNC_TILE, TSNC_TILE, z)`` blocks, best for reading
+#: the time series of a region.
+TSNC_LAYOUTS = ("frame", "time")
+#: Frames per chunk of the ``"time"`` layout
+TSNC_TIME_CHUNK = 32
+#: Height and width of chunks of the ``"time"`` layout
+TSNC_TILE = 64
+
+
+def tsnc_chunks(layout, shape):
+    """Chunk sizes of a ``pixel`` variable of ``shape``.
+
+    :param layout: One of ``TSNC_LAYOUTS``, or a ``(t, y, x, z)`` tuple of
+                   chunk sizes.
+    :param tuple shape: ``(t, y, x, z)`` shape of the variable.
+    :returns: list -- Chunk sizes, each no larger than its dimension.
+    """
+    if layout == "frame":
+        chunks = (1, ) + tuple(shape[1:])
+    elif layout == "time":
+        chunks = (TSNC_TIME_CHUNK, TSNC_TILE, TSNC_TILE, shape[3])
+    elif isinstance(layout, (list, tuple)) and len(layout) == 4:
+        chunks = layout
+    else:
+        msg = PARAM_TYPE_ERR.format(param="layout", func="tsnc_chunks",
+                type="'frame', 'time' or (t, y, x, z) tuple")
+        LOG.error(msg)
+        raise ValueError(msg)
+    return [max(1, min(int(c), int(s))) for c, s in zip(chunks, shape)]
+
+
+def ts_to_tsnc(ts_path, tsnc_path, status_file=None, layout="frame",
+               skip_duplicates=False, start=None, end=None):
+    """Write all images of the timestream at ``ts_path`` into a netCDF4 file
+    at ``tsnc_path``. Progress is logged to the ``CONSOLE`` logger, and
+    written as JSON to ``status_file`` if given.
+
+    ``layout`` sets the chunking of the ``pixel`` variable, see
+    ``tsnc_chunks``. Frames are buffered until a whole time chunk of them can
+    be written, so memory use is one time chunk of frames. For big images and
+    long time chunks, write the ``"frame"`` layout and use ``ts_rechunk_tsnc``,
+    which works in bounded memory.
 
-def ts_to_tsnc(ts_path, tsnc_path):
+    With ``skip_duplicates``, images recorded as duplicate frames by
+    ``timestream.manipulate.dedup.ts_dedup`` are left out. With ``start`` or
+    ``end``, only images in that time range are written, e.g. for one shard
+    of a timestream; see ``ts_concat_tsnc``."""
     log = logging.getLogger("CONSOLE")
     # Get timestream images
-    imgs = list(ts_iter_images(ts_path))
+    start = ts_parse_date(start) if start is not None else None
+    end = ts_parse_date(end) if end is not None else None
+    imgs = list(ts_iter_images(ts_path, skip_duplicates=skip_duplicates))
+    if start is not None or end is not None:
+        imgs = [img for img in imgs
+                if (start is None or ts_parse_date_path(img) >= start) and
+                (end is None or ts_parse_date_path(img) <= end)]
+    if not imgs:
+        raise ValueError("No images of {} to write".format(ts_path))
     mats = ts_iter_numpy(imgs)
     # Make netcdf4 file
     root = ncdf.Dataset(tsnc_path, 'w', format="NETCDF4")
@@ -34,23 +101,167 @@ def ts_to_tsnc(ts_path, tsnc_path):
     ys = root.createVariable("y", 'u4', ('y',))
     xs = root.createVariable("x", 'u4', ('x',))
     # create actual pixel array
-    px_type = 'u{d}'.format(mat0.dtype.itemsize)
+    px_type = 'u{:d}'.format(mat0.dtype.itemsize)
+    chunks = tsnc_chunks(layout, (len(imgs), ) + mat0.shape)
     pixels = root.createVariable("pixel", px_type, ('t', 'y', 'x', 'z'),
-            zlib=True)
-    log.info("Created netcdf4 file {} with pixel array dimensions {!r}".format(
-        tsnc_path, pixels.shape))
-    # iteratively add images
-    count = 0
-    for img, mat in mats:
-        n_dates = len(root.dimensions['t'])
-        time = ts_parse_date_path(img)
-        times[n_dates] = date2num([time,], units=times.units,
-                calendar=times.calendar)
-        pixels[n_dates, :, :, :] = mat
-        count += 1
-        log.debug("Processed {}. Matrix shape is {!r}".format(img,
-            pixels.shape))
-        if count % 2 == 0:
-            log.log(NOEOL, "Processed {: 5d} images.\r".format(count))
-    log.info("Processed {: 5d} images. ts_to_tsnc finished!".format(count))
+            zlib=True, chunksizes=chunks)
+    log.info("Created netcdf4 file {} with pixel array dimensions {!r}, "
+             "chunks {!r}".format(tsnc_path, pixels.shape, chunks))
+    # iteratively add images, a time chunk at a time
+    progress = ProgressReporter(total=len(imgs), name="ts_to_tsnc",
+            status_file=status_file)
+    buf_times = []
+    buf_mats = []
+    while True:
+        t0 = timemod.time()
+        try:
+            img, mat = next(mats)
+        except StopIteration:
+            img = None
+        decoded = timemod.time()
+        if img is not None:
+            progress.add_stage_time("decode", decoded - t0)
+            buf_times.append(ts_parse_date_path(img))
+            buf_mats.append(mat)
+        if buf_mats and (img is None or len(buf_mats) == chunks[0]):
+            n_dates = len(root.dimensions['t'])
+            with instrument.timer("tsnc.write"):
+                times[n_dates:n_dates + len(buf_times)] = ncdf.date2num(
+                    buf_times, units=times.units, calendar=times.calendar)
+                pixels[n_dates:n_dates + len(buf_mats), :, :, :] = \
+                    np.stack(buf_mats)
+            progress.add_stage_time("write", timemod.time() - decoded)
+            log.debug("Wrote {:d} frames. Matrix shape is {!r}".format(
+                len(buf_mats), pixels.shape))
+            buf_times = []
+            buf_mats = []
+        if img is None:
+            break
+        progress.update(nbytes=path.getsize(img))
+    progress.finish()
     root.close()
+
+
+def _copy_var(src_var, dst, chunks=None):
+    """Create a copy of ``src_var`` in ``dst``, without its data"""
+    kwargs = {}
+    filters = src_var.filters() or {}
+    if filters.get("zlib"):
+        kwargs["zlib"] = True
+        kwargs["complevel"] = filters.get("complevel", 4)
+        kwargs["shuffle"] = filters.get("shuffle", False)
+    if chunks is not None:
+        kwargs["chunksizes"] = chunks
+    var = dst.createVariable(src_var.name, src_var.dtype,
+            src_var.dimensions, **kwargs)
+    var.setncatts(dict((k, src_var.getncattr(k))
+                       for k in src_var.ncattrs()))
+    return var
+
+
+def ts_rechunk_tsnc(src_path, dst_path, layout="time", max_memory=512):
+    """Copy a netCDF4 file written by ``ts_to_tsnc`` with its ``pixel``
+    variable rechunked, e.g. from frame-major to time-major chunks.
+
+    The pixel array is transposed out-of-core: it is copied in blocks of
+    whole destination chunks, one time chunk by as many rows of chunks as
+    fit in ``max_memory``, so any size of file can be rechunked.
+
+    :param str src_path: netCDF4 file to read.
+    :param str dst_path: netCDF4 file to write.
+    :param layout: Chunk layout of ``pixel`` in ``dst_path``, see
+                   ``tsnc_chunks``.
+    :param int max_memory: Megabytes of pixel data to hold at once.
+    :returns: list -- The chunk sizes of ``pixel`` in ``dst_path``.
+    """
+    src = ncdf.Dataset(src_path, 'r')
+    dst = ncdf.Dataset(dst_path, 'w', format="NETCDF4")
+    try:
+        for name, dim in src.dimensions.items():
+            dst.createDimension(name, None if dim.isunlimited() else len(dim))
+        for name in src.groups:
+            dst.createGroup(name)
+        dst.setncatts(dict((k, src.getncattr(k)) for k in src.ncattrs()))
+        for name, var in src.variables.items():
+            if name == "pixel":
+                continue
+            _copy_var(var, dst)[:] = var[:]
+        src_px = src.variables["pixel"]
+        shape = src_px.shape
+        chunks = tsnc_chunks(layout, shape)
+        dst_px = _copy_var(src_px, dst, chunks)
+        # Rows of destination chunks per block, within max_memory
+        row_bytes = chunks[0] * chunks[1] * shape[2] * shape[3] * \
+            src_px.dtype.itemsize
+        rows = max(1, int(max_memory * 1024 * 1024 // row_bytes)) * chunks[1]
+        rows = min(rows, shape[1])
+        LOG.info("Rechunking {} to {!r} in blocks of {:d} frames by {:d} rows"
+                 .format(src_path, chunks, chunks[0], rows))
+        for t0 in range(0, shape[0], chunks[0]):
+            t1 = min(t0 + chunks[0], shape[0])
+            for y0 in range(0, shape[1], rows):
+                y1 = min(y0 + rows, shape[1])
+                with instrument.timer("tsnc.rechunk"):
+                    dst_px[t0:t1, y0:y1, :, :] = src_px[t0:t1, y0:y1, :, :]
+    finally:
+        dst.close()
+        src.close()
+    return chunks
+
+
+def ts_concat_tsnc(src_paths, dst_path):
+    """Concatenate netCDF4 files written by ``ts_to_tsnc`` along time, e.g.
+    the files of each shard of a sharded run. They must hold frames of the
+    same size, and be given in time order. The pixel chunking of the first
+    is kept, and frames are copied a time chunk at a time.
+
+    :param list src_paths: netCDF4 files to read.
+    :param str dst_path: netCDF4 file to write.
+    :returns: int -- The number of frames written.
+    """
+    if not src_paths:
+        msg = PARAM_TYPE_ERR.format(param="src_paths", func="ts_concat_tsnc",
+                                    type="non-empty list")
+        LOG.error(msg)
+        raise ValueError(msg)
+    first = ncdf.Dataset(src_paths[0], 'r')
+    dst = ncdf.Dataset(dst_path, 'w', format="NETCDF4")
+    n_frames = 0
+    try:
+        for name, dim in first.dimensions.items():
+            dst.createDimension(name, None if dim.isunlimited() else len(dim))
+        for name in first.groups:
+            dst.createGroup(name)
+        dst.setncatts(dict((k, first.getncattr(k)) for k in first.ncattrs()))
+        for name, var in first.variables.items():
+            if "t" in var.dimensions:
+                continue
+            _copy_var(var, dst)[:] = var[:]
+        src_px = first.variables["pixel"]
+        chunks = src_px.chunking()
+        if chunks == "contiguous":
+            chunks = None
+        dst_px = _copy_var(src_px, dst, chunks)
+        dst_times = _copy_var(first.variables["time"], dst)
+        step = chunks[0] if chunks else 1
+        for src_path in src_paths:
+            src = ncdf.Dataset(src_path, 'r')
+            try:
+                px = src.variables["pixel"]
+                if px.shape[1:] != src_px.shape[1:]:
+                    raise ValueError("Frames of {} are {!r}, not {!r}".format(
+                        src_path, px.shape[1:], src_px.shape[1:]))
+                dst_times[n_frames:n_frames + px.shape[0]] = \
+                    src.variables["time"][:]
+                for t0 in range(0, px.shape[0], step):
+                    t1 = min(t0 + step, px.shape[0])
+                    with instrument.timer("tsnc.concat"):
+                        dst_px[n_frames + t0:n_frames + t1, :, :, :] = \
+                            px[t0:t1, :, :, :]
+                n_frames += px.shape[0]
+            finally:
+                src.close()
+    finally:
+        dst.close()
+        first.close()
+    return n_frames
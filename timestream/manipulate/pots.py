@@ -0,0 +1,188 @@
+"""Extract each pot from every frame into per-pot time series arrays.
+
+Each frame is decoded once, and the regions of all pots are sliced from it.
+Every pot gets a preallocated ``(t, h, w, c)`` array in a ``.npy`` file,
+which workers write into directly through memory maps, so no pixels pass
+between processes. Per-plant analyses can then memory map a pot's file and
+read its whole time series contiguously, with no decoding at all::
+
+    meta, pots = ts_load_pots(out_dir)
+    areas = [green_area(frame) for frame in pots["1A1"]]
+
+Alongside the arrays, ``pots.json`` records the time and source image of
+each frame, which frames were decoded, and each pot's region and chamber
+index.
+"""
+import json
+import logging
+import os
+from os import path
+
+from timestream.manipulate import (
+        ProgressReporter,
+        ts_parallel_map,
+        )
+from timestream.parse import (
+        ts_format_date,
+        ts_get_index,
+        ts_imread,
+        ts_parse_date,
+        )
+from timestream.util import (
+        PARAM_TYPE_ERR,
+        )
+from timestream.util.backends import (
+        lazy_backend,
+        )
+from timestream.util.layouts import (
+        traypos_to_chamber_index,
+        )
+
+np = lazy_backend("numpy")
+LOG = logging.getLogger("timestreamlib")
+#: Name of the metadata file in the output directory
+POTS_META_FILENAME = "pots.json"
+# Memory maps opened by this worker process, by file
+_MEMMAPS = {}
+
+
+def _pot_file(out_dir, traypos):
+    return path.join(out_dir, "{}.npy".format(traypos))
+
+
+def _scaled(roi, scale):
+    return tuple(int(round(v / float(scale))) for v in roi)
+
+
+def _pot_frame(args):
+    """Worker: decode frame ``t`` and write each pot's region into its array.
+
+    ``args`` is ``((t, img), out_dir, rois, scale)``. Returns ``(t, ok)``.
+    """
+    (t, img), out_dir, rois, scale = args
+    mat = ts_imread(img, scale)
+    if mat is None:
+        LOG.warn("Couldn't decode {}".format(img))
+        return (t, False)
+    # Check every pot is inside the frame before writing any of them
+    crops = []
+    for traypos, roi in rois:
+        fname = _pot_file(out_dir, traypos)
+        stack = _MEMMAPS.get(fname)
+        if stack is None:
+            stack = np.load(fname, mmap_mode="r+")
+            _MEMMAPS[fname] = stack
+        x, y, width, height = _scaled(roi, scale)
+        crop = mat[y:y + height, x:x + width]
+        if crop.shape != stack.shape[1:]:
+            LOG.warn("Pot {} is outside {}".format(traypos, img))
+            return (t, False)
+        crops.append((stack, crop))
+    for stack, crop in crops:
+        stack[t] = crop
+    return (t, True)
+
+
+def ts_extract_pots(ts_path, out_dir, rois, start=None, end=None, scale=1,
+                    procs=None, status_file=None, cols=4, rows=5):
+    """Extract every pot of every image of ``ts_path`` into per-pot arrays.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param str out_dir: Directory to write arrays and ``pots.json`` to.
+    :param dict rois: ``{traypos: (x, y, width, height)}`` regions of each
+                      pot in full resolution pixels, e.g. from
+                      ``timestream.util.layouts.tray_pot_rois``.
+    :param datetime.datetime start: Ignore images before ``start``.
+    :param datetime.datetime end: Ignore images after ``end``.
+    :param int scale: Downscaling factor to decode at, see
+                      ``timestream.parse.ts_imread``.
+    :param int procs: Number of worker processes.
+    :param str status_file: Optional JSON progress status file.
+    :param int cols: Pot columns per tray, as given to ``tray_pot_rois``,
+                     for the chamber index of each pot.
+    :param int rows: Pot rows per tray, as given to ``tray_pot_rois``.
+    :returns: dict -- The metadata written to ``pots.json``.
+    """
+    if not isinstance(rois, dict) or not rois:
+        msg = PARAM_TYPE_ERR.format(param="rois", func="ts_extract_pots",
+                                    type="non-empty dict")
+        LOG.error(msg)
+        raise ValueError(msg)
+    start = ts_parse_date(start) if start is not None else None
+    end = ts_parse_date(end) if end is not None else None
+    index = ts_get_index(ts_path)
+    frames = [(time, img) for time, img in zip(index["times"], index["paths"])
+              if (start is None or time >= start) and
+              (end is None or time <= end)]
+    if not frames:
+        raise ValueError("No images in {} to extract pots from".format(
+            ts_path))
+    if not path.isdir(out_dir):
+        os.makedirs(out_dir)
+    # Channels of the first frame that decodes
+    for _, img in frames:
+        mat = ts_imread(img, scale)
+        if mat is not None:
+            channels = mat.shape[2]
+            break
+    else:
+        raise ValueError("No images in {} could be decoded".format(ts_path))
+    rois = sorted(rois.items())
+    meta = {
+        "timestream": path.abspath(ts_path),
+        "scale": scale,
+        "tray_shape": [cols, rows],
+        "times": [ts_format_date(time) for time, _ in frames],
+        "images": [path.relpath(img, ts_path) for _, img in frames],
+        "pots": {},
+    }
+    # Preallocate each pot's array, so workers can write into it in place
+    for traypos, roi in rois:
+        _, _, width, height = _scaled(roi, scale)
+        shape = (len(frames), height, width, channels)
+        stack = np.lib.format.open_memmap(_pot_file(out_dir, traypos),
+                                          mode="w+", dtype="u1", shape=shape)
+        del stack
+        try:
+            chamber_index = traypos_to_chamber_index(traypos, cols * rows,
+                                                     rows)
+        except (TypeError, ValueError):
+            chamber_index = None
+        meta["pots"][traypos] = {
+            "file": path.basename(_pot_file(out_dir, traypos)),
+            "roi": list(roi),
+            "chamber_index": chamber_index,
+            "shape": list(shape),
+        }
+    LOG.info("Extracting {:d} pots from {:d} images".format(len(rois),
+                                                           len(frames)))
+    progress = ProgressReporter(total=len(frames), name="ts_extract_pots",
+                                status_file=status_file)
+    valid = [False] * len(frames)
+    for t, ok in ts_parallel_map(list(enumerate(img for _, img in frames)),
+                                 _pot_frame, [[out_dir], [rois], [scale]],
+                                 procs=procs, progress=progress):
+        valid[t] = ok
+    progress.finish()
+    meta["valid"] = valid
+    with open(path.join(out_dir, POTS_META_FILENAME), "w") as ofh:
+        json.dump(meta, ofh, indent=1, sort_keys=True)
+    return meta
+
+
+def ts_load_pots(out_dir):
+    """Open the pot arrays made by ``ts_extract_pots``, read only.
+
+    :param str out_dir: Directory given to ``ts_extract_pots``.
+    :returns: tuple -- ``(meta, pots)``, the metadata with ``times`` parsed
+              to ``datetime`` objects, and ``{traypos: numpy.memmap}`` of
+              ``(t, h, w, c)`` arrays. Frames whose ``valid`` entry is
+              ``False`` are zeros.
+    """
+    with open(path.join(out_dir, POTS_META_FILENAME)) as ifh:
+        meta = json.load(ifh)
+    meta["times"] = [ts_parse_date(x) for x in meta["times"]]
+    pots = dict((traypos, np.load(path.join(out_dir, info["file"]),
+                                  mmap_mode="r"))
+                for traypos, info in meta["pots"].items())
+    return (meta, pots)
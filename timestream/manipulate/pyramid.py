@@ -0,0 +1,193 @@
+"""Generate derived, reduced resolution timestreams from a source timestream.
+
+Each level of the pyramid is a V1 timestream named for the source, with its
+resolution tag replaced, e.g. ``BVZ0022-GC05L-CN650D-Cam07~fullres-orig``
+gives ``BVZ0022-GC05L-CN650D-Cam07~720-jpg`` for a 720 pixel wide JPEG level.
+"""
+import errno
+import logging
+import os
+from os import path
+
+from timestream.manipulate import (
+        ProgressReporter,
+        ts_parallel_map,
+        )
+from timestream.parse import (
+        DCT_SCALES,
+        _ts_date_to_path,
+        _ts_has_manifest,
+        all_files_with_ext,
+        ts_get_manifest,
+        ts_image_size,
+        ts_imread,
+        ts_iter_images,
+        ts_parse_date_path,
+        ts_parse_n_path,
+        ts_update_manifest,
+        )
+from timestream.parse.validate import (
+        IMAGE_EXT_TO_TYPE,
+        )
+from timestream.util import (
+        PARAM_TYPE_ERR,
+        )
+from timestream.util.backends import (
+        lazy_backend,
+        )
+
+cv2 = lazy_backend("cv2")
+LOG = logging.getLogger("timestreamlib")
+
+
+def ts_pyramid_name(name, width, ext):
+    """Name of the derived timestream of ``name`` at ``width`` pixels wide,
+    encoded as ``ext``."""
+    return "{}~{:d}-{}".format(name.partition("~")[0], width, ext.lower())
+
+
+def _makedirs(dirpath):
+    try:
+        os.makedirs(dirpath)
+    except OSError as exc:
+        # Other workers may be making the same hour directory
+        if exc.errno != errno.EEXIST:
+            raise
+
+
+def _pyramid_image(args):
+    """Worker: decode one source image and write each level it needs.
+
+    ``args`` is ``((img, [(out_path, width, ext), ...]), scale, quality)``.
+    """
+    (img, outputs), scale, quality = args
+    mat = ts_imread(img, scale)
+    if mat is None:
+        LOG.warn("Couldn't decode {}, skipping".format(img))
+        return (img, 0)
+    height, width = mat.shape[:2]
+    for out_path, out_width, ext in outputs:
+        if out_width < width:
+            out_height = max(1, int(round(height * out_width /
+                                          float(width))))
+            out = cv2.resize(mat, (out_width, out_height),
+                             interpolation=cv2.INTER_AREA)
+        else:
+            out = mat
+        params = []
+        if ext.lower() in ("jpg", "jpeg"):
+            params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        ok, buf = cv2.imencode("." + ext, out, params)
+        if not ok:
+            LOG.warn("Couldn't encode {}".format(out_path))
+            continue
+        _makedirs(path.dirname(out_path))
+        # Write then rename, so a killed job never leaves a truncated image
+        # that a later incremental run would treat as done.
+        tmp_path = out_path + ".tmp"
+        with open(tmp_path, "wb") as ofh:
+            ofh.write(buf.tostring())
+        os.rename(tmp_path, out_path)
+    return (img, len(outputs))
+
+
+def _dct_scale(src_width, max_width):
+    """The largest DCT decode scale that still gives at least ``max_width``
+    pixels"""
+    best = 1
+    for scale in DCT_SCALES:
+        if src_width // scale >= max_width:
+            best = scale
+    return best
+
+
+def ts_make_pyramid(ts_path, out_root, levels, procs=None, quality=90,
+                    status_file=None):
+    """Generate or update derived timestreams of ``ts_path`` at several
+    resolutions, in parallel.
+
+    Each source image is decoded once, using libjpeg DCT scaling where the
+    smallest useful scale allows, then resized for every level. Generation is
+    incremental: only images newer than a level's ``end_datetime``, or not
+    present in it, are made. Each level gets a valid ``.tsm`` manifest.
+
+    :param str ts_path: Source timestream.
+    :param str out_root: Directory to create derived timestreams in.
+    :param list levels: ``(width, ext)`` tuples, e.g. ``[(720, "jpg")]``.
+    :param int procs: Number of worker processes.
+    :param int quality: JPEG quality of JPEG levels.
+    :param str status_file: Optional JSON progress status file.
+    :returns: dict -- ``{derived_path: images_written}``.
+    """
+    if not isinstance(levels, list) or not levels:
+        msg = PARAM_TYPE_ERR.format(param="levels", func="ts_make_pyramid",
+                                    type="non-empty list")
+        LOG.error(msg)
+        raise ValueError(msg)
+    for width, ext in levels:
+        if ext not in IMAGE_EXT_TO_TYPE:
+            raise ValueError("Unsupported pyramid extension '{}'".format(ext))
+    src_info = ts_get_manifest(ts_path)
+    # Set up each level, remembering what it already holds
+    level_info = []
+    for width, ext in levels:
+        name = ts_pyramid_name(src_info["name"], width, ext)
+        lvl_path = path.join(out_root, name)
+        lvl_info = {
+            "name": name,
+            "version": 1,
+            "image_type": IMAGE_EXT_TO_TYPE[ext],
+            "extension": ext,
+            "interval": src_info["interval"],
+            "missing": list(src_info.get("missing", [])),
+        }
+        existing = set()
+        end = None
+        if path.isdir(lvl_path):
+            existing = set(all_files_with_ext(lvl_path, ext, cs=True))
+            if _ts_has_manifest(lvl_path):
+                end = ts_get_manifest(lvl_path)["end_datetime"]
+        level_info.append((lvl_path, lvl_info, width, existing, end))
+    # Work out which outputs each source image needs
+    jobs = []
+    times = []
+    written = dict((lvl[0], 0) for lvl in level_info)
+    for img in sorted(ts_iter_images(ts_path)):
+        time = ts_parse_date_path(img)
+        times.append(time)
+        n = ts_parse_n_path(img)
+        outputs = []
+        for lvl_path, lvl_info, width, existing, end in level_info:
+            out = path.join(lvl_path, _ts_date_to_path(lvl_info, time, n))
+            if end is None or time > end or out not in existing:
+                outputs.append((out, width, lvl_info["extension"]))
+                written[lvl_path] += 1
+        if outputs:
+            jobs.append((img, outputs))
+    if not times:
+        raise ValueError("Timestream {} has no images".format(ts_path))
+    if jobs:
+        # Width of the first image whose header, or failing that pixels,
+        # can be read
+        src_width = next((size[0] for size in
+                          (ts_image_size(img) for img, _ in jobs)
+                          if size is not None), None)
+        if src_width is None:
+            raise ValueError("No images of {} could be read".format(ts_path))
+        scale = _dct_scale(src_width, max(width for width, _ in levels))
+        LOG.info("Making {:d} pyramid images at DCT scale 1/{:d}".format(
+            len(jobs), scale))
+        progress = ProgressReporter(total=len(jobs), name="ts_make_pyramid",
+                                    status_file=status_file)
+        for img, count in ts_parallel_map(jobs, _pyramid_image,
+                                          [[scale], [quality]], procs=procs,
+                                          progress=progress):
+            pass
+        progress.finish()
+    for lvl_path, lvl_info, width, existing, end in level_info:
+        if not path.isdir(lvl_path):
+            continue
+        lvl_info["start_datetime"] = times[0]
+        lvl_info["end_datetime"] = times[-1]
+        ts_update_manifest(lvl_path, lvl_info)
+    return written
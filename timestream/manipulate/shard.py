@@ -0,0 +1,303 @@
+"""Split work on a timestream across several nodes.
+
+A timestream's time index is split into shards of consecutive timepoints,
+balanced by image count or bytes, and the plan is written to
+``shards.json`` in a shard directory shared by the nodes. Each shard is then
+run independently, by index, e.g. as the tasks of a cluster array job::
+
+    ts_plan_shards(ts_path, shard_dir, 16, balance="bytes")
+    # On each node, with its task index:
+    ts_run_shard(shard_dir, index, "frame_stats")
+    # Once all are done:
+    ts_merge_shards(shard_dir, "frame_stats", out)
+
+Each shard writes its output to its own file in the shard directory,
+renamed into place when complete, so a failed shard can just be rerun.
+The jobs that can be sharded, with how to run and merge them, are in
+``SHARD_JOBS``. ``ts_run_shards_local`` runs every shard in its own process,
+standing in for nodes.
+"""
+import json
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+from os import path
+from bisect import bisect_left
+
+from timestream.manipulate.netcdf import (
+        ts_concat_tsnc,
+        ts_to_tsnc,
+        )
+from timestream.manipulate.stats import (
+        ts_frame_stats,
+        ts_merge_frame_stats,
+        )
+from timestream.parse import (
+        ts_format_date,
+        ts_get_index,
+        ts_parse_date,
+        )
+from timestream.util import (
+        PARAM_TYPE_ERR,
+        )
+
+LOG = logging.getLogger("timestreamlib")
+#: Name of the shard plan in a shard directory
+SHARD_PLAN_FILENAME = "shards.json"
+#: Ways of balancing shards
+SHARD_BALANCES = ("count", "bytes")
+
+
+def _run_frame_stats(ts_path, start, end, out, procs, **kwargs):
+    ts_frame_stats(ts_path, start=start, end=end, table=out, procs=procs,
+                   **kwargs)
+
+
+def _merge_frame_stats(ts_path, outs, dst, **kwargs):
+    ts_merge_frame_stats(ts_path, outs, dst)
+
+
+def _run_tsnc(ts_path, start, end, out, procs, **kwargs):
+    ts_to_tsnc(ts_path, out, start=start, end=end, **kwargs)
+
+
+def _merge_tsnc(ts_path, outs, dst, **kwargs):
+    ts_concat_tsnc(outs, dst)
+
+
+#: Jobs which can be sharded: ``{name: (run, merge, extension)}``.
+#: ``run(ts_path, start, end, out, procs, **kwargs)`` writes the output of
+#: the images from ``start`` to ``end`` to ``out``, and
+#: ``merge(ts_path, outs, dst, **kwargs)`` merges the outputs of every shard,
+#: in order, into ``dst``.
+SHARD_JOBS = {
+    "frame_stats": (_run_frame_stats, _merge_frame_stats, "csv"),
+    "tsnc": (_run_tsnc, _merge_tsnc, "tsnc"),
+}
+
+
+def _split_points(weights, n_shards):
+    """Indices splitting ``weights`` into ``n_shards`` runs of roughly equal
+    total weight, as ``[0, ..., len(weights)]``. No run is empty."""
+    cumulative = []
+    total = 0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    points = [0]
+    for shard in range(1, n_shards):
+        # First timepoint whose cumulative weight reaches this share
+        point = bisect_left(cumulative, total * shard / float(n_shards)) + 1
+        # Leave at least one timepoint for each later shard
+        point = min(max(point, points[-1] + 1), len(weights) -
+                    (n_shards - shard))
+        points.append(point)
+    points.append(len(weights))
+    return points
+
+
+def ts_plan_shards(ts_path, shard_dir, n_shards, balance="count",
+                   start=None, end=None, threads=None):
+    """Split the images of ``ts_path`` into shards of consecutive timepoints,
+    and write the plan to ``shards.json`` in ``shard_dir``. Bursts are never
+    split between shards.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param str shard_dir: Directory for the plan and shard outputs, which all
+                          nodes can reach.
+    :param int n_shards: Number of shards. Fewer are made if there are fewer
+                         timepoints.
+    :param str balance: One of ``SHARD_BALANCES``: give shards equal numbers
+                        of images, or of bytes, which needs a ``stat`` of
+                        every image.
+    :param datetime.datetime start: Ignore images before ``start``.
+    :param datetime.datetime end: Ignore images after ``end``.
+    :param int threads: Number of threads to ``stat`` images with.
+    :returns: dict -- The plan, with keys ``timestream``, ``balance`` and
+              ``shards``, a list of shard descriptors with keys ``index``,
+              ``start``, ``end`` (formatted dates), ``images`` and
+              ``bytes`` (``None`` unless balanced by bytes).
+    """
+    if balance not in SHARD_BALANCES:
+        msg = PARAM_TYPE_ERR.format(param="balance", func="ts_plan_shards",
+                                    type=" or ".join(SHARD_BALANCES))
+        LOG.error(msg)
+        raise ValueError(msg)
+    if not isinstance(n_shards, int) or n_shards < 1:
+        msg = PARAM_TYPE_ERR.format(param="n_shards", func="ts_plan_shards",
+                                    type="positive int")
+        LOG.error(msg)
+        raise ValueError(msg)
+    start = ts_parse_date(start) if start is not None else None
+    end = ts_parse_date(end) if end is not None else None
+    index = ts_get_index(ts_path)
+    entries = [(time, img) for time, img in
+               zip(index["times"], index["paths"])
+               if (start is None or time >= start) and
+               (end is None or time <= end)]
+    if not entries:
+        raise ValueError("No images of {} to shard".format(ts_path))
+    if balance == "bytes":
+        pool = ThreadPool(threads or 2 * multiprocessing.cpu_count())
+        try:
+            sizes = pool.map(path.getsize, [img for _, img in entries])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        sizes = [None] * len(entries)
+    # Weights of each timepoint, summing its burst
+    times = []
+    counts = []
+    nbytes = []
+    for (time, _), size in zip(entries, sizes):
+        if not times or times[-1] != time:
+            times.append(time)
+            counts.append(0)
+            nbytes.append(0)
+        counts[-1] += 1
+        nbytes[-1] += size or 0
+    if n_shards > len(times):
+        LOG.warn("Only {:d} timepoints, so making {:d} shards".format(
+            len(times), len(times)))
+        n_shards = len(times)
+    weights = nbytes if balance == "bytes" else counts
+    points = _split_points(weights, n_shards)
+    shards = []
+    for iii in range(n_shards):
+        lo, hi = points[iii], points[iii + 1]
+        shards.append({
+            "index": iii,
+            "start": ts_format_date(times[lo]),
+            "end": ts_format_date(times[hi - 1]),
+            "images": sum(counts[lo:hi]),
+            "bytes": sum(nbytes[lo:hi]) if balance == "bytes" else None,
+        })
+    plan = {
+        "timestream": path.abspath(ts_path),
+        "balance": balance,
+        "shards": shards,
+    }
+    if not path.isdir(shard_dir):
+        os.makedirs(shard_dir)
+    plan_file = path.join(shard_dir, SHARD_PLAN_FILENAME)
+    with open(plan_file + ".tmp", "w") as ofh:
+        json.dump(plan, ofh, indent=1, sort_keys=True)
+    os.rename(plan_file + ".tmp", plan_file)
+    LOG.info("Split {:d} images of {} into {:d} shards".format(
+        len(entries), ts_path, n_shards))
+    return plan
+
+
+def ts_load_shard_plan(shard_dir):
+    """Read the plan written by ``ts_plan_shards`` to ``shard_dir``"""
+    with open(path.join(shard_dir, SHARD_PLAN_FILENAME)) as ifh:
+        plan = json.load(ifh)
+    plan["timestream"] = str(plan["timestream"])
+    return plan
+
+
+def _job(job):
+    if job not in SHARD_JOBS:
+        msg = PARAM_TYPE_ERR.format(param="job", func="ts_run_shard",
+                                    type=" or ".join(sorted(SHARD_JOBS)))
+        LOG.error(msg)
+        raise ValueError(msg)
+    return SHARD_JOBS[job]
+
+
+def ts_shard_output(shard_dir, job, index):
+    """Path of the output of shard ``index`` of ``job``"""
+    return path.join(shard_dir, "{}-{:04d}.{}".format(job, index,
+                                                      _job(job)[2]))
+
+
+def ts_run_shard(shard_dir, index, job, procs=None, **kwargs):
+    """Run one shard of ``job``, e.g. as one task of a cluster array job.
+
+    :param str shard_dir: Directory holding the plan.
+    :param int index: Index of the shard to run.
+    :param str job: Name of a job in ``SHARD_JOBS``.
+    :param int procs: Number of worker processes on this node.
+    :returns: str -- Path of the shard's output.
+    """
+    run = _job(job)[0]
+    plan = ts_load_shard_plan(shard_dir)
+    if not 0 <= index < len(plan["shards"]):
+        raise IndexError("No shard {:d} of {:d}".format(index,
+                                                       len(plan["shards"])))
+    shard = plan["shards"][index]
+    out = ts_shard_output(shard_dir, job, index)
+    # Output is renamed into place when complete, so a part file means the
+    # shard failed
+    part = out + ".part"
+    if path.exists(part):
+        os.unlink(part)
+    LOG.info("Running {} shard {:d}, {} to {}".format(
+        job, index, shard["start"], shard["end"]))
+    run(plan["timestream"], ts_parse_date(str(shard["start"])),
+        ts_parse_date(str(shard["end"])), part, procs, **kwargs)
+    os.rename(part, out)
+    return out
+
+
+def ts_merge_shards(shard_dir, job, dst, **kwargs):
+    """Merge the outputs of every shard of ``job``.
+
+    :param str shard_dir: Directory holding the plan and shard outputs.
+    :param str job: Name of a job in ``SHARD_JOBS``.
+    :param str dst: Path of the merged output.
+    :raises: IOError if any shard hasn't finished.
+    """
+    merge = _job(job)[1]
+    plan = ts_load_shard_plan(shard_dir)
+    outs = [ts_shard_output(shard_dir, job, shard["index"])
+            for shard in plan["shards"]]
+    missing = [iii for iii, out in enumerate(outs) if not path.isfile(out)]
+    if missing:
+        raise IOError("Shards {} of {} haven't finished".format(
+            ",".join(str(x) for x in missing), job))
+    merge(plan["timestream"], outs, dst, **kwargs)
+    return dst
+
+
+def _run_shard_process(args):
+    shard_dir, index, job, procs, kwargs = args
+    ts_run_shard(shard_dir, index, job, procs, **kwargs)
+
+
+def ts_run_shards_local(shard_dir, job, workers=None, procs=1, **kwargs):
+    """Run every shard of ``job`` on this machine, each in its own process
+    standing in for a node. Processes aren't daemonic, so each may use a
+    pool of ``procs`` workers of its own.
+
+    :param str shard_dir: Directory holding the plan.
+    :param str job: Name of a job in ``SHARD_JOBS``.
+    :param int workers: Number of shards to run at once, by default all.
+    :param int procs: Number of worker processes of each shard.
+    :returns: list -- Paths of the shard outputs.
+    :raises: RuntimeError if any shard fails.
+    """
+    _job(job)
+    n_shards = len(ts_load_shard_plan(shard_dir)["shards"])
+    workers = workers or n_shards
+    todo = list(range(n_shards))
+    running = []
+    failed = []
+    while todo or running:
+        while todo and len(running) < workers:
+            index = todo.pop(0)
+            proc = multiprocessing.Process(
+                target=_run_shard_process,
+                args=((shard_dir, index, job, procs, kwargs), ))
+            proc.start()
+            running.append((index, proc))
+        index, proc = running.pop(0)
+        proc.join()
+        if proc.exitcode != 0:
+            failed.append(index)
+    if failed:
+        raise RuntimeError("Shards {} of {} failed".format(
+            ",".join(str(x) for x in sorted(failed)), job))
+    return [ts_shard_output(shard_dir, job, iii) for iii in range(n_shards)]
@@ -0,0 +1,197 @@
+"""Cut time ranges out of timestreams, and merge timestreams together.
+
+New timestreams are made of hard links to the source images where possible
+(see ``timestream.util.files.place_file``), so no image data is copied. Only
+the hour directories in range are listed, and the new manifest is made from
+the images placed, so the result is never walked.
+"""
+import filecmp
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+from os import path
+
+from timestream.parse import (
+        _ts_date_to_path,
+        _ts_list_hour_dir,
+        iter_date_range,
+        ts_format_date,
+        ts_get_manifest,
+        ts_index_invalidate,
+        ts_iter_hour_dirs,
+        ts_parse_date,
+        ts_update_manifest,
+        )
+from timestream.util import (
+        PARAM_TYPE_ERR,
+        )
+from timestream.util.files import (
+        PLACE_METHODS,
+        place_file,
+        )
+
+LOG = logging.getLogger("timestreamlib")
+
+
+def _default_threads():
+    # Linking files waits on the filesystem, not the CPU
+    return min(32, 4 * multiprocessing.cpu_count())
+
+
+def _place(args):
+    src, dst, mode = args
+    return place_file(src, dst, mode)
+
+
+def _check_out_path(out_path, func):
+    if path.isdir(out_path) and os.listdir(out_path):
+        msg = "Output of {} must be a new timestream, {} isn't empty".format(
+            func, out_path)
+        LOG.error(msg)
+        raise ValueError(msg)
+
+
+def _check_mode(mode, func):
+    if mode not in PLACE_METHODS:
+        msg = PARAM_TYPE_ERR.format(param="mode", func=func,
+                                    type=" or ".join(sorted(PLACE_METHODS)))
+        LOG.error(msg)
+        raise ValueError(msg)
+
+
+def _list_range(ts_path, ext, start=None, end=None):
+    entries = []
+    for hour_dir in ts_iter_hour_dirs(ts_path, start, end):
+        entries.extend(_ts_list_hour_dir(hour_dir, ext, start, end))
+    return entries
+
+
+def _missing(times, interval):
+    """Formatted timepoints every ``interval`` minutes from the first to the
+    last of the sorted ``times`` which have no image"""
+    present = set(times)
+    return [ts_format_date(x)
+            for x in iter_date_range(times[0], times[-1], interval * 60)
+            if x not in present]
+
+
+def _ts_write_placed(out_path, ts_info, jobs, threads):
+    """Place each ``(src, time, n, mode)`` of ``jobs`` in the new timestream
+    ``out_path``, in parallel, then write its manifest."""
+    placements = [(src, path.join(out_path, _ts_date_to_path(ts_info, time,
+                                                             n)), mode)
+                  for src, time, n, mode in jobs]
+    pool = ThreadPool(threads)
+    try:
+        for _ in pool.imap_unordered(_place, placements):
+            pass
+    finally:
+        pool.close()
+        pool.join()
+    times = sorted(set(time for _, time, _, _ in jobs))
+    ts_info = dict(ts_info)
+    ts_info["start_datetime"] = times[0]
+    ts_info["end_datetime"] = times[-1]
+    ts_info["missing"] = _missing(times, ts_info["interval"])
+    ts_update_manifest(out_path, ts_info)
+    ts_index_invalidate(out_path)
+    return ts_info
+
+
+def ts_extract_range(ts_path, out_path, start=None, end=None, name=None,
+                     mode="link", threads=None):
+    """Make a new timestream of the images of ``ts_path`` from ``start`` to
+    ``end``.
+
+    :param str ts_path: Source timestream.
+    :param str out_path: New timestream, which mustn't hold any files yet.
+    :param start: First time to include, defaults to the start of
+                  ``ts_path``.
+    :param end: Last time to include, defaults to the end of ``ts_path``.
+    :type start: datetime.datetime or str
+    :type end: datetime.datetime or str
+    :param str name: Name of the new timestream. Defaults to the basename of
+                     ``out_path``.
+    :param str mode: ``"link"`` to hard link images where possible, or
+                     ``"copy"`` to give the new timestream its own copy.
+    :param int threads: Number of threads placing images.
+    :returns: dict -- The manifest of the new timestream.
+    :raises: ValueError if no images are in range.
+    """
+    _check_mode(mode, "ts_extract_range")
+    _check_out_path(out_path, "ts_extract_range")
+    if threads is None:
+        threads = _default_threads()
+    start = ts_parse_date(start) if start is not None else None
+    end = ts_parse_date(end) if end is not None else None
+    src_info = ts_get_manifest(ts_path)
+    entries = _list_range(ts_path, src_info["extension"], start, end)
+    if not entries:
+        raise ValueError("No images in {} from {} to {}".format(
+            ts_path, start, end))
+    ts_info = dict(src_info)
+    ts_info["name"] = name or path.basename(out_path.rstrip(os.sep))
+    LOG.info("Extracting {:d} images of {} into {}".format(
+        len(entries), ts_path, out_path))
+    return _ts_write_placed(out_path, ts_info,
+                            [(img, time, n, mode) for time, n, img in entries],
+                            threads)
+
+
+def ts_merge(ts_paths, out_path, name=None, mode="link", threads=None):
+    """Merge timestreams of the same name and extension into a new one, e.g.
+    after a camera swap.
+
+    Where two timestreams have an image at the same time and counter, a
+    duplicate image is dropped, and a differing one is given the next free
+    ``n`` counter.
+
+    :param list ts_paths: Source timestreams.
+    :param str out_path: New timestream, which mustn't hold any files yet.
+    :param str name: Name of the new timestream. Defaults to the sources'
+                     name.
+    :param str mode: ``"link"`` to hard link images where possible, or
+                     ``"copy"`` to give the new timestream its own copy.
+    :param int threads: Number of threads placing images.
+    :returns: dict -- The manifest of the new timestream.
+    :raises: ValueError if the sources differ in name or extension.
+    """
+    if not isinstance(ts_paths, (list, tuple)) or not ts_paths:
+        msg = PARAM_TYPE_ERR.format(param="ts_paths", func="ts_merge",
+                                    type="non-empty list")
+        LOG.error(msg)
+        raise ValueError(msg)
+    _check_mode(mode, "ts_merge")
+    _check_out_path(out_path, "ts_merge")
+    if threads is None:
+        threads = _default_threads()
+    infos = [ts_get_manifest(x) for x in ts_paths]
+    for key in ("name", "extension"):
+        values = set(info[key] for info in infos)
+        if len(values) > 1:
+            msg = "Can't merge timestreams with different {}s: {}".format(
+                key, ", ".join(sorted(values)))
+            LOG.error(msg)
+            raise ValueError(msg)
+    ts_info = dict(infos[0])
+    ts_info["interval"] = min(info["interval"] for info in infos)
+    if name is not None:
+        ts_info["name"] = name
+    slots = {}
+    jobs = []
+    for ts_path, info in zip(ts_paths, infos):
+        for time, n, img in _list_range(ts_path, info["extension"]):
+            while (time, n) in slots:
+                if filecmp.cmp(img, slots[(time, n)], shallow=False):
+                    break
+                n += 1
+            else:
+                slots[(time, n)] = img
+                jobs.append((img, time, n, mode))
+                continue
+            LOG.debug("Dropping duplicate image {}".format(img))
+    if not jobs:
+        raise ValueError("No images to merge")
+    LOG.info("Merging {:d} images into {}".format(len(jobs), out_path))
+    return _ts_write_placed(out_path, ts_info, jobs, threads)
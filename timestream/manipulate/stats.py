@@ -0,0 +1,303 @@
+"""Per-frame image statistics, for finding night frames, lens fogging and
+camera failures before any expensive processing.
+
+Frames are decoded at a reduced DCT scale, by default 1/8 of full size,
+which is plenty for whole-frame statistics. The statistics of every image
+are kept in a CSV sidecar table, ``frame_stats.csv`` in the timestream root,
+with one row per image, along with the scale they were computed at. Later
+runs only compute statistics for images not yet in the table.
+"""
+import csv
+import logging
+import os
+from os import path
+
+from timestream.manipulate import (
+        ProgressReporter,
+        ts_parallel_map,
+        )
+from timestream.parse import (
+        ts_format_date,
+        ts_get_index,
+        ts_imread,
+        ts_parse_date,
+        )
+from timestream.util import (
+        PARAM_TYPE_ERR,
+        )
+from timestream.util.backends import (
+        lazy_backend,
+        )
+
+cv2 = lazy_backend("cv2")
+np = lazy_backend("numpy")
+LOG = logging.getLogger("timestreamlib")
+#: Name of the sidecar table in the timestream root
+FRAME_STATS_FILENAME = "frame_stats.csv"
+#: Number of bins per channel of the ``histogram`` statistic
+HIST_BINS = 8
+#: Statistics computed by default
+DEFAULT_FRAME_STATS = ["brightness", "contrast", "channels", "sharpness"]
+# Columns that aren't statistics
+_TABLE_KEYS = ["time", "n", "image", "scale"]
+
+
+def _gray(mat):
+    return cv2.cvtColor(mat, cv2.COLOR_BGR2GRAY)
+
+
+def _brightness(mat):
+    return [_gray(mat).mean()]
+
+
+def _contrast(mat):
+    return [_gray(mat).std()]
+
+
+def _channels(mat):
+    return list(mat.reshape(-1, mat.shape[2]).mean(axis=0))
+
+
+def _sharpness(mat):
+    # Variance of the Laplacian: low for blurred or fogged frames
+    return [cv2.Laplacian(_gray(mat), cv2.CV_64F).var()]
+
+
+def _saturation(mat):
+    return [cv2.cvtColor(mat, cv2.COLOR_BGR2HSV)[:, :, 1].mean()]
+
+
+def _dark_fraction(mat):
+    return [np.count_nonzero(_gray(mat) < 32) / float(mat.shape[0] *
+                                                       mat.shape[1])]
+
+
+def _histogram(mat):
+    pixels = mat.reshape(-1, mat.shape[2])
+    hists = [np.bincount(pixels[:, chan] // (256 // HIST_BINS),
+                         minlength=HIST_BINS)
+             for chan in range(mat.shape[2])]
+    return list(np.concatenate(hists) / float(len(pixels)))
+
+
+#: Available statistics: ``{name: (columns, function)}``. Each function takes
+#: a BGR image and returns a list of values, one per column.
+FRAME_STATS = {
+    "brightness": (["brightness"], _brightness),
+    "contrast": (["contrast"], _contrast),
+    "channels": (["mean_b", "mean_g", "mean_r"], _channels),
+    "sharpness": (["sharpness"], _sharpness),
+    "saturation": (["saturation"], _saturation),
+    "dark_fraction": (["dark_fraction"], _dark_fraction),
+    "histogram": (["hist_{}{:d}".format(chan, x) for chan in "bgr"
+                   for x in range(HIST_BINS)], _histogram),
+}
+
+
+def _columns(stats):
+    return [col for stat in stats for col in FRAME_STATS[stat][0]]
+
+
+def _image_stats(args):
+    """Worker: ``(img, stats, scale)`` to ``(img, [values...])``, with
+    values ``None`` if ``img`` can't be decoded."""
+    img, stats, scale = args
+    mat = ts_imread(img, scale)
+    if mat is None:
+        LOG.warn("Couldn't decode {}".format(img))
+        return (img, None)
+    if mat.ndim == 2:
+        mat = cv2.cvtColor(mat, cv2.COLOR_GRAY2BGR)
+    values = []
+    for stat in stats:
+        values.extend(float(x) for x in FRAME_STATS[stat][1](mat))
+    return (img, values)
+
+
+def ts_read_frame_stats(ts_path, table=None):
+    """Read the sidecar statistics table of ``ts_path``.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param str table: Read this table instead of the sidecar.
+    :returns: list -- One ``dict`` per image, sorted by time then ``n``, with
+              keys ``time`` (a ``datetime``), ``n``, ``image`` (path relative
+              to ``ts_path``), ``scale`` (the decoding scale, ``None`` in
+              tables written before it was recorded) and one per statistic
+              column. Values of images which couldn't be decoded are
+              ``None``.
+    """
+    if table is None:
+        table = path.join(ts_path, FRAME_STATS_FILENAME)
+    rows = []
+    if not path.isfile(table):
+        return rows
+    with open(table) as ifh:
+        for row in csv.DictReader(ifh):
+            for key, val in row.items():
+                if key not in _TABLE_KEYS:
+                    row[key] = float(val) if val != "" else None
+            row["time"] = ts_parse_date(row["time"])
+            row["n"] = int(row["n"])
+            row["scale"] = int(row["scale"]) if row.get("scale") else None
+            rows.append(row)
+    return rows
+
+
+def _write_table(table, columns, rows):
+    tmp_path = table + ".tmp"
+    with open(tmp_path, "w") as ofh:
+        writer = csv.writer(ofh, lineterminator="\n")
+        writer.writerow(_TABLE_KEYS + columns)
+        for row in rows:
+            vals = [ts_format_date(row["time"]), row["n"], row["image"],
+                    row["scale"]]
+            for col in columns:
+                val = row[col]
+                vals.append("" if val is None else "{:.6g}".format(val))
+            writer.writerow(vals)
+    os.rename(tmp_path, table)
+
+
+def ts_frame_stats(ts_path, stats=None, scale=8, procs=None,
+                   status_file=None, start=None, end=None, table=None):
+    """Compute per-frame statistics of every image in ``ts_path`` in
+    parallel, updating its sidecar table.
+
+    Only images missing from the table are decoded, unless the table holds
+    a different set of statistics, or statistics decoded at a different
+    ``scale``, in which case it is remade. With
+    ``start`` or ``end``, the table holds only images in that time range,
+    e.g. for one shard of a timestream, so give it its own ``table``.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param list stats: Names of statistics from ``FRAME_STATS``. Defaults to
+                       ``DEFAULT_FRAME_STATS``.
+    :param int scale: Downscaling factor to decode at, see
+                      ``timestream.parse.ts_imread``. Note ``sharpness``
+                      depends on the scale, so compare it only between
+                      frames of the same scale.
+    :param int procs: Number of worker processes.
+    :param str status_file: Optional JSON progress status file.
+    :param datetime.datetime start: Ignore images before ``start``.
+    :param datetime.datetime end: Ignore images after ``end``.
+    :param str table: Table to update instead of the sidecar.
+    :returns: list -- The table, as per ``ts_read_frame_stats``.
+    """
+    if stats is None:
+        stats = DEFAULT_FRAME_STATS
+    if not isinstance(stats, list) or not stats or \
+            any(x not in FRAME_STATS for x in stats):
+        msg = PARAM_TYPE_ERR.format(param="stats", func="ts_frame_stats",
+                                    type="list of FRAME_STATS names")
+        LOG.error(msg)
+        raise ValueError(msg)
+    columns = _columns(stats)
+    start = ts_parse_date(start) if start is not None else None
+    end = ts_parse_date(end) if end is not None else None
+    if table is None:
+        table = path.join(ts_path, FRAME_STATS_FILENAME)
+    old = ts_read_frame_stats(ts_path, table)
+    if old and sorted(set(old[0]) - set(_TABLE_KEYS)) != sorted(columns):
+        LOG.info("Frame statistics have changed, remaking table")
+        old = []
+    elif old and old[0]["scale"] != scale:
+        LOG.info("Frame statistics scale has changed, remaking table")
+        old = []
+    done = dict((row["image"], row) for row in old)
+    index = ts_get_index(ts_path)
+    rows = []
+    todo = []
+    for time, n, img in zip(index["times"], index["n"], index["paths"]):
+        if (start is not None and time < start) or \
+                (end is not None and time > end):
+            continue
+        relpath = path.relpath(img, ts_path)
+        if relpath in done:
+            rows.append(done[relpath])
+        else:
+            row = {"time": time, "n": n, "image": relpath, "scale": scale}
+            rows.append(row)
+            todo.append((img, row))
+    if todo:
+        LOG.info("Computing frame statistics of {:d} images".format(
+            len(todo)))
+        progress = ProgressReporter(total=len(todo), name="ts_frame_stats",
+                                    status_file=status_file)
+        results = ts_parallel_map([img for img, _ in todo], _image_stats,
+                                  [[stats], [scale]], procs=procs,
+                                  progress=progress)
+        # Consume every result, so the map runs to its end
+        for iii, (_, values) in enumerate(results):
+            if values is None:
+                values = [None] * len(columns)
+            todo[iii][1].update(zip(columns, values))
+        progress.finish()
+    _write_table(table, columns, rows)
+    return rows
+
+
+def _table_columns(table):
+    """Statistic columns of a table, in order"""
+    with open(table) as ifh:
+        header = next(csv.reader(ifh))
+    return [col for col in header if col not in _TABLE_KEYS]
+
+
+def ts_merge_frame_stats(ts_path, tables, out=None):
+    """Merge frame statistics tables of parts of ``ts_path``, e.g. of each
+    shard of a sharded run, into one.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param list tables: Tables to merge, all of the same statistics and
+                        scale.
+    :param str out: Table to write, by default the sidecar of ``ts_path``.
+    :returns: list -- The merged table, as per ``ts_read_frame_stats``.
+    """
+    columns = None
+    rows = {}
+    for table in tables:
+        cols = _table_columns(table)
+        if columns is None:
+            columns = cols
+        elif cols != columns:
+            raise ValueError("Table {} has different statistics".format(
+                table))
+        for row in ts_read_frame_stats(ts_path, table):
+            rows[row["image"]] = row
+    if len(set(row["scale"] for row in rows.values())) > 1:
+        raise ValueError("Tables have statistics of different scales")
+    if columns is None:
+        raise ValueError("No tables to merge")
+    rows = sorted(rows.values(), key=lambda x: (x["time"], x["n"]))
+    if out is None:
+        out = path.join(ts_path, FRAME_STATS_FILENAME)
+    _write_table(out, columns, rows)
+    return rows
+
+
+def ts_filter_frames(rows, **bounds):
+    """Select rows of a frame statistics table within bounds, e.g. to drop
+    dark or blurred frames.
+
+    Each keyword is a statistic column, with a ``(min, max)`` tuple; either
+    may be ``None`` for no bound. Rows of images which couldn't be decoded
+    are never selected. For example::
+
+        rows = ts_frame_stats(ts_path)
+        good = ts_filter_frames(rows, brightness=(40, None),
+                                sharpness=(50, None))
+
+    :param list rows: Table, from ``ts_frame_stats`` or
+                      ``ts_read_frame_stats``.
+    :returns: list -- The selected rows.
+    """
+    selected = []
+    for row in rows:
+        for col, (lo, hi) in bounds.items():
+            val = row[col]
+            if val is None or (lo is not None and val < lo) or \
+                    (hi is not None and val > hi):
+                break
+        else:
+            selected.append(row)
+    return selected
@@ -0,0 +1,521 @@
+"""Streaming temporal reducers: per-pixel statistics over time, such as
+background estimates for segmentation, in bounded memory.
+
+Frames are fed one at a time to reducers, which update their state a tile
+at a time, so the temporaries of each update are the size of a tile rather
+than a frame:
+
+* ``RunningMoments`` gives the running mean, variance and standard
+  deviation, by Welford's method.
+* ``RunningMinMax`` gives the running minimum and maximum.
+* ``WindowedMedian`` gives the median. Frames are spilled to a scratch file
+  laid out tile by tile, so the median of each tile is computed holding only
+  that tile of each frame. Beyond ``max_frames`` frames, every other frame
+  kept is dropped, so the median is of an evenly spaced sample of the window,
+  and approximate.
+
+``ts_iter_reduced`` reduces frames, e.g. from ``ts_iter_numpy``, over fixed
+time windows, such as a day, and ``ts_reduce`` writes the reductions of a
+timestream as derived timestreams, one image per window::
+
+    ts_reduce(ts_path, out_root, ["median", "mean"],
+              window=timedelta(days=1), scale=2)
+"""
+from datetime import datetime, timedelta
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numbers
+import os
+from os import path
+import tempfile
+
+from timestream.manipulate import (
+        ProgressReporter,
+        _bounded_imap,
+        )
+from timestream.parse import (
+        _ts_date_to_path,
+        ts_format_date,
+        ts_get_index,
+        ts_get_manifest,
+        ts_imread,
+        ts_parse_date,
+        ts_parse_date_path,
+        ts_update_manifest,
+        )
+from timestream.parse.validate import (
+        IMAGE_EXT_TO_TYPE,
+        )
+from timestream.util import (
+        PARAM_TYPE_ERR,
+        instrument,
+        )
+from timestream.util.backends import (
+        lazy_backend,
+        )
+
+cv2 = lazy_backend("cv2")
+np = lazy_backend("numpy")
+LOG = logging.getLogger("timestreamlib")
+#: Default tile edge, in pixels
+DEFAULT_TILE = 512
+#: Default number of frames ``WindowedMedian`` keeps
+DEFAULT_MEDIAN_FRAMES = 64
+#: Windows are aligned to whole multiples of their length since this time,
+#: so e.g. daily windows start at midnight
+WINDOW_EPOCH = datetime(1970, 1, 1)
+
+
+class TemporalReducer(object):
+    """Base of reducers of a sequence of frames of the same shape.
+
+    Subclasses set ``outputs``, and implement ``_start`` to allocate their
+    state once the frame shape is known, ``_update_tile`` to update the state
+    of tile ``iii``, at ``tile`` (a tuple of slices), from that tile of a
+    frame, and ``_result``.
+    """
+    #: Names of the arrays ``result`` gives
+    outputs = ()
+
+    def __init__(self, tile=DEFAULT_TILE):
+        if not isinstance(tile, int) or tile < 1:
+            msg = PARAM_TYPE_ERR.format(param="tile",
+                                        func=type(self).__name__,
+                                        type="positive int")
+            LOG.error(msg)
+            raise ValueError(msg)
+        self.tile = tile
+        self.count = 0
+        self.shape = None
+        self.dtype = None
+
+    def tiles(self):
+        """Tuples of slices of each tile of a frame, in row-major order"""
+        height, width = self.shape[:2]
+        for y0 in range(0, height, self.tile):
+            for x0 in range(0, width, self.tile):
+                yield (slice(y0, min(y0 + self.tile, height)),
+                       slice(x0, min(x0 + self.tile, width)))
+
+    def _check(self, mat):
+        if self.shape is None:
+            self.shape = mat.shape
+            self.dtype = mat.dtype
+            self._start()
+        elif mat.shape != self.shape:
+            raise ValueError("Frame is {!r}, not {!r}".format(mat.shape,
+                                                             self.shape))
+
+    def update(self, mat):
+        """Add a frame.
+
+        :param numpy.ndarray mat: Frame, of the same shape as the first.
+        """
+        mat = np.asarray(mat)
+        self._check(mat)
+        self.count += 1
+        with instrument.timer("temporal." + type(self).__name__):
+            for iii, tile in enumerate(self.tiles()):
+                self._update_tile(iii, tile, mat[tile])
+
+    def result(self):
+        """The reductions of every frame added so far.
+
+        :returns: dict -- ``{output: numpy.ndarray}``, of the frame shape.
+        """
+        if not self.count:
+            raise ValueError("No frames to reduce")
+        return self._result()
+
+    def close(self):
+        """Free any resources beyond memory"""
+        pass
+
+    def _start(self):
+        raise NotImplementedError
+
+    def _update_tile(self, iii, tile, mat):
+        raise NotImplementedError
+
+    def _result(self):
+        raise NotImplementedError
+
+
+class RunningMoments(TemporalReducer):
+    """Running per-pixel mean, and population variance and standard
+    deviation, by Welford's method. State is two frames of ``dtype``."""
+    outputs = ("mean", "var", "std")
+
+    def __init__(self, tile=DEFAULT_TILE, dtype="f4"):
+        TemporalReducer.__init__(self, tile)
+        self.state_dtype = np.dtype(dtype)
+
+    def _start(self):
+        self._mean = np.zeros(self.shape, self.state_dtype)
+        self._m2 = np.zeros(self.shape, self.state_dtype)
+
+    def _update_tile(self, iii, tile, mat):
+        mat = mat.astype(self.state_dtype)
+        mean = self._mean[tile]
+        delta = mat - mean
+        mean += delta / self.count
+        mat -= mean
+        mat *= delta
+        self._m2[tile] += mat
+
+    def _result(self):
+        var = self._m2 / self.count
+        return {"mean": self._mean.copy(), "var": var, "std": np.sqrt(var)}
+
+
+class RunningMinMax(TemporalReducer):
+    """Running per-pixel minimum and maximum, of the frames' dtype"""
+    outputs = ("min", "max")
+
+    def _start(self):
+        self._min = np.empty(self.shape, self.dtype)
+        self._max = np.empty(self.shape, self.dtype)
+
+    def _update_tile(self, iii, tile, mat):
+        if self.count == 1:
+            self._min[tile] = mat
+            self._max[tile] = mat
+            return
+        np.minimum(self._min[tile], mat, out=self._min[tile])
+        np.maximum(self._max[tile], mat, out=self._max[tile])
+
+    def _result(self):
+        return {"min": self._min.copy(), "max": self._max.copy()}
+
+
+class WindowedMedian(TemporalReducer):
+    """Per-pixel median, of up to ``max_frames`` frames spilled to a scratch
+    file in ``tmpdir``.
+
+    The scratch file holds each tile of the kept frames contiguously, so
+    memory is bounded by the tile size times ``max_frames``. Once
+    ``max_frames`` are kept, every other one is dropped and only every other
+    later frame is kept, so the frames used are always evenly spaced over
+    those added. The median is exact until then. Call ``close`` to remove the
+    scratch file.
+    """
+    outputs = ("median", )
+
+    def __init__(self, tile=DEFAULT_TILE, max_frames=DEFAULT_MEDIAN_FRAMES,
+                 tmpdir=None):
+        TemporalReducer.__init__(self, tile)
+        # Thinning must leave the next frame due to be kept
+        if not isinstance(max_frames, int) or max_frames < 2 or \
+                max_frames % 2:
+            msg = PARAM_TYPE_ERR.format(param="max_frames",
+                                        func="WindowedMedian",
+                                        type="even int of at least 2")
+            LOG.error(msg)
+            raise ValueError(msg)
+        self.max_frames = max_frames
+        self.tmpdir = tmpdir
+        self.kept = 0
+        self.stride = 1
+        self._frames = None
+        self._scratch = None
+
+    def _start(self):
+        n_tiles = len(list(self.tiles()))
+        shape = (n_tiles, self.max_frames, min(self.tile, self.shape[0]),
+                 min(self.tile, self.shape[1])) + self.shape[2:]
+        fd, self._scratch = tempfile.mkstemp(suffix=".median",
+                                             dir=self.tmpdir)
+        os.close(fd)
+        self._frames = np.memmap(self._scratch, dtype=self.dtype, mode="w+",
+                                 shape=shape)
+
+    def _thin(self):
+        for iii in range(self._frames.shape[0]):
+            frames = self._frames[iii]
+            frames[:self.max_frames // 2] = np.array(frames[::2])
+        self.kept = self.max_frames // 2
+        self.stride *= 2
+
+    def update(self, mat):
+        mat = np.asarray(mat)
+        if self.count % self.stride == 0 and self.kept == self.max_frames:
+            self._thin()
+        if self.count % self.stride:
+            self._check(mat)
+            self.count += 1
+            return
+        TemporalReducer.update(self, mat)
+        self.kept += 1
+
+    def _update_tile(self, iii, tile, mat):
+        height, width = mat.shape[:2]
+        self._frames[iii, self.kept, :height, :width] = mat
+
+    def _result(self):
+        median = np.empty(self.shape, "f4")
+        for iii, tile in enumerate(self.tiles()):
+            height = tile[0].stop - tile[0].start
+            width = tile[1].stop - tile[1].start
+            frames = np.array(self._frames[iii, :self.kept, :height, :width])
+            median[tile] = np.median(frames, axis=0)
+        return {"median": median}
+
+    def close(self):
+        self._frames = None
+        if self._scratch is not None:
+            os.unlink(self._scratch)
+            self._scratch = None
+
+
+#: Reducer class of each output
+TEMPORAL_OUTPUTS = {
+    "mean": RunningMoments,
+    "var": RunningMoments,
+    "std": RunningMoments,
+    "min": RunningMinMax,
+    "max": RunningMinMax,
+    "median": WindowedMedian,
+}
+
+
+def _check_outputs(outputs, allowed, func):
+    if not isinstance(outputs, (list, tuple)) or not outputs or \
+            any(x not in allowed for x in outputs):
+        msg = PARAM_TYPE_ERR.format(param="outputs", func=func,
+                                    type="non-empty list of " +
+                                    ", ".join(sorted(allowed)))
+        LOG.error(msg)
+        raise ValueError(msg)
+
+
+def _as_window(window, func):
+    """Coerce ``window`` given as a ``timedelta``, seconds or ``None``"""
+    if window is None or isinstance(window, timedelta):
+        return window
+    if isinstance(window, numbers.Real):
+        return timedelta(seconds=window)
+    msg = PARAM_TYPE_ERR.format(param="window", func=func,
+                                type="datetime.timedelta or number")
+    LOG.error(msg)
+    raise TypeError(msg)
+
+
+def _window_start(time, window):
+    if window is None:
+        return None
+    length = int(window.total_seconds())
+    offset = int((time - WINDOW_EPOCH).total_seconds())
+    return WINDOW_EPOCH + timedelta(seconds=offset - offset % length)
+
+
+def _reduce_window(reducers, outputs):
+    results = {}
+    try:
+        for reducer in reducers:
+            results.update(reducer.result())
+    finally:
+        for reducer in reducers:
+            reducer.close()
+    return dict((output, results[output]) for output in outputs)
+
+
+def ts_iter_reduced(frames, outputs, window=None, tile=DEFAULT_TILE,
+                    max_frames=DEFAULT_MEDIAN_FRAMES, tmpdir=None):
+    """Reduce frames over time windows.
+
+    :param frames: Iterable of ``(img_path, numpy.ndarray)`` in time order,
+                   e.g. from ``timestream.parse.ts_iter_numpy``. Capture
+                   times are parsed from the paths. Frames which couldn't be
+                   decoded (``None``) are skipped.
+    :param list outputs: Names from ``TEMPORAL_OUTPUTS``.
+    :param window: Length of each window, as a ``datetime.timedelta`` or a
+                   number of seconds, or ``None`` to reduce every frame
+                   together. Windows are aligned to ``WINDOW_EPOCH``.
+    :param int tile: Tile edge, in pixels.
+    :param int max_frames: Frames of each window kept for the median, see
+                           ``WindowedMedian``.
+    :param str tmpdir: Directory for the median's scratch file.
+    :returns: generator of ``(window_start, {output: numpy.ndarray})`` for
+              each window with frames. ``window_start`` is the time of the
+              first frame if ``window`` is ``None``. Means, variances,
+              standard deviations and medians are floats, minima and maxima
+              of the frames' dtype.
+    """
+    _check_outputs(outputs, TEMPORAL_OUTPUTS, "ts_iter_reduced")
+    window = _as_window(window, "ts_iter_reduced")
+    if window is not None and window.total_seconds() < 1:
+        raise ValueError("Windows must be at least a second long")
+    classes = []
+    for output in outputs:
+        if TEMPORAL_OUTPUTS[output] not in classes:
+            classes.append(TEMPORAL_OUTPUTS[output])
+
+    def make_reducers():
+        reducers = []
+        for cls in classes:
+            if cls is WindowedMedian:
+                reducers.append(cls(tile, max_frames, tmpdir))
+            else:
+                reducers.append(cls(tile))
+        return reducers
+
+    current = key = None
+    reducers = []
+    try:
+        for img, mat in frames:
+            if mat is None:
+                LOG.warn("Couldn't decode {}, skipping".format(img))
+                continue
+            time = ts_parse_date_path(img)
+            if reducers and _window_start(time, window) != key:
+                if _window_start(time, window) < key:
+                    raise ValueError("Frames aren't in time order at "
+                                     "{}".format(img))
+                done, reducers = reducers, []
+                yield (current, _reduce_window(done, outputs))
+            if not reducers:
+                key = _window_start(time, window)
+                current = key if window is not None else time
+                reducers = make_reducers()
+            for reducer in reducers:
+                reducer.update(mat)
+        if reducers:
+            done, reducers = reducers, []
+            yield (current, _reduce_window(done, outputs))
+    finally:
+        for reducer in reducers:
+            reducer.close()
+
+
+def ts_reduced_name(name, output, ext):
+    """Name of the derived timestream of ``output`` reductions of ``name``,
+    encoded as ``ext``."""
+    return "{}~{}-{}".format(name.partition("~")[0], output, ext.lower())
+
+
+def _decode(args):
+    img, scale = args
+    return (img, ts_imread(img, scale))
+
+
+def _to_image(mat, dtype):
+    """Round and clip a reduction to the range of the frames' ``dtype``"""
+    if mat.dtype == dtype:
+        return mat
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        mat = np.clip(np.round(mat), info.min, info.max)
+    return mat.astype(dtype)
+
+
+def ts_reduce(ts_path, out_root, outputs, window=timedelta(days=1),
+              start=None, end=None, scale=1, ext="png", tile=DEFAULT_TILE,
+              max_frames=DEFAULT_MEDIAN_FRAMES, threads=None, tmpdir=None,
+              status_file=None):
+    """Reduce the images of ``ts_path`` over time windows, writing each
+    output as a derived timestream with one image per window, at the
+    window's start. Images are decoded by a thread pool ahead of the
+    reduction. For variances, or floating point results, use
+    ``ts_iter_reduced``.
+
+    :param str ts_path: Source timestream.
+    :param str out_root: Directory to create derived timestreams in.
+    :param list outputs: Names from ``TEMPORAL_OUTPUTS``, but ``var``.
+    :param window: Length of each window, as a ``datetime.timedelta`` or a
+                   number of seconds, or ``None`` for one window.
+    :param datetime.datetime start: Ignore images before ``start``.
+    :param datetime.datetime end: Ignore images after ``end``.
+    :param int scale: Downscaling factor to decode at, see
+                      ``timestream.parse.ts_imread``.
+    :param str ext: Image extension of the derived timestreams.
+    :param int tile: Tile edge, in pixels.
+    :param int max_frames: Frames of each window kept for the median.
+    :param int threads: Number of decoding threads.
+    :param str tmpdir: Directory for the median's scratch file.
+    :param str status_file: Optional JSON progress status file.
+    :returns: dict -- ``{derived_path: images_written}``.
+    """
+    _check_outputs(outputs, [x for x in TEMPORAL_OUTPUTS if x != "var"],
+                   "ts_reduce")
+    if ext not in IMAGE_EXT_TO_TYPE or IMAGE_EXT_TO_TYPE[ext] == "raw":
+        raise ValueError("Unsupported reduction extension '{}'".format(ext))
+    window = _as_window(window, "ts_reduce")
+    start = ts_parse_date(start) if start is not None else None
+    end = ts_parse_date(end) if end is not None else None
+    index = ts_get_index(ts_path)
+    imgs = [img for time, img in zip(index["times"], index["paths"])
+            if (start is None or time >= start) and
+            (end is None or time <= end)]
+    if not imgs:
+        raise ValueError("No images of {} to reduce".format(ts_path))
+    src_info = ts_get_manifest(ts_path)
+    derived = []
+    for output in outputs:
+        name = ts_reduced_name(src_info["name"], output, ext)
+        info = {
+            "name": name,
+            "version": 1,
+            "image_type": IMAGE_EXT_TO_TYPE[ext],
+            "extension": ext,
+            "interval": int(window.total_seconds() // 60) if window else
+            src_info["interval"],
+        }
+        derived.append((output, path.join(out_root, name), info))
+    if threads is None:
+        threads = multiprocessing.cpu_count()
+    progress = ProgressReporter(total=len(imgs), name="ts_reduce",
+                                status_file=status_file)
+    dtypes = []
+
+    def decoded(pool):
+        jobs = ((img, scale) for img in imgs)
+        for img, mat in _bounded_imap(pool, _decode, jobs, 2 * threads):
+            if mat is not None and not dtypes:
+                dtypes.append(mat.dtype)
+            progress.update()
+            yield (img, mat)
+
+    pool = ThreadPool(threads)
+    written = dict((out_path, 0) for _, out_path, _ in derived)
+    starts = []
+    try:
+        for win_start, results in ts_iter_reduced(decoded(pool), outputs,
+                                                  window, tile, max_frames,
+                                                  tmpdir):
+            starts.append(win_start)
+            for output, out_path, info in derived:
+                img = path.join(out_path, _ts_date_to_path(info, win_start))
+                if not path.isdir(path.dirname(img)):
+                    os.makedirs(path.dirname(img))
+                ok, buf = cv2.imencode("." + ext,
+                                       _to_image(results[output], dtypes[0]))
+                if not ok:
+                    raise IOError("Couldn't encode {}".format(img))
+                tmp_path = img + ".tmp"
+                with open(tmp_path, "wb") as ofh:
+                    ofh.write(buf.tostring())
+                os.rename(tmp_path, img)
+                written[out_path] += 1
+    finally:
+        pool.terminate()
+        pool.join()
+    progress.finish()
+    if not starts:
+        raise ValueError("No images of {} could be decoded".format(ts_path))
+    missing = []
+    if window is not None:
+        time = starts[0]
+        have = set(starts)
+        while time < starts[-1]:
+            if time not in have:
+                missing.append(ts_format_date(time))
+            time += window
+    for output, out_path, info in derived:
+        info["start_datetime"] = starts[0]
+        info["end_datetime"] = starts[-1]
+        info["missing"] = missing
+        ts_update_manifest(out_path, info)
+    LOG.info("Reduced {:d} images of {} into {:d} windows".format(
+        len(imgs), ts_path, len(starts)))
+    return written
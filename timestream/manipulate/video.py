@@ -0,0 +1,199 @@
+"""Export timestreams as time-lapse videos.
+
+Frames are decoded, cropped and resized by a pool of worker processes and
+written straight to ``cv2.VideoWriter`` in time order, so no frames are
+written to disk. Only a few frames per worker are in memory at once,
+however long the video.
+"""
+import logging
+import multiprocessing
+
+from timestream.manipulate import (
+        ProgressReporter,
+        ts_parallel_map,
+        )
+from timestream.manipulate.pyramid import (
+        _dct_scale,
+        )
+from timestream.parse import (
+        ts_filter_duplicates,
+        ts_get_index,
+        ts_image_size,
+        ts_imread,
+        ts_iter_resampled,
+        ts_parse_date,
+        ts_parse_date_path,
+        )
+from timestream.util import (
+        PARAM_TYPE_ERR,
+        )
+from timestream.util.backends import (
+        lazy_backend,
+        )
+
+cv2 = lazy_backend("cv2")
+LOG = logging.getLogger("timestreamlib")
+#: ``strftime`` format of timestamps drawn on frames
+VIDEO_TIMESTAMP_FMT = "%Y-%m-%d %H:%M"
+
+
+def _draw_timestamp(frame, text):
+    """Draw ``text`` in the bottom left corner of ``frame``, in white with a
+    black outline so it shows on any background."""
+    height = frame.shape[0]
+    font_scale = max(0.4, height / 720.0)
+    thickness = max(1, int(round(font_scale * 2)))
+    origin = (int(10 * font_scale), height - int(12 * font_scale))
+    cv2.putText(frame, text, origin, cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                (0, 0, 0), thickness + 2, cv2.LINE_AA)
+    cv2.putText(frame, text, origin, cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                (255, 255, 255), thickness, cv2.LINE_AA)
+
+
+def _video_frame(args):
+    """Worker: decode, crop and resize one frame.
+
+    ``args`` is ``(img, scale, crop, size, timestamp)``, where ``crop`` is
+    ``(x, y, width, height)`` in full resolution pixels, or ``None``. Returns
+    the frame, or ``None`` if ``img`` can't be decoded.
+    """
+    img, scale, crop, size, timestamp = args
+    mat = ts_imread(img, scale)
+    if mat is None:
+        LOG.warn("Couldn't decode {}, skipping".format(img))
+        return None
+    if crop is not None:
+        x, y, width, height = [int(round(v / float(scale))) for v in crop]
+        mat = mat[y:y + height, x:x + width]
+    if (mat.shape[1], mat.shape[0]) != size:
+        mat = cv2.resize(mat, size, interpolation=cv2.INTER_AREA)
+    if timestamp:
+        _draw_timestamp(mat, ts_parse_date_path(img).strftime(timestamp))
+    return mat
+
+
+def _frame_size(src_size, crop, width):
+    """Output frame size as ``(width, height)``, made even as most codecs
+    need."""
+    if crop is not None:
+        src_size = (crop[2], crop[3])
+    if width is None:
+        width = src_size[0]
+    height = int(round(src_size[1] * width / float(src_size[0])))
+    return (max(2, width - width % 2), max(2, height - height % 2))
+
+
+def ts_to_video(ts_path, video_path, fps=25, interval=None, times_of_day=None,
+                tolerance=None, start=None, end=None, crop=None, width=None,
+                timestamp=None, fill_missing=False, fourcc="mp4v",
+                skip_duplicates=False, procs=None, status_file=None):
+    """Write a time-lapse video of the timestream at ``ts_path``.
+
+    With ``interval`` or ``times_of_day``, the timestream is first resampled
+    as per ``timestream.parse.ts_iter_resampled``; otherwise every image is a
+    frame. Images are decoded as small as libjpeg DCT scaling allows while
+    still giving ``width`` pixels.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param str video_path: Video file to write; the container format is
+                           taken from its extension.
+    :param float fps: Frames per second.
+    :param datetime.timedelta interval: Time between frames.
+    :param list times_of_day: ``datetime.time`` objects to take a frame at
+                              each day.
+    :param datetime.timedelta tolerance: Maximum distance from a resampling
+                                         target to an image.
+    :param datetime.datetime start: Ignore images before ``start``.
+    :param datetime.datetime end: Ignore images after ``end``.
+    :param tuple crop: ``(x, y, width, height)`` region of the full
+                       resolution images to keep.
+    :param int width: Frame width, defaults to the (cropped) image width.
+                      Frame height keeps the aspect ratio.
+    :param str timestamp: ``strftime`` format, e.g. ``VIDEO_TIMESTAMP_FMT``,
+                          to draw each image's capture time on its frame.
+    :param bool fill_missing: Repeat the previous frame for resampling
+                              targets with no image, so video time runs
+                              evenly. Otherwise such targets are skipped.
+    :param str fourcc: Four character code of the video codec.
+    :param bool skip_duplicates: Leave out images recorded as duplicate
+                                 frames by
+                                 ``timestream.manipulate.dedup.ts_dedup``.
+    :param int procs: Number of worker processes.
+    :param str status_file: Optional JSON progress status file.
+    :returns: int -- Number of frames written.
+    """
+    if crop is not None and (len(crop) != 4 or min(crop[:2]) < 0 or
+                             min(crop[2:]) < 1):
+        msg = PARAM_TYPE_ERR.format(param="crop", func="ts_to_video",
+                                    type="(x, y, width, height) tuple")
+        LOG.error(msg)
+        raise ValueError(msg)
+    start = ts_parse_date(start) if start is not None else None
+    end = ts_parse_date(end) if end is not None else None
+    if interval is not None or times_of_day is not None:
+        frames = list(ts_iter_resampled(ts_path, interval, times_of_day,
+                                        tolerance, start, end))
+    else:
+        index = ts_get_index(ts_path)
+        frames = [(time, img) for time, img in
+                  zip(index["times"], index["paths"])
+                  if (start is None or time >= start) and
+                  (end is None or time <= end)]
+    if skip_duplicates:
+        kept = set(ts_filter_duplicates(img for _, img in frames
+                                        if img is not None))
+        frames = [(time, img) for time, img in frames
+                  if img is None or img in kept]
+    imgs = [img for _, img in frames if img is not None]
+    if not imgs:
+        raise ValueError("No images for video of {}".format(ts_path))
+    # Size from the first image whose header, or failing that pixels, can be
+    # read, rather than decoding a full resolution frame
+    src_size = next((size for size in (ts_image_size(img) for img in imgs)
+                     if size is not None), None)
+    if src_size is None:
+        raise ValueError("No images for video of {} could be read".format(
+            ts_path))
+    if crop is not None and (crop[0] + crop[2] > src_size[0] or
+                             crop[1] + crop[3] > src_size[1]):
+        raise ValueError("Crop {} is outside the {:d}x{:d} images of {}"
+                         .format(tuple(crop), src_size[0], src_size[1],
+                                 ts_path))
+    size = _frame_size(src_size, crop, width)
+    scale = _dct_scale((crop[2] if crop is not None else src_size[0]),
+                       size[0])
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*fourcc),
+                             fps, size)
+    if not writer.isOpened():
+        raise IOError("Couldn't open video {} with codec {}".format(
+            video_path, fourcc))
+    LOG.info("Writing {:d} frames of {:d}x{:d} to {}, decoding at 1/{:d}"
+             .format(len(imgs), size[0], size[1], video_path, scale))
+    progress = ProgressReporter(total=len(imgs), name="ts_to_video",
+                                status_file=status_file)
+    # A couple of frames per worker keeps them busy while bounding memory
+    max_pending = 2 * (procs or multiprocessing.cpu_count())
+    written = 0
+    last = None
+    results = None
+    try:
+        results = ts_parallel_map(
+            imgs, _video_frame, [[scale], [crop], [size], [timestamp]],
+            procs=procs, progress=progress, max_pending=max_pending)
+        for _, img in frames:
+            if img is None:
+                frame = last if fill_missing else None
+            else:
+                frame = next(results)
+            if frame is None:
+                continue
+            writer.write(frame)
+            written += 1
+            last = frame
+    finally:
+        # Frames are pulled one at a time, so the map never runs to its end
+        if results is not None:
+            results.close()
+        writer.release()
+    progress.finish()
+    return written
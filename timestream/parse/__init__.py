@@ -21,37 +21,67 @@
 .. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
 """
 
+from bisect import (
+    bisect_left,
+)
 import collections
-import cv2
+import csv
 from datetime import (
     datetime,
+    time as dtime,
     timedelta,
 )
 import glob
+import itertools
 from itertools import (
     ifilter,
 )
 import json
 import logging
+import numbers
 import os
 from os import path
+import struct
 from voluptuous import MultipleInvalid
 
+from timestream.parse.raw import (
+    CAMERA_RAW_EXTS,
+    ts_imread_raw,
+)
 from timestream.parse.validate import (
     validate_timestream_manifest,
     IMAGE_EXT_CONSTANTS,
     IMAGE_EXT_TO_TYPE,
     TS_DATE_FORMAT,
+    TS_V1_DIR_LEVELS,
     TS_V1_FMT,
 )
 from timestream.util import (
     PARAM_TYPE_ERR,
     dict_unicode_to_str,
+    instrument,
+)
+from timestream.util.backends import (
+    lazy_backend,
 )
 
 #: Default timestream manifest extension
 MANIFEST_EXT = "tsm"
+#: Name of the duplicate frame table in the timestream root, written by
+#: ``timestream.manipulate.dedup.ts_dedup``
+DEDUP_FILENAME = "dedup.csv"
+#: Downscaling factors which libjpeg can apply while decoding
+DCT_SCALES = [1, 2, 4, 8]
+_CV2_REDUCED_FLAGS = {
+    2: "IMREAD_REDUCED_COLOR_2",
+    4: "IMREAD_REDUCED_COLOR_4",
+    8: "IMREAD_REDUCED_COLOR_8",
+}
 LOG = logging.getLogger("timestreamlib")
+cv2 = lazy_backend("cv2")
+np = lazy_backend("numpy")
+# Time indices of timestreams, keyed by absolute timestream path
+_TS_INDEX_CACHE = {}
 
 
 def _ts_has_manifest(ts_path):
@@ -61,6 +91,7 @@ def _ts_has_manifest(ts_path):
     :returns: The path to the manifest, or ``False``.
     """
     pattern = "{}{}*.{}".format(ts_path, os.sep, MANIFEST_EXT)
+    instrument.incr("listdir.calls")
     manifest = glob.glob(pattern)
     if len(manifest):
         return manifest[0]
@@ -75,6 +106,15 @@ def ts_parse_date_path(img):
     return ts_parse_date(string_time)
 
 
+def ts_parse_n_path(img):
+    """Get the sub-second counter ``n`` from an image's filename"""
+    basename = path.splitext(path.basename(img))[0]
+    try:
+        return int(basename.split("_")[7])
+    except (IndexError, ValueError):
+        return 0
+
+
 def ts_parse_date(dt):
     if isinstance(dt, datetime):
         return dt
@@ -94,15 +134,44 @@ def ts_format_date(dt):
         raise TypeError(msg)
 
 
+def ts_parse_name(name):
+    """Split a timestream name into its conventional components.
+
+    Names look like ``BVZ0022-GC05L-CN650D-Cam07~fullres-orig``, i.e. dash
+    separated experiment/location/camera fields, then a ``~`` and a
+    resolution tag.
+
+    :param str name: Timestream name.
+    :returns: dict -- with keys ``name``, ``experiment``, ``camera`` and
+              ``resolution``. Missing components are ``None``.
+    """
+    if not isinstance(name, str):
+        msg = PARAM_TYPE_ERR.format(param="name", func="ts_parse_name",
+                                    type="str")
+        LOG.error(msg)
+        raise TypeError(msg)
+    prefix, tilde, restag = name.partition("~")
+    fields = prefix.split("-")
+    return {
+        "name": name,
+        "experiment": fields[0] if fields[0] else None,
+        "camera": fields[-1] if len(fields) > 1 else None,
+        "resolution": restag if tilde and restag else None,
+    }
+
+
 def ts_guess_manifest(ts_path):
     """Guesses the values of manifest fields in a timestream
     """
     # This whole thing's one massive fucking kludge. But it seems to work
     # pretty good so, well, whoop.
     retval = {}
+    instrument.incr("manifest.guesses")
     # get a sorted list of all files
     all_files = []
     for root, _, files in os.walk(ts_path):
+        instrument.incr("walk.dirs")
+        instrument.incr("walk.files", len(files))
         for fle in files:
             all_files.append(path.join(root, fle))
     all_files = sorted(all_files)
@@ -173,6 +242,8 @@ def all_files_with_ext(topdir, ext, cs=False):
     # OK, walk the dir. we only care about files, hence why dirs never gets
     # touched
     for root, dirs, files in os.walk(topdir):
+        instrument.incr("walk.dirs")
+        instrument.incr("walk.files", len(files))
         for fpath in files:
             # split out ext, and do any case-conversion we need
             fname, fext = path.splitext(fpath)
@@ -207,8 +278,10 @@ def ts_get_manifest(ts_path):
     if manifest:
         try:
             LOG.debug("Manifest for {} exists at {}".format(ts_path, manifest))
-            with open(manifest) as ifh:
-                manifest = json.load(ifh)
+            instrument.incr("manifest.loads")
+            with instrument.timer("manifest.parse"):
+                with open(manifest) as ifh:
+                    manifest = json.load(ifh)
             if isinstance(manifest, list):
                 # it comes in as a list, we want a dict
                 manifest = dict_unicode_to_str(manifest[0])
@@ -220,13 +293,21 @@ def ts_get_manifest(ts_path):
             manifest = None
     if not manifest:
         LOG.debug("Manifest for {} doesn't exist (yet)".format(ts_path))
-        manifest = ts_guess_manifest(ts_path)
+        with instrument.timer("manifest.guess"):
+            manifest = ts_guess_manifest(ts_path)
         manifest = validate_timestream_manifest(manifest)
     LOG.debug("Manifest for {} is {!r}".format(ts_path, manifest))
     return manifest
 
 
 def ts_update_manifest(ts_path, ts_info):
+    """Write ``ts_info`` as the manifest of the timestream at ``ts_path``.
+    Dates may be given as ``datetime`` objects or formatted strings.
+    """
+    ts_info = dict(ts_info)
+    for key in ("start_datetime", "end_datetime"):
+        if key in ts_info:
+            ts_info[key] = ts_format_date(ts_info[key])
     try:
         mfname = "{}.{}".format(ts_info["name"], MANIFEST_EXT)
         mfname = path.join(ts_path, mfname)
@@ -236,11 +317,17 @@ def ts_update_manifest(ts_path, ts_info):
         LOG.warn("Couldn't write JSON manifest for ts {}".format(ts_path))
 
 
-def ts_iter_images(ts_path):
+def ts_iter_images(ts_path, skip_duplicates=False):
     """Iterate over a ``timestream`` in chronological order
+
+    With ``skip_duplicates``, images recorded as duplicates of an earlier
+    frame by ``timestream.manipulate.dedup.ts_dedup`` are skipped.
     """
     manifest = ts_guess_manifest(ts_path)
-    for fpath in all_files_with_ext(ts_path, manifest["extension"], cs=False):
+    imgs = all_files_with_ext(ts_path, manifest["extension"], cs=False)
+    if skip_duplicates:
+        imgs = ts_filter_duplicates(imgs)
+    for fpath in imgs:
         yield fpath
 
 
@@ -270,6 +357,20 @@ def ts_iter_times(ts_path):
         yield time
 
 
+def ts_num_timepoints(ts_info):
+    """Count the timepoints a manifest says have images, i.e. the expected
+    timepoints between ``start_datetime`` and ``end_datetime`` less those
+    listed as ``missing``.
+
+    :param dict ts_info: A validated manifest, from ``ts_get_manifest``.
+    :returns: int -- The number of timepoints.
+    """
+    range_secs = int((ts_info["end_datetime"] -
+                      ts_info["start_datetime"]).total_seconds())
+    expected = range_secs // (ts_info["interval"] * 60) + 1
+    return max(0, expected - len(ts_info.get("missing", [])))
+
+
 def ts_get_image(ts_path, date, n=0, write_manifest=False):
     """Get the image path of the image in ``ts_path`` at ``date``
     """
@@ -296,6 +397,7 @@ def ts_get_image(ts_path, date, n=0, write_manifest=False):
     # Join to make "absolute" path, i.e. path including ts_path
     abspath = path.join(ts_path, relpath)
     # not-so-silently fail if we can't find the image
+    instrument.incr("stat.calls")
     if path.exists(abspath):
         LOG.debug("Image at {} in {} is {}.".format(date, ts_path, abspath))
         return abspath
@@ -318,17 +420,525 @@ def _ts_date_to_path(ts_info, date, n=0):
     return date.strftime(pth)
 
 
-def ts_iter_numpy(fname_iter):
+def ts_build_index(ts_path):
+    """Build the time index of the timestream at ``ts_path`` with one walk of
+    its directories. No image files are opened or ``stat``-ed.
+
+    :param str ts_path: Path to the root of a timestream.
+    :returns: dict -- with keys ``times``, ``n`` and ``paths``: parallel
+              lists of capture times, sub-second counters and absolute image
+              paths of every image, sorted by time then ``n``.
+    """
+    ts_info = ts_get_manifest(ts_path)
+    entries = []
+    for img in all_files_with_ext(ts_path, ts_info["extension"]):
+        try:
+            entries.append((ts_parse_date_path(img), ts_parse_n_path(img),
+                            img))
+        except ValueError:
+            LOG.warn("Skipping badly named image {}".format(img))
+    entries.sort()
+    return {
+        "times": [x[0] for x in entries],
+        "n": [x[1] for x in entries],
+        "paths": [x[2] for x in entries],
+    }
+
+
+def ts_get_index(ts_path, refresh=False):
+    """Get the time index of ``ts_path``, building it on first use.
+
+    Indices are cached for the life of the process. Pass ``refresh=True``, or
+    call ``ts_index_invalidate``, after images are added to a timestream.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param bool refresh: Rebuild the index even if it's cached.
+    :returns: dict -- The index, as per ``ts_build_index``.
+    """
+    key = path.abspath(ts_path)
+    index = _TS_INDEX_CACHE.get(key)
+    if index is None or refresh:
+        instrument.incr("index.builds")
+        index = ts_build_index(ts_path)
+        _TS_INDEX_CACHE[key] = index
+    else:
+        instrument.incr("index.cache_hits")
+    return index
+
+
+def ts_get_duplicates(ts_path):
+    """Get the images of ``ts_path`` which duplicate an earlier frame, as
+    recorded by ``timestream.manipulate.dedup.ts_dedup``.
+
+    :param str ts_path: Path to the root of a timestream.
+    :returns: set -- Normalised paths of the duplicate images.
+    :raises: IOError if the timestream has no duplicate frame table.
+    """
+    table = path.join(ts_path, DEDUP_FILENAME)
+    if not path.isfile(table):
+        raise IOError("{} has no duplicate frame table, run ts_dedup on it"
+                      .format(ts_path))
+    dups = set()
+    with open(table) as ifh:
+        for row in csv.DictReader(ifh):
+            if row["duplicate_of"]:
+                dups.add(path.normpath(path.join(ts_path, row["image"])))
+    return dups
+
+
+def ts_image_root(img):
+    """Get the root of the V1 timestream holding the image at ``img``"""
+    for _ in range(len(TS_V1_DIR_LEVELS) + 1):
+        img = path.dirname(img)
+    return img
+
+
+def ts_filter_duplicates(imgs):
+    """Drop duplicate frames from image paths, as per ``ts_get_duplicates``.
+    The images may be from several timestreams.
+
+    :param imgs: Iterable of image paths.
+    :returns: generator of the image paths which aren't duplicates.
+    """
+    dups = {}
+    for img in imgs:
+        root = ts_image_root(img)
+        if root not in dups:
+            dups[root] = ts_get_duplicates(root)
+        if path.normpath(img) in dups[root]:
+            instrument.incr("dedup.skipped")
+            continue
+        yield img
+
+
+def ts_index_invalidate(ts_path=None):
+    """Forget the cached index of ``ts_path``, or of all timestreams."""
+    if ts_path is None:
+        _TS_INDEX_CACHE.clear()
+    else:
+        _TS_INDEX_CACHE.pop(path.abspath(ts_path), None)
+
+
+def ts_index_add(ts_path, entries):
+    """Add newly found images to the cached index of ``ts_path``, if there is
+    one, without rebuilding it.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param list entries: ``(time, n, image_path)`` tuples.
+    """
+    index = _TS_INDEX_CACHE.get(path.abspath(ts_path))
+    if index is None:
+        return
+    for time, n, img in sorted(entries):
+        times = index["times"]
+        if not times or (time, n) > (times[-1], index["n"][-1]):
+            # The common case: new images are the newest
+            pos = len(times)
+        else:
+            pos = bisect_left(list(zip(times, index["n"])), (time, n))
+        index["times"].insert(pos, time)
+        index["n"].insert(pos, n)
+        index["paths"].insert(pos, img)
+
+
+def _ts_index_nearest(times, date, tolerance):
+    """Find the position in sorted ``times`` of the time nearest ``date``, or
+    ``None`` if none is within ``tolerance``. Ties go to the earlier time."""
+    pos = bisect_left(times, date)
+    best = None
+    best_diff = None
+    # The nearest time is either the first at or after date, or the last
+    # before it.
+    for cand in (pos - 1, pos):
+        if 0 <= cand < len(times):
+            diff = abs(times[cand] - date)
+            if diff <= tolerance and (best is None or diff < best_diff):
+                best = cand
+                best_diff = diff
+    if best is None:
+        return None
+    # Bursts share a time, so step back to the first image (i.e. n == 0)
+    return bisect_left(times, times[best])
+
+
+def _as_tolerance(tolerance, func):
+    """Coerce ``tolerance`` given as a ``timedelta`` or seconds"""
+    if isinstance(tolerance, timedelta):
+        return tolerance
+    if isinstance(tolerance, numbers.Real):
+        return timedelta(seconds=tolerance)
+    msg = PARAM_TYPE_ERR.format(param="tolerance", func=func,
+                                type="datetime.timedelta or number")
+    LOG.error(msg)
+    raise TypeError(msg)
+
+
+def ts_get_nearest_image(ts_path, date, tolerance=timedelta(seconds=60)):
+    """Get the image in ``ts_path`` captured nearest to ``date``.
+
+    Unlike ``ts_get_image``, the image need not be at exactly ``date``, so
+    this copes with camera clock drift. The search bisects the cached time
+    index of the timestream, so no paths are probed.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param date: Time to look for.
+    :type date: datetime.datetime or str
+    :param tolerance: Maximum allowed distance from ``date``, as a
+                      ``datetime.timedelta`` or a number of seconds.
+    :returns: tuple -- ``(image_path, offset)``, where ``offset`` is the
+              capture time less ``date``, or ``(None, None)`` if no image is
+              within ``tolerance``.
+    """
+    return ts_get_nearest_images(ts_path, [date], tolerance)[0]
+
+
+def ts_get_nearest_images(ts_path, dates, tolerance=timedelta(seconds=60)):
+    """Get the image nearest each of ``dates``, as per
+    ``ts_get_nearest_image``.
+
+    The index is fetched once for all ``dates``.
+
+    :returns: list -- ``(image_path, offset)`` tuples, in the order of
+              ``dates``.
+    """
+    tolerance = _as_tolerance(tolerance, "ts_get_nearest_images")
+    index = ts_get_index(ts_path)
+    times = index["times"]
+    paths = index["paths"]
+    results = []
+    for date in dates:
+        date = ts_parse_date(date)
+        pos = _ts_index_nearest(times, date, tolerance)
+        if pos is None:
+            results.append((None, None))
+        else:
+            results.append((paths[pos], times[pos] - date))
+    return results
+
+
+def _resample_targets(first, last, interval, times_of_day):
+    """Yield target times from midnight before ``first`` up to ``last``,
+    either every ``interval``, or at each of ``times_of_day`` on every
+    day."""
+    day = datetime.combine(first.date(), dtime())
+    if times_of_day is not None:
+        times_of_day = sorted(times_of_day)
+        while day <= last:
+            for tod in times_of_day:
+                yield datetime.combine(day.date(), tod)
+            day += timedelta(days=1)
+    else:
+        target = day
+        while target <= last:
+            yield target
+            target += interval
+
+
+def ts_iter_resampled(ts_path, interval=None, times_of_day=None,
+                      tolerance=None, start=None, end=None):
+    """Iterate over a timestream at a coarser time resolution, picking the
+    image nearest each target time from the cached time index.
+
+    Targets are either every ``interval`` (aligned to midnight), or each of
+    ``times_of_day`` on every day, e.g. ``[datetime.time(12)]`` for one image
+    per day at noon. Only the chosen images' paths are produced, so no other
+    images are touched.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param datetime.timedelta interval: Time between targets.
+    :param list times_of_day: ``datetime.time`` objects to target each day.
+    :param datetime.timedelta tolerance: Maximum distance from a target to an
+                                         image. Defaults to half of
+                                         ``interval``, or 30 minutes.
+    :param datetime.datetime start: Ignore targets before ``start``.
+    :param datetime.datetime end: Ignore targets after ``end``.
+    :returns: generator of ``(target_time, image_path)`` tuples. The image
+              path is ``None`` if no image is within ``tolerance``.
+    """
+    if (interval is None) == (times_of_day is None):
+        msg = "ts_iter_resampled needs exactly one of interval or times_of_day"
+        LOG.error(msg)
+        raise ValueError(msg)
+    if interval is not None and not isinstance(interval, timedelta):
+        msg = PARAM_TYPE_ERR.format(param="interval",
+                                    func="ts_iter_resampled",
+                                    type="datetime.timedelta")
+        LOG.error(msg)
+        raise TypeError(msg)
+    # Targets must advance, or they would never pass the last image
+    if interval is not None and interval <= timedelta(0):
+        msg = PARAM_TYPE_ERR.format(param="interval",
+                                    func="ts_iter_resampled",
+                                    type="positive datetime.timedelta")
+        LOG.error(msg)
+        raise ValueError(msg)
+    if times_of_day is not None and not times_of_day:
+        msg = PARAM_TYPE_ERR.format(param="times_of_day",
+                                    func="ts_iter_resampled",
+                                    type="non-empty list of datetime.time")
+        LOG.error(msg)
+        raise ValueError(msg)
+    if tolerance is None:
+        if interval is not None:
+            tolerance = interval // 2
+        else:
+            tolerance = timedelta(minutes=30)
+    tolerance = _as_tolerance(tolerance, "ts_iter_resampled")
+    index = ts_get_index(ts_path)
+    times = index["times"]
+    if not times:
+        return
+    first = times[0] - tolerance if start is None else start
+    last = times[-1] + tolerance if end is None else end
+    for target in _resample_targets(first, last, interval, times_of_day):
+        if target < first or target > last:
+            continue
+        pos = _ts_index_nearest(times, target, tolerance)
+        yield (target, index["paths"][pos] if pos is not None else None)
+
+
+def _ts_iter_dirs(dirpath, levels, start, end):
+    """Recursively yield the leaf directories below ``dirpath`` of a V1
+    hierarchy, in chronological order, skipping any outside ``start`` to
+    ``end``. Directory names are zero-padded dates, so they are compared as
+    strings to the bounds formatted the same way."""
+    fmt = levels[0]
+    lo = start.strftime(fmt) if start is not None else None
+    hi = end.strftime(fmt) if end is not None else None
+    instrument.incr("listdir.calls")
+    try:
+        names = sorted(os.listdir(dirpath))
+    except OSError:
+        return
+    for name in names:
+        if (lo is not None and name < lo) or (hi is not None and name > hi):
+            continue
+        try:
+            datetime.strptime(name, fmt)
+        except ValueError:
+            continue
+        subdir = path.join(dirpath, name)
+        if len(levels) == 1:
+            yield subdir
+        else:
+            for leaf in _ts_iter_dirs(subdir, levels[1:], start, end):
+                yield leaf
+
+
+def ts_iter_hour_dirs(ts_path, start=None, end=None):
+    """Iterate over the hour directories of a V1 timestream in chronological
+    order. Only directories which could hold images from ``start`` to ``end``
+    are listed, so a short time range of a long timestream is cheap.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param datetime.datetime start: Earliest time of interest.
+    :param datetime.datetime end: Latest time of interest.
+    :returns: generator of paths to hour directories.
+    """
+    start = ts_parse_date(start) if start is not None else None
+    end = ts_parse_date(end) if end is not None else None
+    return _ts_iter_dirs(ts_path, TS_V1_DIR_LEVELS, start, end)
+
+
+def _ts_list_hour_dir(hour_dir, ext, start=None, end=None):
+    """List the images in ``hour_dir`` with extension ``ext``, from ``start``
+    to ``end``, as sorted ``(time, n, path)`` tuples."""
+    ext = "." + ext.lower()
+    instrument.incr("listdir.calls")
+    entries = []
+    for fname in os.listdir(hour_dir):
+        if path.splitext(fname)[1].lower() != ext:
+            continue
+        try:
+            time = ts_parse_date_path(fname)
+        except ValueError:
+            continue
+        if (start is not None and time < start) or \
+                (end is not None and time > end):
+            continue
+        entries.append((time, ts_parse_n_path(fname),
+                        path.join(hour_dir, fname)))
+    instrument.incr("walk.files", len(entries))
+    entries.sort()
+    return entries
+
+
+def ts_iter_bursts(ts_path, start=None, end=None, skip_duplicates=False):
+    """Iterate over every image of a timestream, grouped by timepoint.
+
+    This includes all images of sub-second bursts, i.e. all values of the
+    ``n`` counter, and needs just one directory listing per hour directory.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param datetime.datetime start: Skip timepoints before ``start``.
+    :param datetime.datetime end: Skip timepoints after ``end``.
+    :param bool skip_duplicates: Skip images which duplicate an earlier
+                                 frame, as per ``ts_get_duplicates``, and
+                                 timepoints with only such images.
+    :returns: generator of ``(time, [image_path, ...])`` tuples, with paths
+              in order of ``n``.
+    """
+    start = ts_parse_date(start) if start is not None else None
+    end = ts_parse_date(end) if end is not None else None
+    ext = ts_get_manifest(ts_path)["extension"]
+    dups = ts_get_duplicates(ts_path) if skip_duplicates else set()
+    for hour_dir in ts_iter_hour_dirs(ts_path, start, end):
+        entries = _ts_list_hour_dir(hour_dir, ext, start, end)
+        for time, group in itertools.groupby(entries, lambda x: x[0]):
+            imgs = [x[2] for x in group if path.normpath(x[2]) not in dups]
+            if imgs:
+                yield (time, imgs)
+
+
+def ts_read_burst(imgs, scale=1):
+    """Decode a burst of images into one array.
+
+    :param list imgs: Image paths, e.g. from ``ts_iter_bursts``. The images
+                      must all be the same size.
+    :param int scale: Downscaling factor, as per ``ts_imread``.
+    :returns: numpy.ndarray -- of shape ``(len(imgs), height, width,
+              channels)``.
+    """
+    mats = []
+    for img in imgs:
+        mat = ts_imread(img, scale)
+        if mat is None:
+            raise IOError("Couldn't decode image {}".format(img))
+        mats.append(mat)
+    return np.stack(mats)
+
+
+def ts_imread(img, scale=1):
+    """Decode ``img`` with OpenCV, reduced in size by a factor of ``scale``.
+
+    For scales in ``DCT_SCALES``, JPEGs are downscaled during decoding by
+    libjpeg's DCT scaling, which is much faster than decoding the full image
+    and resizing it. Other scales are decoded in full and resized.
+
+    :param str img: Path to image file.
+    :param int scale: Downscaling factor.
+    :returns: numpy.ndarray -- The image, or ``None`` if it couldn't be read.
+    """
+    if scale in _CV2_REDUCED_FLAGS:
+        with instrument.timer("decode.cv2_reduced"):
+            mat = cv2.imread(img, getattr(cv2, _CV2_REDUCED_FLAGS[scale]))
+    else:
+        with instrument.timer("decode.cv2"):
+            mat = cv2.imread(img)
+        if mat is not None and scale != 1:
+            height, width = mat.shape[:2]
+            size = (max(1, int(width / scale)), max(1, int(height / scale)))
+            mat = cv2.resize(mat, size, interpolation=cv2.INTER_AREA)
+    if instrument.enabled():
+        instrument.incr("read.bytes", path.getsize(img))
+        instrument.incr("decode.images")
+    return mat
+
+
+def _exif_orientation(app1):
+    """EXIF orientation tag of a JPEG APP1 segment, or ``None`` if it isn't
+    EXIF, or has no orientation"""
+    if app1[:6] != b"Exif\0\0":
+        return None
+    tiff = app1[6:]
+    endian = "<" if tiff[:2] == b"II" else ">"
+    ifd = struct.unpack(endian + "I", tiff[4:8])[0]
+    count = struct.unpack(endian + "H", tiff[ifd:ifd + 2])[0]
+    for iii in range(count):
+        entry = tiff[ifd + 2 + 12 * iii:ifd + 14 + 12 * iii]
+        tag = struct.unpack(endian + "H", entry[:2])[0]
+        if tag == 0x0112:
+            return struct.unpack(endian + "H", entry[8:10])[0]
+    return None
+
+
+def _jpeg_size(ifh):
+    """``(width, height)`` from the frame header of the JPEG open at
+    ``ifh``, just after its start of image marker, or ``None``. Like
+    ``cv2.imread``, EXIF orientation is applied, so rotated images have
+    their width and height swapped."""
+    orientation = 1
+    while True:
+        marker = ifh.read(2)
+        if len(marker) < 2 or marker[0:1] != b"\xff":
+            return None
+        code = ord(marker[1:2])
+        if code == 0xff:
+            # Fill byte before the marker
+            ifh.seek(-1, os.SEEK_CUR)
+            continue
+        if code == 0x01 or 0xd0 <= code <= 0xd8:
+            # Markers without a segment
+            continue
+        length = struct.unpack(">H", ifh.read(2))[0]
+        if code == 0xe1:
+            orientation = (_exif_orientation(ifh.read(length - 2)) or
+                           orientation)
+            continue
+        # Start of frame markers, but DHT, JPG and DAC
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack(">xHH", ifh.read(5))
+            if orientation in (5, 6, 7, 8):
+                return (height, width)
+            return (width, height)
+        ifh.seek(length - 2, os.SEEK_CUR)
+
+
+def ts_image_size(img):
+    """Size of ``img`` in pixels, without decoding it where possible.
+
+    JPEG and PNG sizes are read from their headers; other images are
+    decoded.
+
+    :param str img: Path to image file.
+    :returns: tuple -- ``(width, height)``, or ``None`` if the image can't be
+              read.
+    """
+    size = None
+    try:
+        with open(img, "rb") as ifh:
+            head = ifh.read(24)
+            if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+                size = struct.unpack(">II", head[16:24])
+            elif head[:2] == b"\xff\xd8":
+                ifh.seek(2)
+                size = _jpeg_size(ifh)
+    except (IOError, struct.error):
+        return None
+    if size is not None and min(size) > 0:
+        return tuple(int(x) for x in size)
+    mat = ts_imread(img)
+    if mat is None:
+        return None
+    return (mat.shape[1], mat.shape[0])
+
+
+def ts_iter_numpy(fname_iter, raw_mode=None):
     """Take each image filename from ``fname_iter`` and yield the image as a
     numpy array, via ``cv2.imread``. The image is returned as a tuple of
     ``(img_path, img_matrix)``.
+
+    If ``raw_mode`` is one of ``timestream.parse.raw.RAW_DECODE_MODES``,
+    camera raw images are decoded in that mode by
+    ``timestream.parse.raw.ts_imread_raw``, rather than fully demosaiced by
+    the freeimage plugin.
     """
     for img in fname_iter:
+        if raw_mode is not None and \
+                path.splitext(img)[1][1:].lower() in CAMERA_RAW_EXTS:
+            yield (img, ts_imread_raw(img, raw_mode))
+            continue
         try:
             import skimage.io as imgio
-            yield (img, imgio.imread(img, plugin="freeimage"))
+            with instrument.timer("decode.skimage"):
+                mat = imgio.imread(img, plugin="freeimage")
         except ImportError:
             LOG.warn("Couln't load scikit image io module. " +
                      "Raw images not supported")
-            yield (img, cv2.imread(img))
+            with instrument.timer("decode.cv2"):
+                mat = cv2.imread(img)
+        if instrument.enabled():
+            instrument.incr("read.bytes", path.getsize(img))
+            instrument.incr("decode.images")
+        yield (img, mat)
 
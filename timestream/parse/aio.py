@@ -0,0 +1,186 @@
+# Copyright 2014 Kevin Murray
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: timestream.parse.aio
+    :platform: Unix, Windows
+    :synopsis: Asyncio access to timestreams on high-latency filesystems.
+
+Every function here returns an ``asyncio`` future, which can be awaited (or
+``yield From``-ed under trollius on Python 2). Blocking filesystem calls run
+in a shared thread pool, so at most ``max_workers`` of them are in flight at
+once; set that with ``ts_aio_set_concurrency``. On NFS or SMB mounts, where
+each ``listdir``, ``stat`` and ``open`` costs milliseconds, hundreds of
+requests can be kept in flight this way.
+
+.. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+from timestream.parse import (
+    _ts_list_hour_dir,
+    ts_get_manifest,
+    ts_get_nearest_image,
+    ts_iter_hour_dirs,
+    ts_parse_date,
+)
+from timestream.util import (
+    PARAM_TYPE_ERR,
+    instrument,
+)
+
+#: Default maximum number of blocking filesystem calls in flight
+DEFAULT_CONCURRENCY = 64
+LOG = logging.getLogger("timestreamlib")
+
+_EXECUTOR = {"executor": None, "max_workers": DEFAULT_CONCURRENCY}
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def ts_aio_set_concurrency(max_workers):
+    """Set the maximum number of blocking calls in flight at once. The
+    current thread pool finishes its queued work and is replaced.
+
+    :param int max_workers: Concurrency limit.
+    """
+    if not isinstance(max_workers, int) or max_workers < 1:
+        msg = PARAM_TYPE_ERR.format(param="max_workers",
+                                    func="ts_aio_set_concurrency",
+                                    type="positive int")
+        LOG.error(msg)
+        raise ValueError(msg)
+    with _EXECUTOR_LOCK:
+        old = _EXECUTOR["executor"]
+        _EXECUTOR["executor"] = None
+        _EXECUTOR["max_workers"] = max_workers
+    if old is not None:
+        old.shutdown(wait=False)
+
+
+def _executor():
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR["executor"] is None:
+            _EXECUTOR["executor"] = ThreadPoolExecutor(
+                _EXECUTOR["max_workers"])
+        return _EXECUTOR["executor"]
+
+
+def _run(loop, func, *args):
+    """Run ``func(*args)`` in the bounded thread pool, returning a future"""
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    return loop.run_in_executor(_executor(), func, *args)
+
+
+def _read_file(img):
+    with open(img, "rb") as ifh:
+        data = ifh.read()
+    instrument.incr("read.bytes", len(data))
+    return data
+
+
+def ts_aio_get_manifest(ts_path, loop=None):
+    """Load the manifest of ``ts_path``, as per ``ts_get_manifest``.
+
+    :returns: asyncio.Future -- of the manifest ``dict``.
+    """
+    return _run(loop, ts_get_manifest, ts_path)
+
+
+def ts_aio_get_nearest_image(ts_path, date, tolerance=60, loop=None):
+    """Find the image nearest ``date``, as per ``ts_get_nearest_image``.
+
+    :returns: asyncio.Future -- of an ``(image_path, offset)`` tuple.
+    """
+    return _run(loop, ts_get_nearest_image, ts_path, date, tolerance)
+
+
+def ts_aio_read_bytes(img, loop=None):
+    """Read the whole of the file ``img``.
+
+    :returns: asyncio.Future -- of the file's contents as ``bytes``.
+    """
+    return _run(loop, _read_file, img)
+
+
+def ts_aio_read_many(imgs, loop=None):
+    """Read many files concurrently, within the concurrency limit.
+
+    :returns: asyncio.Future -- of a list of file contents, in the order of
+              ``imgs``.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    if not imgs:
+        result = asyncio.Future(loop=loop)
+        result.set_result([])
+        return result
+    return asyncio.gather(*[ts_aio_read_bytes(img, loop) for img in imgs])
+
+
+def _list_hour_dirs(ts_path, start, end):
+    ext = ts_get_manifest(ts_path)["extension"]
+    return (ext, list(ts_iter_hour_dirs(ts_path, start, end)))
+
+
+def ts_aio_list_range(ts_path, start=None, end=None, loop=None):
+    """List all images of ``ts_path`` from ``start`` to ``end``.
+
+    The date-pruned directory hierarchy is found first, then every hour
+    directory in range is listed concurrently.
+
+    :returns: asyncio.Future -- of a sorted list of ``(time, image_path)``
+              tuples, including all sub-second images.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    start = ts_parse_date(start) if start is not None else None
+    end = ts_parse_date(end) if end is not None else None
+    result = asyncio.Future(loop=loop)
+
+    def got_listings(fut):
+        if result.cancelled():
+            return
+        if fut.exception() is not None:
+            result.set_exception(fut.exception())
+            return
+        result.set_result([(time, img) for listing in fut.result()
+                           for time, _, img in listing])
+
+    def got_dirs(fut):
+        if result.cancelled():
+            return
+        if fut.exception() is not None:
+            result.set_exception(fut.exception())
+            return
+        ext, hour_dirs = fut.result()
+        if not hour_dirs:
+            result.set_result([])
+            return
+        listings = asyncio.gather(*[
+            _run(loop, _ts_list_hour_dir, hour_dir, ext, start, end)
+            for hour_dir in hour_dirs])
+        listings.add_done_callback(got_listings)
+
+    _run(loop, _list_hour_dirs, ts_path, start, end).add_done_callback(
+        got_dirs)
+    return result
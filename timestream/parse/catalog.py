@@ -0,0 +1,256 @@
+# Copyright 2014 Kevin Murray
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: timestream.parse.catalog
+    :platform: Unix, Windows
+    :synopsis: Discover and index many timestreams under a storage root.
+
+.. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
+"""
+
+from fnmatch import fnmatchcase
+import json
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+from os import path
+import re
+
+from timestream.parse import (
+    MANIFEST_EXT,
+    _ts_has_manifest,
+    ts_format_date,
+    ts_get_manifest,
+    ts_parse_name,
+)
+from timestream.util import (
+    PARAM_TYPE_ERR,
+    dict_unicode_to_str,
+    instrument,
+)
+
+#: Default catalog file name, written at the top of the storage root
+CATALOG_FILENAME = ".timestream_catalog.json"
+#: Version of the catalog file format
+CATALOG_VERSION = 1
+LOG = logging.getLogger("timestreamlib")
+_YEAR_DIR = re.compile(r"^\d{4}$")
+
+
+def _default_threads():
+    # Catalog work is dominated by filesystem latency, not CPU, so we use more
+    # threads than cores.
+    return min(32, 4 * multiprocessing.cpu_count())
+
+
+def _scan_dir(dirpath):
+    """List ``dirpath`` once, returning ``(is_timestream, subdirs)``.
+
+    A directory is a timestream if it holds a manifest, or a ``%Y`` folder
+    as per the V1 hierarchy.
+    """
+    instrument.incr("listdir.calls")
+    try:
+        entries = os.listdir(dirpath)
+    except OSError:
+        LOG.warn("Couldn't list directory {}".format(dirpath))
+        return (False, [])
+    subdirs = []
+    is_ts = False
+    for entry in entries:
+        full = path.join(dirpath, entry)
+        if entry.endswith("." + MANIFEST_EXT) and path.isfile(full):
+            is_ts = True
+        elif path.isdir(full):
+            if _YEAR_DIR.match(entry):
+                is_ts = True
+            subdirs.append(full)
+    return (is_ts, subdirs)
+
+
+def ts_find_timestreams(root, max_depth=3, threads=None):
+    """Find all timestream roots below ``root``.
+
+    Directory levels are listed in parallel, and we never descend into a
+    timestream once found.
+
+    :param str root: Storage root to search.
+    :param int max_depth: How many directory levels below ``root`` to search.
+    :param int threads: Number of listing threads.
+    :returns: list -- Sorted paths to timestream roots.
+    """
+    if not isinstance(root, str):
+        msg = PARAM_TYPE_ERR.format(param="root", func="ts_find_timestreams",
+                                    type="str")
+        LOG.error(msg)
+        raise TypeError(msg)
+    if threads is None:
+        threads = _default_threads()
+    found = []
+    level = [root]
+    pool = ThreadPool(threads)
+    try:
+        for _ in range(max_depth + 1):
+            if not level:
+                break
+            next_level = []
+            for dirpath, (is_ts, subdirs) in zip(level,
+                                                 pool.map(_scan_dir, level)):
+                if is_ts:
+                    found.append(dirpath)
+                else:
+                    next_level.extend(subdirs)
+            level = next_level
+    finally:
+        pool.close()
+        pool.join()
+    return sorted(found)
+
+
+def _ts_mtime(ts_path):
+    """The change marker for a timestream: the newer of the timestream root
+    and its manifest's modification times."""
+    mtime = os.stat(ts_path).st_mtime
+    manifest = _ts_has_manifest(ts_path)
+    if manifest:
+        mtime = max(mtime, os.stat(manifest).st_mtime)
+    return mtime
+
+
+def _catalog_entry(ts_path):
+    """Make a catalog entry for the timestream at ``ts_path``, or ``None`` if
+    it can't be parsed."""
+    try:
+        mtime = _ts_mtime(ts_path)
+        manifest = ts_get_manifest(ts_path)
+    except Exception as exc:
+        LOG.warn("Couldn't catalog timestream {}: {}".format(ts_path, exc))
+        return None
+    entry = ts_parse_name(manifest["name"])
+    entry.update({
+        "extension": manifest["extension"],
+        "image_type": manifest["image_type"],
+        "interval": manifest["interval"],
+        "start_datetime": ts_format_date(manifest["start_datetime"]),
+        "end_datetime": ts_format_date(manifest["end_datetime"]),
+        "mtime": mtime,
+    })
+    return entry
+
+
+def ts_catalog_load(catalog_path):
+    """Read a catalog file, returning an empty catalog if it doesn't exist or
+    can't be read.
+
+    :param str catalog_path: Path to catalog file.
+    :returns: dict -- The catalog.
+    """
+    try:
+        with open(catalog_path) as ifh:
+            catalog = dict_unicode_to_str(json.load(ifh))
+        if catalog.get("version") == CATALOG_VERSION:
+            return catalog
+        LOG.warn("Catalog {} has an old format, ignoring".format(catalog_path))
+    except (IOError, OSError, ValueError):
+        LOG.debug("No usable catalog at {}".format(catalog_path))
+    return {"version": CATALOG_VERSION, "timestreams": {}}
+
+
+def ts_catalog_update(root, catalog_path=None, threads=None, max_depth=3):
+    """Create or refresh the catalog of all timestreams under ``root``.
+
+    Only timestreams whose root directory or manifest has changed since the
+    last update are re-read, in parallel. The catalog is written back to
+    ``catalog_path``.
+
+    :param str root: Storage root holding timestreams.
+    :param str catalog_path: Catalog file. Defaults to ``CATALOG_FILENAME``
+                             in ``root``.
+    :param int threads: Number of threads to read timestreams with.
+    :param int max_depth: How deep below ``root`` to search for timestreams.
+    :returns: dict -- The updated catalog.
+    """
+    if catalog_path is None:
+        catalog_path = path.join(root, CATALOG_FILENAME)
+    if threads is None:
+        threads = _default_threads()
+    catalog = ts_catalog_load(catalog_path)
+    old = catalog["timestreams"]
+    new = {}
+    stale = []
+    for ts_path in ts_find_timestreams(root, max_depth, threads):
+        relpath = path.relpath(ts_path, root)
+        entry = old.get(relpath)
+        try:
+            unchanged = entry and entry["mtime"] == _ts_mtime(ts_path)
+        except OSError:
+            continue
+        if unchanged:
+            new[relpath] = entry
+        else:
+            stale.append(relpath)
+    instrument.incr("catalog.cache_hits", len(new))
+    instrument.incr("catalog.refreshes", len(stale))
+    LOG.info("Catalog: {:d} timestreams unchanged, {:d} to refresh".format(
+        len(new), len(stale)))
+    if stale:
+        pool = ThreadPool(threads)
+        try:
+            entries = pool.map(_catalog_entry,
+                               [path.join(root, x) for x in stale])
+        finally:
+            pool.close()
+            pool.join()
+        for relpath, entry in zip(stale, entries):
+            if entry is not None:
+                new[relpath] = entry
+    catalog["timestreams"] = new
+    tmp_path = catalog_path + ".tmp"
+    with open(tmp_path, "w") as ofh:
+        json.dump(catalog, ofh, indent=1, sort_keys=True)
+    os.rename(tmp_path, catalog_path)
+    return catalog
+
+
+def ts_catalog_query(catalog, name=None, start=None, end=None):
+    """Find timestreams in ``catalog`` by name and/or time span.
+
+    :param dict catalog: A catalog from ``ts_catalog_update`` or
+                         ``ts_catalog_load``.
+    :param str name: ``fnmatch``-style pattern matched against the timestream
+                     name, e.g. ``"BVZ0022-*~fullres-*"``.
+    :param start: Only return timestreams with images at or after ``start``.
+    :param end: Only return timestreams with images at or before ``end``.
+    :type start: datetime.datetime or str
+    :type end: datetime.datetime or str
+    :returns: list -- ``(relpath, entry)`` tuples, sorted by path.
+    """
+    # Formatted dates sort lexicographically, so we can compare them as-is
+    if start is not None:
+        start = ts_format_date(start)
+    if end is not None:
+        end = ts_format_date(end)
+    results = []
+    for relpath, entry in sorted(catalog["timestreams"].items()):
+        if name is not None and not fnmatchcase(entry["name"], name):
+            continue
+        if start is not None and entry["end_datetime"] < start:
+            continue
+        if end is not None and entry["start_datetime"] > end:
+            continue
+        results.append((relpath, entry))
+    return results
@@ -0,0 +1,271 @@
+# Copyright 2014 Kevin Murray
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: timestream.parse.checksum
+    :platform: Unix, Windows
+    :synopsis: Checksum manifests and integrity verification of timestreams.
+
+Checksums of every image are kept in a BagIt-style payload manifest,
+``manifest-<algorithm>.txt`` in the timestream root, with one
+``<checksum> <path>`` line per image, paths being relative to the root. Next
+to it, ``.manifest-<algorithm>.stat.json`` records each image's size and
+modification time when it was hashed, so later runs need only re-hash images
+which have changed since.
+
+.. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
+"""
+
+import hashlib
+import json
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+from os import path
+
+from timestream.parse import (
+    all_files_with_ext,
+    ts_get_manifest,
+)
+from timestream.util import (
+    PARAM_TYPE_ERR,
+    instrument,
+)
+
+#: Supported checksum algorithms
+CHECKSUM_ALGORITHMS = ("md5", "sha1", "sha256", "sha512", "blake2b")
+#: Size of each read when hashing. Large reads keep disks streaming, and
+#: hashlib releases the GIL while hashing them, so threads hash in parallel.
+HASH_BUFSIZE = 4 * 1024 * 1024
+LOG = logging.getLogger("timestreamlib")
+
+
+def _default_threads():
+    return min(32, 2 * multiprocessing.cpu_count())
+
+
+def _new_hash(algorithm):
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        msg = PARAM_TYPE_ERR.format(param="algorithm", func="_new_hash",
+                                    type=" or ".join(CHECKSUM_ALGORITHMS))
+        LOG.error(msg)
+        raise ValueError(msg)
+    if algorithm == "blake2b":
+        try:
+            return hashlib.blake2b()
+        except AttributeError:
+            # Python < 3.6 needs the pyblake2 backport
+            try:
+                import pyblake2
+            except ImportError:
+                raise ValueError("blake2b checksums need Python 3.6+ or the "
+                                 "pyblake2 module")
+            return pyblake2.blake2b()
+    return hashlib.new(algorithm)
+
+
+def ts_checksum_manifest_path(ts_path, algorithm="sha256"):
+    """Path of the payload manifest of ``ts_path`` for ``algorithm``."""
+    return path.join(ts_path, "manifest-{}.txt".format(algorithm))
+
+
+def _stat_cache_path(ts_path, algorithm):
+    return path.join(ts_path, ".manifest-{}.stat.json".format(algorithm))
+
+
+def ts_hash_file(fname, algorithm="sha256", bufsize=HASH_BUFSIZE):
+    """Checksum the file ``fname``.
+
+    :param str fname: File to hash.
+    :param str algorithm: One of ``CHECKSUM_ALGORITHMS``.
+    :param int bufsize: Bytes to read at a time.
+    :returns: str -- The hex digest.
+    """
+    digest = _new_hash(algorithm)
+    with open(fname, "rb") as ifh:
+        while True:
+            buf = ifh.read(bufsize)
+            if not buf:
+                break
+            digest.update(buf)
+            instrument.incr("checksum.bytes", len(buf))
+    instrument.incr("checksum.files")
+    return digest.hexdigest()
+
+
+def ts_read_checksums(manifest_path):
+    """Read a BagIt-style manifest file.
+
+    :param str manifest_path: Path to manifest.
+    :returns: dict -- ``{relative_path: checksum}``, empty if the manifest
+              doesn't exist.
+    """
+    checksums = {}
+    try:
+        with open(manifest_path) as ifh:
+            for line in ifh:
+                line = line.rstrip("\r\n")
+                if not line:
+                    continue
+                checksum, _, relpath = line.partition(" ")
+                checksums[relpath.lstrip(" *")] = checksum.lower()
+    except IOError:
+        LOG.debug("No checksum manifest at {}".format(manifest_path))
+    return checksums
+
+
+def _load_stat_cache(ts_path, algorithm):
+    try:
+        with open(_stat_cache_path(ts_path, algorithm)) as ifh:
+            return dict((str(k), tuple(v)) for k, v in json.load(ifh).items())
+    except (IOError, ValueError):
+        return {}
+
+
+def _write_atomic(fname, text):
+    tmp_path = fname + ".tmp"
+    with open(tmp_path, "w") as ofh:
+        ofh.write(text)
+    os.rename(tmp_path, fname)
+
+
+def _stat(img):
+    st = os.stat(img)
+    instrument.incr("stat.calls")
+    return (st.st_size, st.st_mtime)
+
+
+def _scan(ts_path, threads):
+    """``{relpath: (size, mtime)}`` of every image in ``ts_path``, stat-ed
+    in parallel"""
+    ext = ts_get_manifest(ts_path)["extension"]
+    imgs = sorted(all_files_with_ext(ts_path, ext, cs=True))
+    pool = ThreadPool(threads)
+    try:
+        stats = pool.map(_stat, imgs)
+    finally:
+        pool.close()
+        pool.join()
+    return dict((path.relpath(img, ts_path), st)
+                for img, st in zip(imgs, stats))
+
+
+def _hash_all(ts_path, relpaths, algorithm, threads):
+    """``{relpath: checksum}`` of ``relpaths``, hashed in parallel. Files
+    which can't be read get a checksum of ``None``."""
+    def hash_one(relpath):
+        try:
+            return ts_hash_file(path.join(ts_path, relpath), algorithm)
+        except (IOError, OSError) as exc:
+            LOG.warn("Couldn't hash {}: {}".format(relpath, exc))
+            return None
+    pool = ThreadPool(threads)
+    try:
+        return dict(zip(relpaths, pool.map(hash_one, relpaths)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def ts_write_checksums(ts_path, algorithm="sha256", threads=None):
+    """Create or update the checksum manifest of ``ts_path``.
+
+    Only images which are new, or whose size or modification time changed
+    since they were last hashed, are hashed, in parallel. Images which no
+    longer exist are dropped from the manifest.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param str algorithm: One of ``CHECKSUM_ALGORITHMS``.
+    :param int threads: Number of hashing threads.
+    :returns: dict -- with keys ``hashed``, ``unchanged`` and ``removed``,
+              each a sorted list of relative image paths.
+    """
+    _new_hash(algorithm)
+    if threads is None:
+        threads = _default_threads()
+    manifest_path = ts_checksum_manifest_path(ts_path, algorithm)
+    old = ts_read_checksums(manifest_path)
+    old_stats = _load_stat_cache(ts_path, algorithm)
+    stats = _scan(ts_path, threads)
+    unchanged = sorted(x for x in stats
+                       if x in old and old_stats.get(x) == stats[x])
+    todo = sorted(set(stats) - set(unchanged))
+    LOG.info("Hashing {:d} images, {:d} unchanged".format(len(todo),
+                                                         len(unchanged)))
+    checksums = dict((x, old[x]) for x in unchanged)
+    for relpath, checksum in _hash_all(ts_path, todo, algorithm,
+                                       threads).items():
+        if checksum is None:
+            del stats[relpath]
+        else:
+            checksums[relpath] = checksum
+    _write_atomic(manifest_path, "".join(
+        "{}  {}\n".format(checksums[x], x) for x in sorted(checksums)))
+    _write_atomic(_stat_cache_path(ts_path, algorithm), json.dumps(
+        dict((x, stats[x]) for x in checksums), sort_keys=True))
+    return {
+        "hashed": sorted(set(todo) & set(checksums)),
+        "unchanged": unchanged,
+        "removed": sorted(set(old) - set(stats)),
+    }
+
+
+def ts_verify_checksums(ts_path, algorithm="sha256", full=False,
+                        threads=None):
+    """Verify the images of ``ts_path`` against its checksum manifest.
+
+    By default verification is incremental: only images whose size or
+    modification time differ from when they were hashed are re-hashed. Use
+    ``full=True`` to re-hash every image, e.g. to find silent corruption on
+    disk.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param str algorithm: One of ``CHECKSUM_ALGORITHMS``.
+    :param bool full: Re-hash every image.
+    :param int threads: Number of hashing threads.
+    :returns: dict -- with keys ``missing`` (in the manifest, not on disk),
+              ``extra`` (on disk, not in the manifest), ``corrupt``
+              (checksum differs or image unreadable) and ``verified``
+              (checksum matches or image unchanged), each a sorted list of
+              relative image paths.
+    :raises: ValueError if there is no checksum manifest.
+    """
+    _new_hash(algorithm)
+    if threads is None:
+        threads = _default_threads()
+    manifest_path = ts_checksum_manifest_path(ts_path, algorithm)
+    if not path.isfile(manifest_path):
+        raise ValueError("No {} checksum manifest in {}".format(algorithm,
+                                                                ts_path))
+    expected = ts_read_checksums(manifest_path)
+    old_stats = _load_stat_cache(ts_path, algorithm)
+    stats = _scan(ts_path, threads)
+    present = sorted(set(expected) & set(stats))
+    if full:
+        todo = present
+    else:
+        todo = [x for x in present if old_stats.get(x) != stats[x]]
+    LOG.info("Verifying {:d} of {:d} images".format(len(todo), len(present)))
+    hashed = _hash_all(ts_path, todo, algorithm, threads)
+    corrupt = sorted(x for x in todo if hashed[x] != expected[x])
+    for relpath in corrupt:
+        LOG.warn("Checksum mismatch for {}".format(relpath))
+    return {
+        "missing": sorted(set(expected) - set(stats)),
+        "extra": sorted(set(stats) - set(expected)),
+        "corrupt": corrupt,
+        "verified": sorted(set(present) - set(corrupt)),
+    }
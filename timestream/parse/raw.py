@@ -0,0 +1,226 @@
+# Copyright 2014 Kevin Murray
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: timestream.parse.raw
+    :platform: Unix, Windows
+    :synopsis: Fast decoding of camera raw (CR2 and NEF) images.
+
+Camera raw images can be decoded in one of ``RAW_DECODE_MODES``:
+
+``"preview"``
+    The full-size JPEG preview which cameras embed in each raw file is
+    decoded, with no demosaicing. It is found by walking the file's TIFF
+    directories, and only it is read from disk. Gives an ``(h, w, 3)``
+    ``uint8`` BGR array; ``h`` and ``w`` are those of the preview, which for
+    CR2 files is the full sensor size, and for NEF files is usually so.
+
+``"half"``
+    The sensor data is demosaiced at half size, by combining each 2x2 Bayer
+    block into one pixel, which is several times faster than ``"full"``.
+    Gives an ``(h / 2, w / 2, 3)`` BGR array of ``uint16`` (or ``uint8`` with
+    ``bits=8``), with the camera's white balance and sRGB gamma applied.
+
+``"full"``
+    A full demosaic. Gives an ``(h, w, 3)`` BGR array of ``uint16`` (or
+    ``uint8`` with ``bits=8``), with the camera's white balance and sRGB
+    gamma applied.
+
+``h`` and ``w`` are the height and width of the sensor's active area. The
+``"half"`` and ``"full"`` modes need the optional ``rawpy`` module (LibRaw);
+``"preview"`` needs only OpenCV.
+
+.. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
+"""
+
+import logging
+import struct
+
+from timestream.util import (
+    PARAM_TYPE_ERR,
+    instrument,
+)
+from timestream.util.backends import (
+    get_backend,
+    lazy_backend,
+)
+
+#: Ways of decoding camera raw images
+RAW_DECODE_MODES = ("preview", "half", "full")
+#: Extensions of camera raw images, which need demosaicing
+CAMERA_RAW_EXTS = ("cr2", "nef")
+LOG = logging.getLogger("timestreamlib")
+cv2 = lazy_backend("cv2")
+np = lazy_backend("numpy")
+# TIFF tags
+_TAG_COMPRESSION = 0x0103
+_TAG_STRIP_OFFSETS = 0x0111
+_TAG_STRIP_BYTE_COUNTS = 0x0117
+_TAG_SUB_IFDS = 0x014A
+_TAG_JPEG_OFFSET = 0x0201
+_TAG_JPEG_LENGTH = 0x0202
+# Sizes of TIFF field types which may hold offsets and lengths
+_TIFF_TYPES = {3: ("H", 2), 4: ("I", 4), 13: ("I", 4)}
+# JPEG start of frame markers which libjpeg decodes; raw data is stored as
+# lossless JPEG (0xC3), which it doesn't
+_JPEG_SOF_OK = (0xC0, 0xC1, 0xC2)
+# Bytes read to find a JPEG's start of frame marker
+_JPEG_HEADER_BYTES = 65536
+
+
+def _read_ifd(fh, offset, endian):
+    """Read the TIFF directory at ``offset``, returning ``(tags, next)``,
+    where ``tags`` is ``{tag: [values]}`` of numeric tags."""
+    fh.seek(offset)
+    count, = struct.unpack(endian + "H", fh.read(2))
+    entries = fh.read(12 * count)
+    next_ifd, = struct.unpack(endian + "I", fh.read(4))
+    tags = {}
+    for iii in range(count):
+        tag, typ, num = struct.unpack(endian + "HHI",
+                                      entries[12 * iii:12 * iii + 8])
+        if typ not in _TIFF_TYPES or num > 1024:
+            continue
+        fmt, size = _TIFF_TYPES[typ]
+        value = entries[12 * iii + 8:12 * iii + 12]
+        if size * num > 4:
+            pos = fh.tell()
+            fh.seek(struct.unpack(endian + "I", value)[0])
+            value = fh.read(size * num)
+            fh.seek(pos)
+        tags[tag] = list(struct.unpack(endian + fmt * num,
+                                       value[:size * num]))
+    return (tags, next_ifd)
+
+
+def _jpeg_candidates(fh):
+    """All ``(offset, length)`` of JPEG streams referenced by the TIFF
+    directories of the open raw file ``fh``."""
+    fh.seek(0)
+    header = fh.read(8)
+    if header[:2] == b"II":
+        endian = "<"
+    elif header[:2] == b"MM":
+        endian = ">"
+    else:
+        raise ValueError("Not a TIFF-based raw file")
+    todo = [struct.unpack(endian + "I", header[4:8])[0]]
+    seen = set()
+    found = []
+    while todo:
+        offset = todo.pop()
+        if offset == 0 or offset in seen or len(seen) > 64:
+            continue
+        seen.add(offset)
+        tags, next_ifd = _read_ifd(fh, offset, endian)
+        todo.append(next_ifd)
+        todo.extend(tags.get(_TAG_SUB_IFDS, []))
+        if _TAG_JPEG_OFFSET in tags and _TAG_JPEG_LENGTH in tags:
+            found.append((tags[_TAG_JPEG_OFFSET][0],
+                          tags[_TAG_JPEG_LENGTH][0]))
+        if tags.get(_TAG_COMPRESSION) in ([6], [7]) and \
+                len(tags.get(_TAG_STRIP_OFFSETS, [])) == 1:
+            found.append((tags[_TAG_STRIP_OFFSETS][0],
+                          tags[_TAG_STRIP_BYTE_COUNTS][0]))
+    return found
+
+
+def _jpeg_sof(data):
+    """The start of frame marker of the JPEG stream starting ``data``, or
+    ``None`` if it isn't found."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos:pos + 1] != b"\xff":
+            return None
+        marker = bytearray(data[pos + 1:pos + 2])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return marker
+        length, = struct.unpack(">H", data[pos + 2:pos + 4])
+        pos += 2 + length
+    return None
+
+
+def ts_raw_preview_bytes(img):
+    """Extract the largest embedded JPEG preview of the raw image ``img``,
+    reading only its TIFF directories and the preview itself.
+
+    :param str img: Path to a CR2 or NEF image.
+    :returns: bytes -- The JPEG file, or ``None`` if there's no preview.
+    """
+    with open(img, "rb") as fh:
+        try:
+            candidates = _jpeg_candidates(fh)
+        except (ValueError, struct.error) as exc:
+            LOG.warn("Couldn't read TIFF directories of {}: {}".format(img,
+                                                                      exc))
+            return None
+        for offset, length in sorted(candidates, key=lambda x: -x[1]):
+            fh.seek(offset)
+            head = fh.read(min(length, _JPEG_HEADER_BYTES))
+            if _jpeg_sof(head) not in _JPEG_SOF_OK:
+                continue
+            data = head + fh.read(length - len(head))
+            instrument.incr("read.bytes", len(data))
+            return data
+    return None
+
+
+def ts_imread_raw(img, mode="preview", bits=16):
+    """Decode the camera raw image ``img``. See the module documentation for
+    the shape and bit depth given by each mode.
+
+    :param str img: Path to a CR2 or NEF image.
+    :param str mode: One of ``RAW_DECODE_MODES``.
+    :param int bits: Bits per sample, 8 or 16, of ``"half"`` and ``"full"``
+                     modes.
+    :returns: numpy.ndarray -- The image, or ``None`` if it couldn't be read.
+    :raises: ValueError, ImportError if ``rawpy`` is needed but missing.
+    """
+    if mode not in RAW_DECODE_MODES:
+        msg = PARAM_TYPE_ERR.format(param="mode", func="ts_imread_raw",
+                                    type=" or ".join(RAW_DECODE_MODES))
+        LOG.error(msg)
+        raise ValueError(msg)
+    if mode == "preview":
+        with instrument.timer("decode.raw_preview"):
+            data = ts_raw_preview_bytes(img)
+            if data is None:
+                return None
+            mat = cv2.imdecode(np.frombuffer(data, dtype="u1"),
+                               cv2.IMREAD_COLOR)
+        instrument.incr("decode.images")
+        return mat
+    if bits not in (8, 16):
+        msg = PARAM_TYPE_ERR.format(param="bits", func="ts_imread_raw",
+                                    type="8 or 16")
+        LOG.error(msg)
+        raise ValueError(msg)
+    try:
+        rawpy = get_backend("rawpy")
+    except ImportError:
+        raise ImportError("Raw decode mode '{}' needs the rawpy module"
+                          .format(mode))
+    with instrument.timer("decode.raw_" + mode):
+        try:
+            with rawpy.imread(img) as raw:
+                rgb = raw.postprocess(half_size=(mode == "half"),
+                                      use_camera_wb=True, output_bps=bits)
+        except (IOError, rawpy.LibRawError) as exc:
+            LOG.warn("Couldn't decode {}: {}".format(img, exc))
+            return None
+    instrument.incr("decode.images")
+    return np.ascontiguousarray(rgb[:, :, ::-1])
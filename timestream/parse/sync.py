@@ -0,0 +1,190 @@
+# Copyright 2014 Kevin Murray
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: timestream.parse.sync
+    :platform: Unix, Windows
+    :synopsis: Synchronised iteration over several timestreams.
+
+Chambers have several cameras photographing the same plants, whose clocks
+and capture schedules never agree exactly. ``ts_iter_synced`` aligns their
+frames by merge-joining the sorted time index of each timestream, grouping
+images whose capture times are within a tolerance::
+
+    streams = {"top": top_path, "side": side_path}
+    for time, frames in ts_iter_synced(streams, tolerance=60, decode=True):
+        analyse(frames["top"], frames["side"])
+
+Each time index is built once and cached, so no manifests are reloaded and
+no paths are probed per timepoint.
+
+.. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
+"""
+
+from collections import deque
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from os import path
+
+from timestream.parse import (
+    _as_tolerance,
+    ts_get_index,
+    ts_imread,
+    ts_parse_date,
+)
+from timestream.util import (
+    PARAM_TYPE_ERR,
+    instrument,
+)
+
+LOG = logging.getLogger("timestreamlib")
+#: Default number of timepoints decoded ahead of the one yielded
+DEFAULT_PREFETCH = 2
+
+
+def _stream_names(ts_paths):
+    """``[(name, ts_path)]`` of a dict of timestreams, or a list named by
+    their basenames"""
+    if isinstance(ts_paths, dict):
+        return sorted(ts_paths.items())
+    if not isinstance(ts_paths, (list, tuple)) or not ts_paths:
+        msg = PARAM_TYPE_ERR.format(param="ts_paths", func="ts_iter_synced",
+                                    type="non-empty list or dict")
+        LOG.error(msg)
+        raise ValueError(msg)
+    names = [path.basename(x.rstrip("/")) for x in ts_paths]
+    if len(set(names)) != len(names):
+        raise ValueError("Timestream names clash, pass a dict to name them")
+    return list(zip(names, ts_paths))
+
+
+def _first_of_bursts(index, start, end):
+    """``(times, paths)`` of ``index``, with only the first image of each
+    burst, from ``start`` to ``end``"""
+    times = []
+    paths = []
+    for time, img in zip(index["times"], index["paths"]):
+        if (start is not None and time < start) or \
+                (end is not None and time > end):
+            continue
+        if times and times[-1] == time:
+            continue
+        times.append(time)
+        paths.append(img)
+    return (times, paths)
+
+
+def ts_sync_times(ts_paths, tolerance=60, start=None, end=None,
+                  complete=False):
+    """Align the images of several timestreams by capture time.
+
+    The time indices are merge-joined: starting from the earliest image not
+    yet used, the next image of each timestream is in the group if it was
+    captured within ``tolerance`` of it. Each image is used at most once,
+    and only the first image of a burst is used.
+
+    :param ts_paths: ``{name: ts_path}`` of timestreams, or a list of paths,
+                     named by their basenames.
+    :param tolerance: Maximum spread of capture times in a group, as a
+                      ``datetime.timedelta`` or a number of seconds.
+    :param datetime.datetime start: Ignore images before ``start``.
+    :param datetime.datetime end: Ignore images after ``end``.
+    :param bool complete: Only give groups with an image from every
+                          timestream.
+    :returns: generator of ``(time, {name: image_path})``, where ``time`` is
+              the earliest capture time of the group.
+    """
+    streams = _stream_names(ts_paths)
+    tolerance = _as_tolerance(tolerance, "ts_sync_times")
+    start = ts_parse_date(start) if start is not None else None
+    end = ts_parse_date(end) if end is not None else None
+    indices = [_first_of_bursts(ts_get_index(ts_path), start, end)
+               for _, ts_path in streams]
+    pos = [0] * len(streams)
+    while True:
+        heads = [times[p] for (times, _), p in zip(indices, pos)
+                 if p < len(times)]
+        if not heads:
+            return
+        first = min(heads)
+        group = {}
+        for iii, (name, _) in enumerate(streams):
+            times, imgs = indices[iii]
+            if pos[iii] < len(times) and times[pos[iii]] - first <= tolerance:
+                group[name] = imgs[pos[iii]]
+                pos[iii] += 1
+        if complete and len(group) < len(streams):
+            instrument.incr("sync.incomplete")
+            continue
+        yield (first, group)
+
+
+def ts_iter_synced(ts_paths, tolerance=60, start=None, end=None,
+                   complete=False, decode=False, scale=1, threads=None,
+                   prefetch=DEFAULT_PREFETCH):
+    """Iterate over aligned frames of several timestreams. Groups are as per
+    ``ts_sync_times``.
+
+    With ``decode``, the images of every timestream are decoded in parallel
+    by a thread pool, ``prefetch`` timepoints ahead of the one yielded, so
+    decoding overlaps the caller's processing.
+
+    :param ts_paths: ``{name: ts_path}`` of timestreams, or a list of paths,
+                     named by their basenames.
+    :param tolerance: Maximum spread of capture times in a group, as a
+                      ``datetime.timedelta`` or a number of seconds.
+    :param datetime.datetime start: Ignore images before ``start``.
+    :param datetime.datetime end: Ignore images after ``end``.
+    :param bool complete: Only give groups with an image from every
+                          timestream.
+    :param bool decode: Give decoded images rather than paths.
+    :param int scale: Downscaling factor to decode at, see
+                      ``timestream.parse.ts_imread``.
+    :param int threads: Number of decoding threads, by default one per
+                        timestream up to the number of CPUs.
+    :param int prefetch: Number of timepoints to decode ahead.
+    :returns: generator of ``(time, {name: image})``, where ``image`` is a
+              path, or with ``decode`` a ``numpy.ndarray`` (``None`` if it
+              couldn't be decoded).
+    """
+    groups = ts_sync_times(ts_paths, tolerance, start, end, complete)
+    if not decode:
+        for item in groups:
+            yield item
+        return
+    if threads is None:
+        threads = min(len(ts_paths), multiprocessing.cpu_count())
+    pool = ThreadPool(max(1, threads))
+    pending = deque()
+    try:
+        for time, group in groups:
+            pending.append((time, dict(
+                (name, pool.apply_async(ts_imread, (img, scale)))
+                for name, img in group.items())))
+            if len(pending) > prefetch:
+                yield _collect(pending.popleft())
+        while pending:
+            yield _collect(pending.popleft())
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _collect(item):
+    time, results = item
+    with instrument.timer("sync.wait"):
+        frames = dict((name, res.get()) for name, res in results.items())
+    return (time, frames)
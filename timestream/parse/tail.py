@@ -0,0 +1,245 @@
+# Copyright 2014 Kevin Murray
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: timestream.parse.tail
+    :platform: Unix, Windows
+    :synopsis: Follow a timestream as a camera writes new images into it.
+
+Only the directories on the path to the newest image are watched: the hour
+directory for new images, and its day, month, year and timestream root
+directories for the next hour. On Linux these are watched with inotify;
+elsewhere, or if inotify fails, their modification times are polled.
+
+Images are reported as soon as they are listed, so cameras should write
+images under a temporary name and rename them into place.
+
+.. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+from os import path
+import select
+import sys
+import time as timemod
+
+from timestream.parse import (
+    _ts_has_manifest,
+    _ts_list_hour_dir,
+    ts_get_manifest,
+    ts_index_add,
+    ts_iter_hour_dirs,
+    ts_parse_date,
+    ts_update_manifest,
+)
+from timestream.parse.validate import (
+    TS_V1_DIR_LEVELS,
+)
+from timestream.util import (
+    instrument,
+)
+
+LOG = logging.getLogger("timestreamlib")
+# inotify event masks, from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+# Seconds after which a directory's mtime is assumed to be settled
+_MTIME_SETTLE = 2.0
+
+
+class _PollWaiter(object):
+
+    """Wait by sleeping; changes are found by polling directory mtimes"""
+
+    def watch(self, dirs):
+        pass
+
+    def wait(self, timeout):
+        timemod.sleep(timeout)
+
+    def close(self):
+        pass
+
+
+class _InotifyWaiter(object):
+
+    """Wait for filesystem events in watched directories, using inotify"""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+
+    def watch(self, dirs):
+        dirs = set(dirs)
+        for dirpath in set(self._watches) - dirs:
+            self._libc.inotify_rm_watch(self._fd, self._watches.pop(dirpath))
+        for dirpath in dirs - set(self._watches):
+            wd = self._libc.inotify_add_watch(
+                self._fd, dirpath.encode(sys.getfilesystemencoding()),
+                _IN_WATCH_MASK)
+            # Directories which don't exist yet are caught by their parent
+            if wd >= 0:
+                self._watches[dirpath] = wd
+
+    def wait(self, timeout):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if ready:
+            # We only use events as a wake up, so just drain them
+            try:
+                while os.read(self._fd, 65536):
+                    pass
+            except OSError:
+                pass
+
+    def close(self):
+        os.close(self._fd)
+
+
+def _make_waiter(use_inotify):
+    if use_inotify is False or not sys.platform.startswith("linux"):
+        return _PollWaiter()
+    try:
+        return _InotifyWaiter()
+    except (OSError, AttributeError) as exc:
+        if use_inotify:
+            raise
+        LOG.info("inotify unavailable ({}), polling instead".format(exc))
+        return _PollWaiter()
+
+
+def _dir_chain(ts_path, time):
+    """The timestream root and the directories leading to the hour directory
+    for ``time``, root first"""
+    dirs = [ts_path]
+    for level in TS_V1_DIR_LEVELS:
+        dirs.append(path.join(dirs[-1], time.strftime(level)))
+    return dirs
+
+
+def _mtimes(dirs):
+    mtimes = []
+    for dirpath in dirs:
+        instrument.incr("stat.calls")
+        try:
+            mtimes.append(os.stat(dirpath).st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def _settled(mtimes):
+    """``mtimes``, or ``None`` if any directory changed too recently for its
+    mtime to be trusted. Filesystems with coarse timestamps could otherwise
+    hide a second change within the same tick, so such directories are
+    re-listed on the next check."""
+    now = timemod.time()
+    for mtime in mtimes:
+        if mtime is None or now - mtime < _MTIME_SETTLE:
+            return None
+    return mtimes
+
+
+def _newer_images(ts_path, ext, last, seen):
+    """List images newer than ``last``, or at ``last`` but not in ``seen``,
+    using a date-pruned traversal starting from ``last``"""
+    new = []
+    for hour_dir in ts_iter_hour_dirs(ts_path, start=last):
+        for entry in _ts_list_hour_dir(hour_dir, ext, start=last):
+            if entry[2] not in seen:
+                new.append(entry)
+    return new
+
+
+def ts_tail(ts_path, since=None, poll_interval=5.0, idle_timeout=None,
+            update_manifest=True, use_inotify=None):
+    """Follow a timestream, yielding new images as they appear.
+
+    If the timestream has a manifest, its ``end_datetime`` is updated as
+    images arrive, as is the cached time index (see
+    ``timestream.parse.ts_get_index``).
+
+    :param str ts_path: Path to the root of a timestream.
+    :param since: Yield images from this time on. Defaults to just after the
+                  newest image already in the timestream.
+    :type since: datetime.datetime or str
+    :param float poll_interval: Maximum seconds between checks for images.
+    :param float idle_timeout: Stop after this many seconds without a new
+                               image. ``None`` follows forever.
+    :param bool update_manifest: Keep the manifest's ``end_datetime``
+                                 current.
+    :param bool use_inotify: ``True`` to require inotify, ``False`` to
+                             always poll, ``None`` to use it if possible.
+    :returns: generator of ``(time, image_path)`` tuples.
+    """
+    ts_info = ts_get_manifest(ts_path)
+    ext = ts_info["extension"]
+    seen = set()
+    if since is None:
+        # The manifest's end_datetime may be stale, so start looking there
+        existing = _newer_images(ts_path, ext, ts_info["end_datetime"], seen)
+        if existing:
+            last = existing[-1][0]
+            seen = set(x[2] for x in existing if x[0] == last)
+        else:
+            last = ts_info["end_datetime"]
+    else:
+        last = ts_parse_date(since)
+    has_manifest = bool(_ts_has_manifest(ts_path))
+    waiter = _make_waiter(use_inotify)
+    try:
+        chain = _dir_chain(ts_path, last)
+        waiter.watch(chain)
+        # With an explicit start time, there may be images to catch up on
+        mtimes = _settled(_mtimes(chain)) if since is None else None
+        idle_since = timemod.time()
+        while True:
+            now_mtimes = _mtimes(chain)
+            new = []
+            if now_mtimes != mtimes:
+                mtimes = _settled(now_mtimes)
+                new = _newer_images(ts_path, ext, last, seen)
+            if new:
+                idle_since = timemod.time()
+                ts_index_add(ts_path, new)
+                if new[-1][0] > last:
+                    last = new[-1][0]
+                    seen = set()
+                seen.update(x[2] for x in new if x[0] == last)
+                if update_manifest and has_manifest and \
+                        last > ts_info["end_datetime"]:
+                    ts_info["end_datetime"] = last
+                    ts_update_manifest(ts_path, ts_info)
+                new_chain = _dir_chain(ts_path, last)
+                if new_chain != chain:
+                    chain = new_chain
+                    waiter.watch(chain)
+                    mtimes = None
+                for time, _, img in new:
+                    yield (time, img)
+            elif idle_timeout is not None and \
+                    timemod.time() - idle_since > idle_timeout:
+                return
+            waiter.wait(poll_interval)
+    finally:
+        waiter.close()
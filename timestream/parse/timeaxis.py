@@ -0,0 +1,316 @@
+# Copyright 2014 Kevin Murray
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: timestream.parse.timeaxis
+    :platform: Unix, Windows
+    :synopsis: Vectorised time axes of timestreams, as datetime64 arrays.
+
+``ts_iter_times`` makes a ``datetime`` for every expected timepoint, which
+for a long timestream is hundreds of thousands of Python objects. This module
+instead works on ``numpy.datetime64[s]`` arrays, for example::
+
+    expected, present = ts_presence_mask(ts_path)
+    stats = ts_coverage(expected, present)
+    missing = ts_relpaths(ts_get_manifest(ts_path), expected[~present])
+
+.. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
+"""
+
+import logging
+import numbers
+import os
+from os import path
+import re
+
+from timestream.parse import (
+    _ts_date_to_path,
+    ts_get_index,
+    ts_get_manifest,
+    ts_iter_hour_dirs,
+)
+from timestream.parse.validate import (
+    TS_V1_FMT,
+)
+from timestream.util import (
+    PARAM_TYPE_ERR,
+    instrument,
+)
+from timestream.util.backends import (
+    lazy_backend,
+)
+
+LOG = logging.getLogger("timestreamlib")
+np = lazy_backend("numpy")
+#: Sources of image times for ``ts_presence_mask``
+PRESENCE_SOURCES = ("index", "scan")
+_STRFTIME_FIELD = re.compile(r"%([YmdHMS%])")
+_N_FIELD = re.compile(r"\{n(?::([^}]*))?\}")
+
+
+def _manifest(ts_info):
+    """``ts_info`` if it's a manifest, else the manifest of that path"""
+    if isinstance(ts_info, dict):
+        return ts_info
+    return ts_get_manifest(ts_info)
+
+
+def _datetime64(values):
+    return np.asarray(values).astype("M8[s]")
+
+
+def ts_expected_times(ts_info):
+    """All expected timepoints of a timestream, from its manifest's start,
+    end and interval.
+
+    :param ts_info: A manifest, from ``ts_get_manifest``, or the path of a
+                    timestream.
+    :returns: numpy.ndarray -- ``datetime64[s]`` timepoints.
+    """
+    ts_info = _manifest(ts_info)
+    interval = np.timedelta64(int(ts_info["interval"] * 60), "s")
+    start = np.datetime64(ts_info["start_datetime"], "s")
+    end = np.datetime64(ts_info["end_datetime"], "s")
+    return np.arange(start, end + np.timedelta64(1, "s"), interval)
+
+
+def ts_scan_times(ts_path, ext=None):
+    """Capture times and ``n`` counters of every image in ``ts_path``, from
+    one listing of each hour directory. Times are parsed in bulk, so no
+    ``datetime`` objects are made.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param str ext: Image extension, by default that of the manifest.
+    :returns: tuple -- ``(times, n)``, sorted ``datetime64[s]`` and integer
+              arrays.
+    """
+    if ext is None:
+        ext = ts_get_manifest(ts_path)["extension"]
+    ext = "." + ext.lower()
+    isos = []
+    ns = []
+    for hour_dir in ts_iter_hour_dirs(ts_path):
+        instrument.incr("listdir.calls")
+        for fname in os.listdir(hour_dir):
+            base, fext = path.splitext(fname)
+            if fext.lower() != ext:
+                continue
+            fields = base.split("_")
+            if len(fields) < 7:
+                continue
+            isos.append("{}-{}-{}T{}:{}:{}".format(*fields[1:7]))
+            ns.append(fields[7] if len(fields) > 7 else "0")
+    try:
+        times = np.array(isos, dtype="M8[s]")
+        ns = np.array(ns, dtype=int)
+    except ValueError:
+        # A badly named image; fall back to skipping them one by one
+        good = []
+        for iso, n in zip(isos, ns):
+            try:
+                good.append((np.datetime64(iso, "s"), int(n)))
+            except ValueError:
+                LOG.warn("Skipping badly named image at {}".format(iso))
+        times = np.array([x[0] for x in good], dtype="M8[s]")
+        ns = np.array([x[1] for x in good], dtype=int)
+    order = np.lexsort((ns, times))
+    return (times[order], ns[order])
+
+
+def ts_presence_mask(ts_path, source="index", tolerance=0):
+    """Which expected timepoints of ``ts_path`` have an image.
+
+    :param str ts_path: Path to the root of a timestream.
+    :param str source: Where image times come from, one of
+                       ``PRESENCE_SOURCES``: the cached time index, or a
+                       fresh scan of the hour directories.
+    :param tolerance: Seconds an image may be from its timepoint and still
+                      count, for cameras whose clocks drift. Images off the
+                      grid by more are ignored.
+    :returns: tuple -- ``(expected, present)``, a ``datetime64[s]`` array as
+              per ``ts_expected_times``, and a boolean array of the same
+              length.
+    """
+    if source not in PRESENCE_SOURCES:
+        msg = PARAM_TYPE_ERR.format(param="source", func="ts_presence_mask",
+                                    type=" or ".join(PRESENCE_SOURCES))
+        LOG.error(msg)
+        raise ValueError(msg)
+    if not isinstance(tolerance, numbers.Real) or tolerance < 0:
+        msg = PARAM_TYPE_ERR.format(param="tolerance",
+                                    func="ts_presence_mask",
+                                    type="non-negative number")
+        LOG.error(msg)
+        raise ValueError(msg)
+    ts_info = ts_get_manifest(ts_path)
+    expected = ts_expected_times(ts_info)
+    if source == "index":
+        times = _datetime64(ts_get_index(ts_path)["times"])
+    else:
+        times, _ = ts_scan_times(ts_path, ts_info["extension"])
+    present = np.zeros(len(expected), dtype=bool)
+    if len(expected) == 0 or len(times) == 0:
+        return (expected, present)
+    # Snap each image to its nearest timepoint
+    interval = int(ts_info["interval"] * 60)
+    offsets = (times - expected[0]).astype("i8")
+    slots = np.rint(offsets / float(interval)).astype("i8")
+    ok = (slots >= 0) & (slots < len(expected)) & \
+        (np.abs(offsets - slots * interval) <= tolerance)
+    present[slots[ok]] = True
+    return (expected, present)
+
+
+def ts_gap_runs(present):
+    """Runs of consecutive missing timepoints.
+
+    :param numpy.ndarray present: Boolean presence mask.
+    :returns: tuple -- ``(starts, lengths)``, integer arrays of the position
+              of the first missing timepoint of each gap and its length.
+    """
+    missing = np.concatenate(([False], ~np.asarray(present, dtype=bool),
+                              [False]))
+    edges = np.flatnonzero(np.diff(missing.astype("i1")))
+    starts = edges[0::2]
+    return (starts, edges[1::2] - starts)
+
+
+def ts_coverage(expected, present):
+    """Coverage and gap statistics of a presence mask.
+
+    :param numpy.ndarray expected: ``datetime64`` timepoints.
+    :param numpy.ndarray present: Boolean presence mask.
+    :returns: dict -- with keys ``expected`` and ``present``, counts of
+              timepoints; ``coverage``, the fraction present; ``gaps``, the
+              number of gaps; ``longest_gap``, ``None`` or a dict of the
+              ``start`` and ``end`` (``datetime64``) of the missing timepoints
+              of the longest gap and its ``length`` in timepoints; and
+              ``days`` and ``daily_coverage``, arrays of each calendar day
+              (``datetime64[D]``) and the fraction of its timepoints present.
+    """
+    expected = np.asarray(expected)
+    present = np.asarray(present, dtype=bool)
+    if expected.shape != present.shape:
+        raise ValueError("expected and present must be the same length")
+    starts, lengths = ts_gap_runs(present)
+    longest = None
+    if len(lengths):
+        big = int(np.argmax(lengths))
+        first = starts[big]
+        longest = {
+            "start": expected[first],
+            "end": expected[first + lengths[big] - 1],
+            "length": int(lengths[big]),
+        }
+    days, day_idx = np.unique(expected.astype("M8[D]"), return_inverse=True)
+    day_total = np.bincount(day_idx, minlength=len(days))
+    day_present = np.bincount(day_idx, weights=present, minlength=len(days))
+    n_present = int(np.count_nonzero(present))
+    coverage = n_present / float(len(expected)) if len(expected) else 0.0
+    return {
+        "expected": len(expected),
+        "present": n_present,
+        "coverage": coverage,
+        "gaps": len(starts),
+        "longest_gap": longest,
+        "days": days,
+        "daily_coverage": day_present / np.maximum(day_total, 1),
+    }
+
+
+def _time_fields(times):
+    """``{strftime field: (values, width)}`` of ``datetime64[s]`` times"""
+    days = times.astype("M8[D]")
+    months = times.astype("M8[M]")
+    years = times.astype("M8[Y]")
+    secs = (times - days).astype("i8")
+    return {
+        "Y": (years.astype("i8") + 1970, 4),
+        "m": ((months - years).astype("i8") + 1, 2),
+        "d": ((days - months).astype("i8") + 1, 2),
+        "H": (secs // 3600, 2),
+        "M": (secs // 60 % 60, 2),
+        "S": (secs % 60, 2),
+    }
+
+
+def _path_template(ts_info, n_width):
+    """``TS_V1_FMT`` as a list of literal strings and ``(field, width)``
+    tuples, where fields are strftime fields or ``"n"``."""
+    template = []
+    pieces = _N_FIELD.split(TS_V1_FMT)
+    for iii, piece in enumerate(pieces):
+        if iii % 2 == 1:
+            template.append(("n", n_width))
+            continue
+        piece = piece.format(tsname=ts_info["name"], ext=ts_info["extension"])
+        for jjj, part in enumerate(_STRFTIME_FIELD.split(piece)):
+            if jjj % 2 == 0 or part == "%":
+                template.append(part)
+            else:
+                template.append((part, None))
+    return template
+
+
+def ts_relpaths(ts_info, times, n=0):
+    """Paths relative to the timestream root of images at ``times``, made in
+    bulk rather than by one ``strftime`` per image.
+
+    Every field of a V1 path has a fixed width, so the paths are written as
+    rows of one byte array, a column of digits at a time.
+
+    :param ts_info: A manifest, from ``ts_get_manifest``, or the path of a
+                    timestream.
+    :param times: ``datetime64`` array, e.g. ``expected[~present]``.
+    :param n: Sub-second counter, an integer or an array like ``times``.
+    :returns: list -- Relative paths, as per ``TS_V1_FMT``.
+    """
+    ts_info = _manifest(ts_info)
+    times = _datetime64(times).ravel()
+    if len(times) == 0:
+        return []
+    ns = np.broadcast_to(np.asarray(n, dtype="i8"), times.shape)
+    n_spec = "%" + (_N_FIELD.findall(TS_V1_FMT) or ["d"])[0]
+    n_width = len(n_spec % ns.max())
+    if ns.min() < 0 or len(n_spec % ns.min()) != n_width:
+        # Counters of differing widths: no fixed layout
+        return [_ts_date_to_path(ts_info, t, int(c))
+                for t, c in zip(times.astype(object), ns)]
+    fields = _time_fields(times)
+    fields["n"] = (ns, n_width)
+    template = _path_template(ts_info, n_width)
+    parts = []
+    for item in template:
+        if isinstance(item, tuple):
+            values, width = fields[item[0]]
+            parts.append((values, width))
+        else:
+            parts.append(item.encode("utf-8"))
+    row_len = sum(len(x) if isinstance(x, bytes) else x[1] for x in parts)
+    buf = np.empty((len(times), row_len), dtype="u1")
+    col = 0
+    for part in parts:
+        if isinstance(part, bytes):
+            buf[:, col:col + len(part)] = np.frombuffer(part, dtype="u1")
+            col += len(part)
+            continue
+        values, width = part
+        for digit in range(width):
+            buf[:, col + width - 1 - digit] = 48 + values // 10 ** digit % 10
+        col += width
+    paths = buf.view("S{:d}".format(row_len)).ravel().tolist()
+    if str is not bytes:
+        paths = [x.decode("utf-8") for x in paths]
+    return paths
@@ -62,6 +62,8 @@ __TS_V1_LEVELS = [
     '{tsname:s}_%Y_%m_%d_%H_%M_%S_{n:02d}.{ext:s}',
 ]
 TS_V1_FMT = path.join(*__TS_V1_LEVELS)
+#: ``strftime`` formats of each directory level of a V1 timestream
+TS_V1_DIR_LEVELS = __TS_V1_LEVELS[:-1]
 
 
 def validate_timestream_manifest(manifest):
@@ -0,0 +1,150 @@
+# Copyright 2014 Kevin Murray
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: timestream.util.backends
+    :platform: Unix, Windows
+    :synopsis: Registry of heavy optional modules, imported on first use.
+
+Image decoding, EXIF and netCDF support come from large third party modules,
+which take most of the time of importing timestreamlib, and which tools that
+only list or resolve paths don't need. Modules get them through this
+registry instead of importing them directly::
+
+    cv2 = lazy_backend("cv2")
+
+    def decode(img):
+        return cv2.imread(img)
+
+The backend is imported on the first attribute access, so importing
+``timestream.parse`` loads none of them. A backend may name several
+alternative modules, the first that imports being used. If none can be
+imported, an ``ImportError`` says which package to install.
+
+.. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
+"""
+
+import importlib
+import logging
+import threading
+
+from timestream.util import (
+    PARAM_TYPE_ERR,
+    instrument,
+)
+
+LOG = logging.getLogger("timestreamlib")
+#: Registered backends: ``{name: (modules, install hint)}``, where
+#: ``modules`` are alternative module names, tried in order.
+BACKENDS = {}
+# Imported backend modules, by backend name
+_LOADED = {}
+_LOCK = threading.Lock()
+
+
+def register_backend(name, modules, hint=None):
+    """Register a backend, replacing any of the same name.
+
+    :param str name: Name of the backend.
+    :param list modules: Names of alternative modules which provide it, in
+                         order of preference.
+    :param str hint: What to install if no module can be imported.
+    """
+    if isinstance(modules, str):
+        modules = [modules]
+    if not modules:
+        msg = PARAM_TYPE_ERR.format(param="modules", func="register_backend",
+                                    type="non-empty list")
+        LOG.error(msg)
+        raise ValueError(msg)
+    with _LOCK:
+        BACKENDS[name] = (tuple(modules), hint or modules[0])
+        _LOADED.pop(name, None)
+
+
+def get_backend(name):
+    """Import the backend ``name`` if need be, and return its module.
+
+    :param str name: Name of a registered backend.
+    :returns: module -- The first of the backend's modules that imports.
+    :raises: KeyError if ``name`` isn't registered, ImportError if none of its
+             modules can be imported.
+    """
+    module = _LOADED.get(name)
+    if module is not None:
+        return module
+    with _LOCK:
+        if name in _LOADED:
+            return _LOADED[name]
+        if name not in BACKENDS:
+            raise KeyError("No backend named '{}'".format(name))
+        modules, hint = BACKENDS[name]
+        errors = []
+        for modname in modules:
+            try:
+                with instrument.timer("backend.import"):
+                    module = importlib.import_module(modname)
+            except ImportError as exc:
+                errors.append("{}: {}".format(modname, exc))
+                continue
+            LOG.debug("Loaded backend {} from {}".format(name, modname))
+            _LOADED[name] = module
+            return module
+    raise ImportError("Backend '{}' is unavailable, please install {} ({})"
+                      .format(name, hint, "; ".join(errors)))
+
+
+def backend_available(name):
+    """Whether the backend ``name`` can be imported. This imports it."""
+    try:
+        get_backend(name)
+    except ImportError:
+        return False
+    return True
+
+
+def loaded_backends():
+    """``{name: module name}`` of the backends imported so far"""
+    return dict((name, module.__name__) for name, module in _LOADED.items())
+
+
+class LazyBackend(object):
+
+    """Stand-in for a backend module, which imports it on first attribute
+    access, e.g. ``cv2.imread``."""
+
+    __slots__ = ("_name", )
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_backend(self._name), attr)
+
+    def __repr__(self):
+        return "<lazy backend '{}'>".format(self._name)
+
+
+def lazy_backend(name):
+    """A ``LazyBackend`` for the backend ``name``, which need not be
+    registered until first used."""
+    return LazyBackend(name)
+
+
+register_backend("cv2", ["cv2"], "OpenCV's python bindings (opencv-python)")
+register_backend("numpy", ["numpy"], "numpy")
+register_backend("exif", ["exifread", "wand.image"], "ExifRead")
+register_backend("netcdf", ["netCDF4"], "netCDF4")
+register_backend("rawpy", ["rawpy"], "rawpy")
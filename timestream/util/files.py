@@ -0,0 +1,140 @@
+# Copyright 2014 Kevin Murray
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: timestream.util.files
+    :platform: Unix, Windows
+    :synopsis: Place image files cheaply, sharing data where possible.
+
+.. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
+"""
+
+import errno
+import os
+from os import path
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from timestream.util import (
+    PARAM_TYPE_ERR,
+    instrument,
+)
+
+#: Ways to place a file, in order of preference, for each mode
+PLACE_METHODS = {
+    "link": ("link", "reflink", "copy_range", "copy"),
+    "copy": ("reflink", "copy_range", "copy"),
+}
+# FICLONE ioctl request, from <linux/fs.h>
+_FICLONE = 0x40049409
+# Errors meaning a method isn't supported here, so the next should be tried
+_UNSUPPORTED = set([errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY,
+                    errno.EINVAL, errno.ENOSYS, errno.EMLINK, errno.EACCES])
+
+
+def makedirs(dirpath):
+    """Make ``dirpath`` and its parents, if they don't already exist. Safe to
+    call from several threads or processes at once."""
+    try:
+        os.makedirs(dirpath)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "reflinks need fcntl")
+    with open(src, "rb") as ifh:
+        with open(dst, "wb") as ofh:
+            try:
+                fcntl.ioctl(ofh.fileno(), _FICLONE, ifh.fileno())
+            except IOError as exc:
+                # Python 2 raises IOError here
+                raise OSError(exc.errno, str(exc))
+
+
+def _copy_range(src, dst):
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is None:
+        raise OSError(errno.ENOSYS, "copy_file_range needs Python 3.8+")
+    with open(src, "rb") as ifh:
+        with open(dst, "wb") as ofh:
+            remaining = os.fstat(ifh.fileno()).st_size
+            while remaining > 0:
+                done = copy_file_range(ifh.fileno(), ofh.fileno(), remaining)
+                if done == 0:
+                    break
+                remaining -= done
+    shutil.copystat(src, dst)
+
+
+def _copy(src, dst):
+    shutil.copy2(src, dst)
+
+
+# Python 2 on Windows has no os.link
+_PLACERS = {
+    "link": getattr(os, "link", None),
+    "reflink": _reflink,
+    "copy_range": _copy_range,
+    "copy": _copy,
+}
+
+
+def place_file(src, dst, mode="link"):
+    """Place a copy of ``src`` at ``dst``, using the cheapest method the
+    filesystem allows.
+
+    In ``"link"`` mode, ``dst`` is hard linked to ``src`` if possible, so both
+    names share one file. Otherwise, and in ``"copy"`` mode, a reflink (a
+    copy-on-write clone, on btrfs or XFS) is tried, then an in-kernel
+    ``copy_file_range``, then an ordinary copy. Parent directories of ``dst``
+    are made as needed; an existing ``dst`` is an error.
+
+    :param str src: File to place.
+    :param str dst: Destination path.
+    :param str mode: ``"link"`` or ``"copy"``.
+    :returns: str -- The method used: ``"link"``, ``"reflink"``,
+              ``"copy_range"`` or ``"copy"``.
+    :raises: ValueError, OSError
+    """
+    if mode not in PLACE_METHODS:
+        msg = PARAM_TYPE_ERR.format(param="mode", func="place_file",
+                                    type=" or ".join(sorted(PLACE_METHODS)))
+        raise ValueError(msg)
+    if mode == "link" and _PLACERS["link"] is None:
+        raise ValueError("Hard links aren't available on this platform, "
+                         "use mode 'copy'")
+    if path.lexists(dst):
+        raise OSError(errno.EEXIST, "Destination exists", dst)
+    makedirs(path.dirname(dst))
+    methods = PLACE_METHODS[mode]
+    for method in methods:
+        try:
+            _PLACERS[method](src, dst)
+        except (OSError, IOError) as exc:
+            if exc.errno not in _UNSUPPORTED or method == methods[-1]:
+                raise
+            # Don't leave an empty file from a failed clone behind
+            if method != "link" and path.lexists(dst):
+                os.unlink(dst)
+            continue
+        instrument.incr("place." + method)
+        return method
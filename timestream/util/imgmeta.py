@@ -20,11 +20,7 @@
 
 .. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
 """
-try:
-    import exifread as er
-    library = "exifread"
-except ImportError:
-    library = "wand"
+from datetime import datetime
 from string import (
     digits,
 )
@@ -32,6 +28,23 @@ from string import (
 from timestream.util import (
     dict_unicode_to_str,
 )
+from timestream.util.backends import (
+    get_backend,
+)
+
+#: ``strptime`` format of EXIF date tags
+EXIF_DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+#: EXIF library to use, ``"exifread"`` or ``"wand"``. ``None`` uses the
+#: ``exif`` backend, i.e. exifread if it is installed, otherwise wand.
+library = None
+
+
+def _exif_library():
+    if library is not None:
+        return library
+    if get_backend("exif").__name__ == "exifread":
+        return "exifread"
+    return "wand"
 
 
 def get_exif_tags(image, mode="silent"):
@@ -45,18 +58,16 @@ def get_exif_tags(image, mode="silent"):
     """
     if mode not in {"silent", "raise"}:
         raise ValueError("Bad get_exif_tags mode '{}'".format(mode))
-    if library == "wand":
+    lib = _exif_library()
+    if lib == "wand":
         # use the wand library, as either we've been told to or the faster
         # exifread isn't available
         from wand.image import Image
         with Image(filename=image) as img:
             exif = {k[5:]: v for k, v in img.metadata.items() if
                     k.startswith('exif:')}
-    elif library == "exifread":
-        try:
-            er.__doc__
-        except NameError:
-            import exifread as er
+    elif lib == "exifread":
+        import exifread as er
         with open(image, "rb") as fh:
             tags = er.process_file(fh, details=False)
         tags = dict_unicode_to_str(tags)
@@ -73,7 +84,7 @@ def get_exif_tags(image, mode="silent"):
     else:
         raise ValueError(
             "Library '{}' not supported (only wand and exifread are".format(
-                library))
+                lib))
     return exif
 
 
@@ -97,3 +108,29 @@ def get_exif_tag(image, tag, mode="silent"):
             return None
         else:
             raise exc
+
+
+def get_exif_datetime(image, tag="DateTimeOriginal"):
+    """Get the capture time of an image from its EXIF header.
+
+    With exifread, parsing stops as soon as ``tag`` is found, so only the
+    start of the file is read.
+
+    :param str image: Path to image file.
+    :param str tag: EXIF date tag to use.
+    :returns: datetime.datetime -- The capture time, or ``None`` if the image
+              has no such tag.
+    """
+    if _exif_library() == "exifread":
+        import exifread as er
+        with open(image, "rb") as fh:
+            tags = er.process_file(fh, details=False, stop_tag=tag)
+        value = tags.get("EXIF " + tag, tags.get("Image " + tag))
+    else:
+        value = get_exif_tag(image, tag)
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(str(value).strip(), EXIF_DATE_FORMAT)
+    except ValueError:
+        return None
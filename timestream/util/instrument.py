@@ -0,0 +1,177 @@
+# Copyright 2014 Kevin Murray
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: timestream.util.instrument
+    :platform: Unix, Windows
+    :synopsis: Lightweight counters and timers for the library's hot paths.
+
+Instrumentation is off by default, and costs a function call and a dict
+lookup per event when off. Turn it on for a block of code with
+``instrumented()``, or for a whole run by setting the ``TIMESTREAM_INSTRUMENT``
+environment variable. If the variable holds a file name rather than ``1``,
+statistics are written there as JSON when the interpreter exits.
+
+Counters and timers are per-process; work done in ``ts_parallel_map``
+workers is not counted, only the time spent waiting on them.
+
+.. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
+"""
+
+import atexit
+import collections
+import contextlib
+import json
+import logging
+import os
+import time
+
+#: Environment variable which enables instrumentation
+INSTRUMENT_ENV = "TIMESTREAM_INSTRUMENT"
+LOG = logging.getLogger("timestreamlib")
+
+_STATE = {"enabled": False}
+_COUNTERS = collections.Counter()
+_TIMERS = collections.defaultdict(lambda: [0.0, 0])
+
+
+class _Timer(object):
+
+    """Context manager adding its run time to a named timer"""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        timer = _TIMERS[self.name]
+        timer[0] += time.time() - self.start
+        timer[1] += 1
+        return False
+
+
+class _NullTimer(object):
+
+    """Do-nothing stand in for ``_Timer`` when instrumentation is off"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def enabled():
+    """Is instrumentation currently on?"""
+    return _STATE["enabled"]
+
+
+def enable(on=True):
+    """Turn instrumentation on or off, returning the previous state."""
+    prev = _STATE["enabled"]
+    _STATE["enabled"] = bool(on)
+    return prev
+
+
+def reset():
+    """Clear all counters and timers."""
+    _COUNTERS.clear()
+    _TIMERS.clear()
+
+
+def incr(name, amount=1):
+    """Add ``amount`` to the counter ``name``, if instrumentation is on."""
+    if _STATE["enabled"]:
+        _COUNTERS[name] += amount
+
+
+def timer(name):
+    """Context manager which times its block into the timer ``name``, if
+    instrumentation is on.
+
+    :param str name: Timer name, e.g. ``"decode.cv2"``.
+    """
+    if _STATE["enabled"]:
+        return _Timer(name)
+    return _NULL_TIMER
+
+
+def get_stats():
+    """Get a snapshot of all counters and timers.
+
+    :returns: dict -- ``{"counters": {name: count}, "timers": {name:
+              {"seconds": total, "calls": count}}}``
+    """
+    return {
+        "counters": dict(_COUNTERS),
+        "timers": dict((k, {"seconds": v[0], "calls": v[1]})
+                       for k, v in _TIMERS.items()),
+    }
+
+
+def dump_stats(fname):
+    """Write ``get_stats()`` to ``fname`` as JSON."""
+    with open(fname, "w") as ofh:
+        json.dump(get_stats(), ofh, indent=2, sort_keys=True)
+    LOG.info("Wrote instrumentation stats to {}".format(fname))
+
+
+@contextlib.contextmanager
+def instrumented(dump=None):
+    """Context manager enabling instrumentation for a block of code.
+
+    Counters are reset on entry. The ``dict`` given by the ``with`` statement
+    is filled with ``get_stats()`` on exit, and the stats are also written to
+    ``dump`` as JSON if it's given.
+
+    ::
+
+        with instrumented("stats.json") as stats:
+            ts_to_tsnc(ts_path, tsnc_path)
+        print(stats["timers"]["decode.cv2"])
+    """
+    reset()
+    prev = enable(True)
+    stats = {}
+    try:
+        yield stats
+    finally:
+        enable(prev)
+        stats.update(get_stats())
+        if dump is not None:
+            dump_stats(dump)
+
+
+def _setup_from_env():
+    setting = os.environ.get(INSTRUMENT_ENV, "")
+    if not setting or setting == "0":
+        return
+    enable(True)
+    if setting != "1":
+        atexit.register(dump_stats, setting)
+
+
+_setup_from_env()
@@ -21,6 +21,7 @@
 
 """
 
+import collections
 import logging
 import re
 
@@ -52,3 +53,48 @@ def traypos_to_chamber_index(traypos, tray_cap=20, col_cap=5):
     return index
 
 
+def tray_pot_rois(trays, cols=4, rows=5, margin=0):
+    """Work out the region of each pot in an image, from the region of each
+    tray.
+
+    Each tray is divided evenly into a grid of ``cols`` columns, lettered
+    from ``A`` at the left, by ``rows`` rows, numbered from ``1`` at the top,
+    as per ``traypos_to_chamber_index``.
+
+    :param dict trays: ``{tray_number: (x, y, width, height)}`` in pixels.
+    :param int cols: Pot columns per tray.
+    :param int rows: Pot rows per tray, at most 9.
+    :param int margin: Pixels to trim from each side of each pot.
+    :returns: collections.OrderedDict -- ``{traypos: (x, y, width, height)}``,
+              in order of chamber index.
+    :raises: TypeError, ValueError
+    """
+    if not isinstance(trays, dict) or not trays:
+        msg = PARAM_TYPE_ERR.format(func='tray_pot_rois', param='trays',
+                                    type='non-empty dict')
+        LOG.error(msg)
+        raise TypeError(msg)
+    if not 1 <= cols <= 26 or not 1 <= rows <= 9:
+        msg = "Trays of {:d} by {:d} pots are invalid".format(cols, rows)
+        LOG.error(msg)
+        raise ValueError(msg)
+    pots = []
+    for tray, (x, y, width, height) in trays.items():
+        for col in range(cols):
+            left = x + int(round(col * width / float(cols)))
+            right = x + int(round((col + 1) * width / float(cols)))
+            for row in range(rows):
+                top = y + int(round(row * height / float(rows)))
+                bottom = y + int(round((row + 1) * height / float(rows)))
+                roi = (left + margin, top + margin,
+                       right - left - 2 * margin, bottom - top - 2 * margin)
+                if roi[2] < 1 or roi[3] < 1:
+                    msg = "Pots of tray {} are too small".format(tray)
+                    LOG.error(msg)
+                    raise ValueError(msg)
+                traypos = "{:d}{}{:d}".format(int(tray), chr(65 + col),
+                                              row + 1)
+                index = traypos_to_chamber_index(traypos, cols * rows, rows)
+                pots.append((index, traypos, roi))
+    return collections.OrderedDict((pos, roi) for _, pos, roi in
+                                   sorted(pots))
@@ -0,0 +1,152 @@
+# Copyright 2014 Kevin Murray
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: timestream.util.synthetic
+    :platform: Unix, Windows
+    :synopsis: Generate synthetic timestreams for testing and benchmarking.
+
+.. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
+"""
+
+from datetime import timedelta
+import json
+import logging
+import os
+from os import path
+import random
+
+from timestream.parse import (
+    MANIFEST_EXT,
+)
+from timestream.parse.validate import (
+    IMAGE_EXT_TO_TYPE,
+    TS_DATE_FORMAT,
+    TS_V1_FMT,
+)
+from timestream.util import (
+    PARAM_TYPE_ERR,
+)
+
+#: Ways of filling the image files of a synthetic timestream
+SYNTHETIC_MODES = ["empty", "tiny", "sparse"]
+LOG = logging.getLogger("timestreamlib")
+
+
+def _encode_image(ext, shape, seed):
+    """Encode a small noise image as ``ext``, for decodable synthetic files."""
+    import cv2
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    mat = rng.randint(0, 256, size=shape).astype("u1")
+    ok, buf = cv2.imencode("." + ext.lower(), mat)
+    if not ok:
+        raise ValueError("Can't encode synthetic image as '{}'".format(ext))
+    return buf.tostring()
+
+
+def ts_make_synthetic(ts_path, start, end, interval=5, name=None, ext="JPG",
+                      mode="tiny", size=4096, shape=(48, 64, 3), burst=1,
+                      gaps=None, missing_rate=0.0, seed=0,
+                      write_manifest=True):
+    """Create a synthetic V1 timestream at ``ts_path``.
+
+    :param str ts_path: Root of the timestream to create.
+    :param datetime.datetime start: First timepoint.
+    :param datetime.datetime end: Last timepoint.
+    :param int interval: Minutes between timepoints.
+    :param str name: Timestream name, defaults to the basename of ``ts_path``.
+    :param str ext: Image file extension.
+    :param str mode: One of ``SYNTHETIC_MODES``. ``"empty"`` makes zero-byte
+                     files, ``"tiny"`` a real image of ``shape`` that can be
+                     decoded, and ``"sparse"`` a sparse file of ``size``
+                     bytes.
+    :param int size: File size in bytes for ``"sparse"`` mode.
+    :param tuple shape: Image shape for ``"tiny"`` mode.
+    :param int burst: Number of images per timepoint, i.e. the sub-second
+                      counter ``n`` runs from 0 to ``burst - 1``.
+    :param list gaps: ``(start, end)`` datetime pairs with no images.
+    :param float missing_rate: Fraction of other timepoints randomly dropped.
+    :param int seed: Random seed, so streams are reproducible.
+    :param bool write_manifest: Write a ``.tsm`` manifest listing the missing
+                                timepoints.
+    :returns: dict -- The manifest of the new timestream.
+    """
+    if mode not in SYNTHETIC_MODES:
+        raise ValueError("Bad ts_make_synthetic mode '{}'".format(mode))
+    if not isinstance(burst, int) or not 1 <= burst <= 100:
+        msg = PARAM_TYPE_ERR.format(param="burst", func="ts_make_synthetic",
+                                    type="int between 1 and 100")
+        LOG.error(msg)
+        raise ValueError(msg)
+    if name is None:
+        name = path.basename(ts_path.rstrip(os.sep))
+    if gaps is None:
+        gaps = []
+    rng = random.Random(seed)
+    data = b""
+    if mode == "tiny":
+        data = _encode_image(ext, shape, seed)
+    fmts = [TS_V1_FMT.format(tsname=name, ext=ext, n=n) for n in range(burst)]
+    made_dirs = set()
+    missing = []
+    first = last = None
+    step = timedelta(minutes=interval)
+    time = start
+    while time <= end:
+        if (any(g_start <= time <= g_end for g_start, g_end in gaps) or
+                (missing_rate and rng.random() < missing_rate)):
+            missing.append(time.strftime(TS_DATE_FORMAT))
+            time += step
+            continue
+        if first is None:
+            first = time
+        last = time
+        for fmt in fmts:
+            img = path.join(ts_path, time.strftime(fmt))
+            img_dir = path.dirname(img)
+            if img_dir not in made_dirs:
+                if not path.isdir(img_dir):
+                    os.makedirs(img_dir)
+                made_dirs.add(img_dir)
+            with open(img, "wb") as ofh:
+                if mode == "sparse":
+                    ofh.truncate(size)
+                else:
+                    ofh.write(data)
+        time += step
+    if first is None:
+        raise ValueError("Synthetic timestream would have no images")
+    # Timepoints outside the first and last images aren't "missing"
+    first_str = first.strftime(TS_DATE_FORMAT)
+    last_str = last.strftime(TS_DATE_FORMAT)
+    missing = [x for x in missing if first_str < x < last_str]
+    manifest = {
+        "name": name,
+        "version": 1,
+        "start_datetime": first_str,
+        "end_datetime": last_str,
+        "image_type": IMAGE_EXT_TO_TYPE[ext],
+        "extension": ext,
+        "interval": interval,
+        "missing": missing,
+    }
+    if write_manifest:
+        mf_path = path.join(ts_path, "{}.{}".format(name, MANIFEST_EXT))
+        with open(mf_path, "w") as ofh:
+            json.dump(manifest, ofh, indent=2)
+    LOG.debug("Made synthetic timestream {} with {:d} dirs".format(
+        ts_path, len(made_dirs)))
+    return manifest
@@ -0,0 +1,464 @@
+# Copyright 2014 Kevin Murray
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: timestream.webapi
+    :platform: Unix, Windows
+    :synopsis: WSGI service giving HTTP access to timestreams.
+
+The service implements the API of :ref:`spec-webapi`. It is a plain WSGI
+application, so it runs under any WSGI server, e.g.::
+
+    gunicorn -w 4 'timestream.webapi:make_app("/data/timestreams")'
+
+or, for local use, ``ts_serve``.
+
+Each worker process finds the timestreams under its root once, and keeps
+their manifests and time indices in memory, so lookups never walk the
+directory tree. Encoded responses are kept in an in-memory LRU cache.
+
+.. moduleauthor:: Kevin Murray <spam@kdmurray.id.au>
+"""
+
+import collections
+from datetime import datetime, timedelta
+from email.utils import formatdate, parsedate_tz, mktime_tz
+import hashlib
+import json
+import logging
+import os
+from os import path
+import re
+import threading
+import time as timemod
+try:
+    from urlparse import parse_qs
+except ImportError:
+    from urllib.parse import parse_qs
+try:
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, make_server
+
+from timestream.manipulate.pyramid import (
+    _dct_scale,
+)
+from timestream.parse import (
+    ts_format_date,
+    ts_get_index,
+    ts_get_manifest,
+    ts_get_nearest_image,
+    ts_imread,
+    ts_index_invalidate,
+    ts_parse_date,
+)
+from timestream.parse.catalog import (
+    ts_find_timestreams,
+)
+from timestream.util import (
+    instrument,
+)
+from timestream.util.backends import (
+    lazy_backend,
+)
+
+cv2 = lazy_backend("cv2")
+LOG = logging.getLogger("timestreamlib")
+#: Default size of the response cache, in bytes
+DEFAULT_CACHE_BYTES = 128 * 1024 * 1024
+#: Largest thumbnail width served
+MAX_THUMB_WIDTH = 2048
+#: Default tolerance of nearest image lookups, in seconds
+DEFAULT_TOLERANCE = 3600
+_CONTENT_TYPES = {
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "tif": "image/tiff",
+    "tiff": "image/tiff",
+}
+_ROUTE = re.compile(r"^/streams/(?P<stream>.+)/(?P<what>manifest|index|image|"
+                    r"thumb)(?:/(?P<when>[^/]+))?/?$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_REASONS = {
+    200: "OK",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    416: "Requested Range Not Satisfiable",
+}
+
+
+class HTTPError(Exception):
+
+    """An error response, with an HTTP status code"""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class _Response(object):
+
+    """An encoded response body with its validators"""
+
+    def __init__(self, body, content_type, mtime, headers=None):
+        self.body = body
+        self.content_type = content_type
+        self.mtime = mtime
+        self.etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        self.headers = headers or []
+
+
+class LRUCache(object):
+
+    """Thread-safe least recently used cache, bounded by total size.
+
+    :param int max_bytes: Total size of values to keep.
+    :param sizeof: Function giving the size of a value.
+    """
+
+    def __init__(self, max_bytes, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is None:
+                instrument.incr("webapi.cache_misses")
+                return None
+            self._items[key] = value
+            instrument.incr("webapi.cache_hits")
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        # A single huge value would flush everything else
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= self.sizeof(old)
+            self._items[key] = value
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= self.sizeof(evicted)
+
+    def __len__(self):
+        return len(self._items)
+
+
+def _parse_when(when):
+    """Parse a URL datetime, as ``%Y_%m_%d_%H_%M_%S`` or ISO 8601"""
+    for parse in (ts_parse_date,
+                  lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%S")):
+        try:
+            return parse(when)
+        except ValueError:
+            pass
+    raise HTTPError(400, "Bad datetime '{}'".format(when))
+
+
+def _json_body(obj):
+    return json.dumps(obj, sort_keys=True).encode("utf-8")
+
+
+class TimestreamApp(object):
+
+    """WSGI application serving the timestreams under ``root``.
+
+    :param str root: Storage root holding timestreams.
+    :param int cache_bytes: Size of the in-memory response cache.
+    :param int max_depth: How deep below ``root`` to look for timestreams.
+    :param float refresh: Seconds after which timestreams, manifests and
+                          indices are reloaded, for growing timestreams.
+                          ``None`` keeps them for the life of the worker.
+    """
+
+    def __init__(self, root, cache_bytes=DEFAULT_CACHE_BYTES, max_depth=3,
+                 refresh=None):
+        self.root = root
+        self.max_depth = max_depth
+        self.refresh = refresh
+        self.cache = LRUCache(cache_bytes, lambda resp: len(resp.body))
+        self._lock = threading.Lock()
+        self._loaded = None
+        self._streams = {}
+        self._manifests = {}
+        self._widths = {}
+
+    def _load(self):
+        """(Re)load the stream list, forgetting manifests and indices"""
+        streams = {}
+        for ts_path in ts_find_timestreams(self.root, self.max_depth):
+            streams[path.relpath(ts_path, self.root)] = ts_path
+        self._streams = streams
+        self._manifests = {}
+        self._widths = {}
+        if self._loaded is not None:
+            # Indices are rebuilt lazily, on their next lookup
+            for ts_path in streams.values():
+                ts_index_invalidate(ts_path)
+        self._loaded = timemod.time()
+        LOG.info("Serving {:d} timestreams from {}".format(len(streams),
+                                                          self.root))
+
+    def _stream(self, name):
+        """``(ts_path, manifest)`` of the stream called ``name``"""
+        with self._lock:
+            if self._loaded is None or (self.refresh is not None and
+                    timemod.time() - self._loaded > self.refresh):
+                self._load()
+            ts_path = self._streams.get(name)
+            if ts_path is None:
+                raise HTTPError(404, "No timestream '{}'".format(name))
+            if ts_path not in self._manifests:
+                self._manifests[ts_path] = ts_get_manifest(ts_path)
+            return (ts_path, self._manifests[ts_path])
+
+    def _source_width(self, ts_path, img):
+        """Full width of the images of ``ts_path``, probed by decoding
+        ``img`` once per stream, as frames of a timestream share a size"""
+        with self._lock:
+            width = self._widths.get(ts_path)
+        if width is None:
+            mat = ts_imread(img)
+            if mat is None:
+                raise HTTPError(404, "Couldn't decode image")
+            width = mat.shape[1]
+            with self._lock:
+                self._widths[ts_path] = width
+        return width
+
+    def _cached(self, key, make):
+        resp = self.cache.get(key)
+        if resp is None:
+            resp = make()
+            self.cache.put(key, resp)
+        return resp
+
+    def _list(self):
+        with self._lock:
+            if self._loaded is None:
+                self._load()
+            names = sorted(self._streams)
+        return _Response(_json_body({"streams": names}), "application/json",
+                         self._loaded)
+
+    def _manifest(self, name):
+        ts_path, manifest = self._stream(name)
+        manifest = dict(manifest)
+        for key in ("start_datetime", "end_datetime"):
+            manifest[key] = ts_format_date(manifest[key])
+        return _Response(_json_body(manifest), "application/json",
+                         self._loaded)
+
+    def _index(self, name, query):
+        ts_path, _ = self._stream(name)
+        index = ts_get_index(ts_path)
+        start = _parse_when(query["start"][0]) if "start" in query else None
+        end = _parse_when(query["end"][0]) if "end" in query else None
+        body = {"times": [], "n": [], "images": []}
+        for time, n, img in zip(index["times"], index["n"], index["paths"]):
+            if (start is not None and time < start) or \
+                    (end is not None and time > end):
+                continue
+            body["times"].append(ts_format_date(time))
+            body["n"].append(n)
+            body["images"].append(path.relpath(img, ts_path))
+        return _Response(_json_body(body), "application/json", self._loaded)
+
+    def _nearest(self, name, when, query):
+        ts_path, _ = self._stream(name)
+        try:
+            tolerance = float(query.get("tolerance", [DEFAULT_TOLERANCE])[0])
+        except ValueError:
+            raise HTTPError(400, "Bad tolerance")
+        img, offset = ts_get_nearest_image(ts_path, _parse_when(when),
+                                           tolerance)
+        if img is None:
+            raise HTTPError(404, "No image near {}".format(when))
+        return img, offset
+
+    def _image(self, name, when, query):
+        img, offset = self._nearest(name, when, query)
+        mtime = os.stat(img).st_mtime
+
+        def make():
+            with open(img, "rb") as ifh:
+                body = ifh.read()
+            ext = path.splitext(img)[1][1:].lower()
+            return _Response(body, _CONTENT_TYPES.get(
+                ext, "application/octet-stream"), mtime)
+        resp = self._cached(("image", img, mtime), make)
+        return resp, self._image_headers(img, offset)
+
+    def _thumb(self, name, when, query):
+        ts_path, _ = self._stream(name)
+        img, offset = self._nearest(name, when, query)
+        try:
+            width = int(query.get("width", [320])[0])
+        except ValueError:
+            raise HTTPError(400, "Bad width")
+        if not 1 <= width <= MAX_THUMB_WIDTH:
+            raise HTTPError(400, "Width must be 1 to {:d}".format(
+                MAX_THUMB_WIDTH))
+        mtime = os.stat(img).st_mtime
+
+        def make():
+            # Decode once, at the largest DCT scale that's still wide enough
+            scale = _dct_scale(self._source_width(ts_path, img), width)
+            mat = ts_imread(img, scale)
+            if mat is None:
+                raise HTTPError(404, "Couldn't decode image")
+            height = max(1, int(round(mat.shape[0] * width /
+                                      float(mat.shape[1]))))
+            mat = cv2.resize(mat, (width, height),
+                             interpolation=cv2.INTER_AREA)
+            ok, buf = cv2.imencode(".jpg", mat,
+                                   [cv2.IMWRITE_JPEG_QUALITY, 85])
+            return _Response(buf.tostring(), "image/jpeg", mtime)
+        resp = self._cached(("thumb", img, mtime, width), make)
+        return resp, self._image_headers(img, offset)
+
+    @staticmethod
+    def _image_headers(img, offset):
+        return [
+            ("X-Timestream-Image", path.basename(img)),
+            ("X-Timestream-Offset", "{:.0f}".format(
+                offset.total_seconds())),
+        ]
+
+    def _route(self, environ):
+        method = environ.get("REQUEST_METHOD", "GET")
+        if method not in ("GET", "HEAD"):
+            raise HTTPError(405, "Only GET and HEAD are supported")
+        url = environ.get("PATH_INFO", "/")
+        query = parse_qs(environ.get("QUERY_STRING", ""))
+        if url.rstrip("/") == "/streams":
+            return self._list(), []
+        match = _ROUTE.match(url)
+        if match is None:
+            raise HTTPError(404, "No such resource")
+        stream, what, when = match.group("stream", "what", "when")
+        if what in ("image", "thumb"):
+            if when is None:
+                raise HTTPError(404, "No datetime given")
+            return getattr(self, "_" + what)(stream, when, query)
+        if when is not None:
+            raise HTTPError(404, "No such resource")
+        if what == "manifest":
+            return self._manifest(stream), []
+        return self._index(stream, query), []
+
+    def __call__(self, environ, start_response):
+        try:
+            resp, headers = self._route(environ)
+        except HTTPError as exc:
+            return self._send(start_response, exc.status,
+                              [("Content-Type", "application/json")],
+                              _json_body({"error": str(exc)}))
+        headers = headers + [
+            ("Content-Type", resp.content_type),
+            ("ETag", resp.etag),
+            ("Last-Modified", formatdate(resp.mtime, usegmt=True)),
+            ("Accept-Ranges", "bytes"),
+            ("Cache-Control", "public, max-age=60"),
+        ]
+        # Conditional requests, preferring the ETag as per RFC 7232
+        inm = environ.get("HTTP_IF_NONE_MATCH")
+        ims = environ.get("HTTP_IF_MODIFIED_SINCE")
+        if inm is not None:
+            if resp.etag in [x.strip() for x in inm.split(",")] or \
+                    inm.strip() == "*":
+                return self._send(start_response, 304, headers, b"")
+        elif ims is not None:
+            parsed = parsedate_tz(ims)
+            if parsed is not None and int(resp.mtime) <= mktime_tz(parsed):
+                return self._send(start_response, 304, headers, b"")
+        body = resp.body
+        status = 200
+        rng = environ.get("HTTP_RANGE")
+        if rng is not None:
+            status, body, extra = self._range(rng, body)
+            headers.extend(extra)
+        if environ.get("REQUEST_METHOD") == "HEAD":
+            headers.append(("Content-Length", str(len(body))))
+            body = b""
+        return self._send(start_response, status, headers, body)
+
+    @staticmethod
+    def _range(rng, body):
+        """Apply a single ``bytes=`` range, as ``(status, body, headers)``.
+        Ranges we don't understand are ignored, as RFC 7233 allows."""
+        match = _RANGE.match(rng.strip())
+        if match is None or match.groups() == ("", ""):
+            return (200, body, [])
+        first, last = match.groups()
+        size = len(body)
+        if first == "":
+            first = max(0, size - int(last))
+            last = size - 1
+        else:
+            first = int(first)
+            last = min(int(last), size - 1) if last != "" else size - 1
+        if first >= size or first > last:
+            return (416, b"", [("Content-Range", "bytes */{:d}".format(size))])
+        return (206, body[first:last + 1], [
+            ("Content-Range", "bytes {:d}-{:d}/{:d}".format(first, last,
+                                                           size))])
+
+    @staticmethod
+    def _send(start_response, status, headers, body):
+        if not any(k == "Content-Length" for k, _ in headers):
+            headers = headers + [("Content-Length", str(len(body)))]
+        start_response("{:d} {}".format(status, _REASONS[status]), headers)
+        return [body]
+
+
+def make_app(root, **kwargs):
+    """Make a WSGI application serving the timestreams under ``root``. See
+    ``TimestreamApp`` for keyword arguments."""
+    return TimestreamApp(root, **kwargs)
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def ts_serve(root, host="127.0.0.1", port=8000, **kwargs):
+    """Serve the timestreams under ``root`` over HTTP until interrupted,
+    using the standard library's threaded WSGI server.
+
+    :param str root: Storage root holding timestreams.
+    :param str host: Address to listen on.
+    :param int port: Port to listen on.
+    """
+    server = make_server(host, port, make_app(root, **kwargs),
+                         server_class=_ThreadingWSGIServer)
+    LOG.info("Serving {} on http://{}:{:d}/".format(root, host, port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
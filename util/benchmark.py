@@ -0,0 +1,232 @@
+"""Benchmark timestreamlib's hot paths on a synthetic timestream.
+
+Results are written as JSON, so runs can be compared to catch regressions.
+
+Usage:
+    benchmark.py [options] [<output>]
+    benchmark.py compare <old> <new>
+
+Options:
+    -d DAYS --days=DAYS         Days of images to generate [default: 2]
+    -i MINS --interval=MINS     Minutes between timepoints [default: 5]
+    -b N --burst=N              Images per timepoint [default: 1]
+    -m MODE --mode=MODE         Image files: empty, tiny or sparse
+                                [default: tiny]
+    -g RATE --missing=RATE      Fraction of timepoints missing [default: 0.05]
+    -r N --repeats=N            Repeats of each benchmark [default: 3]
+    -n N --decode=N             Images used by decode benchmarks [default: 50]
+    -p N --procs=N              Processes for parallel benchmarks [default: 2]
+    -k NAMES --only=NAMES       Comma separated benchmarks to run
+    -t DIR --tmpdir=DIR         Where to generate the synthetic timestream
+"""
+
+from datetime import datetime, timedelta
+from docopt import docopt
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+
+from timestream.parse import (
+    all_files_with_ext,
+    ts_get_image,
+    ts_guess_manifest,
+    ts_iter_numpy,
+    ts_iter_times,
+)
+from timestream.manipulate import ts_parallel_map
+from timestream.util.synthetic import ts_make_synthetic
+
+TS_NAME = "BENCH01-GC01L-SYN-Cam01~tiny-orig"
+#: Modules whose import time is benchmarked, in a fresh interpreter each time
+IMPORT_MODULES = ["timestream.parse", "timestream.parse.catalog",
+                  "timestream.manipulate"]
+# Prints the import time of a module, and the heavy backends it loaded
+_IMPORT_SCRIPT = """
+import sys, time
+start = time.time()
+import {module}
+took = time.time() - start
+from timestream.util.backends import BACKENDS
+heavy = [m for mods, _ in BACKENDS.values() for m in mods if m in sys.modules]
+print("{{:f}} {{}}".format(took, ",".join(heavy)))
+"""
+
+
+def _decode_shape(args):
+    return next(ts_iter_numpy([args[0]]))[1].shape
+
+
+def bench_walk(ctx):
+    return len(list(all_files_with_ext(ctx["ts"], ctx["ext"])))
+
+
+def bench_guess_manifest(ctx):
+    ts_guess_manifest(ctx["ts"])
+    return 1
+
+
+def bench_get_image(ctx):
+    count = 0
+    for time in ts_iter_times(ctx["ts"]):
+        ts_get_image(ctx["ts"], time)
+        count += 1
+    return count
+
+
+def bench_decode(ctx):
+    return len(list(ts_iter_numpy(ctx["imgs"])))
+
+
+def bench_parallel_map(ctx):
+    return len(list(ts_parallel_map(ctx["imgs"], _decode_shape, [],
+                                    procs=ctx["procs"])))
+
+
+def import_time(module):
+    """Seconds to import ``module`` in a fresh interpreter, and the backend
+    modules importing it loaded, which should be none for the core API."""
+    out = subprocess.check_output([sys.executable, "-c",
+                                   _IMPORT_SCRIPT.format(module=module)])
+    took, _, heavy = out.decode("utf-8").strip().partition(" ")
+    return float(took), [x for x in heavy.split(",") if x]
+
+
+def bench_import(ctx):
+    for module in IMPORT_MODULES:
+        took, heavy = import_time(module)
+        sys.stderr.write("  import {:<24s} {:.4f}s\n".format(module, took))
+        if heavy:
+            sys.stderr.write("Importing {} loaded {}\n".format(
+                module, ", ".join(heavy)))
+    return len(IMPORT_MODULES)
+
+
+def bench_to_tsnc(ctx):
+    from timestream.manipulate.netcdf import ts_to_tsnc
+    ts_to_tsnc(ctx["ts"], path.join(ctx["tmpdir"], "bench.tsnc"))
+    return ctx["n_images"]
+
+
+#: (name, function, needs decodable images)
+BENCHMARKS = [
+    ("import", bench_import, False),
+    ("walk", bench_walk, False),
+    ("guess_manifest", bench_guess_manifest, False),
+    ("get_image", bench_get_image, False),
+    ("decode", bench_decode, True),
+    ("parallel_map", bench_parallel_map, True),
+    ("to_tsnc", bench_to_tsnc, True),
+]
+
+
+def run_benchmark(func, ctx, repeats):
+    times = []
+    items = 0
+    for _ in range(repeats):
+        start = time.time()
+        items = func(ctx)
+        times.append(time.time() - start)
+    best = min(times)
+    return {
+        "times": times,
+        "best": best,
+        "mean": sum(times) / len(times),
+        "items": items,
+        "items_per_sec": items / best if best > 0 else None,
+    }
+
+
+def run(opts):
+    params = {
+        "days": int(opts["--days"]),
+        "interval": int(opts["--interval"]),
+        "burst": int(opts["--burst"]),
+        "mode": opts["--mode"],
+        "missing_rate": float(opts["--missing"]),
+        "repeats": int(opts["--repeats"]),
+        "decode": int(opts["--decode"]),
+        "procs": int(opts["--procs"]),
+    }
+    only = opts["--only"].split(",") if opts["--only"] else None
+    tmpdir = tempfile.mkdtemp(dir=opts["--tmpdir"])
+    try:
+        ts = path.join(tmpdir, TS_NAME)
+        start = datetime(2014, 1, 1)
+        end = start + timedelta(days=params["days"]) - timedelta(seconds=1)
+        gen_start = time.time()
+        ts_make_synthetic(ts, start, end, interval=params["interval"],
+                          mode=params["mode"], burst=params["burst"],
+                          missing_rate=params["missing_rate"])
+        gen_time = time.time() - gen_start
+        imgs = sorted(all_files_with_ext(ts, "JPG"))
+        ctx = {
+            "ts": ts,
+            "ext": "JPG",
+            "tmpdir": tmpdir,
+            "imgs": imgs[:params["decode"]],
+            "n_images": len(imgs),
+            "procs": params["procs"],
+        }
+        results = {}
+        for name, func, decodes in BENCHMARKS:
+            if only is not None and name not in only:
+                continue
+            if decodes and params["mode"] != "tiny":
+                continue
+            try:
+                results[name] = run_benchmark(func, ctx, params["repeats"])
+            except ImportError as exc:
+                sys.stderr.write("Skipping {}: {}\n".format(name, exc))
+                continue
+            sys.stderr.write("{:<16s} best {:.4f}s\n".format(
+                name, results[name]["best"]))
+    finally:
+        shutil.rmtree(tmpdir)
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "n_images": len(imgs),
+            "generate_time": gen_time,
+            "params": params,
+        },
+        "results": results,
+    }
+
+
+def compare(old_file, new_file):
+    with open(old_file) as fh:
+        old = json.load(fh)["results"]
+    with open(new_file) as fh:
+        new = json.load(fh)["results"]
+    print("{:<16s} {:>10s} {:>10s} {:>8s}".format("benchmark", "old (s)",
+                                                  "new (s)", "ratio"))
+    for name in sorted(set(old) & set(new)):
+        old_best = old[name]["best"]
+        new_best = new[name]["best"]
+        ratio = new_best / old_best if old_best > 0 else float("nan")
+        print("{:<16s} {:>10.4f} {:>10.4f} {:>8.2f}".format(
+            name, old_best, new_best, ratio))
+
+
+def main():
+    opts = docopt(__doc__)
+    if opts["compare"]:
+        compare(opts["<old>"], opts["<new>"])
+        return
+    report = run(opts)
+    if opts["<output>"]:
+        with open(opts["<output>"], "w") as ofh:
+            json.dump(report, ofh, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Split work on a timestream into shards, run on separate nodes, e.g. as the
+tasks of a cluster array job, then merge their outputs.
+
+Usage:
+    ts_shard.py plan [options] <timestream> <shard_dir> <n_shards>
+    ts_shard.py run [options] <shard_dir> <index> <job>
+    ts_shard.py local [options] <shard_dir> <job>
+    ts_shard.py merge <shard_dir> <job> <output>
+
+Commands:
+    plan    Split the timestream into shards, writing the plan to shard_dir
+    run     Run one shard of a job: frame_stats or tsnc
+    local   Run every shard of a job on this machine, a process per shard
+    merge   Merge the outputs of every shard of a job
+
+Options:
+    -b BALANCE --balance=BALANCE    Balance shards by "count" or "bytes"
+                                    [default: count]
+    -p PROCS --procs=PROCS          Worker processes per shard [default: 1]
+    -w WORKERS --workers=WORKERS    Shards to run at once with local
+"""
+
+from docopt import docopt
+import logging
+import sys
+
+from timestream.manipulate.shard import (
+    ts_merge_shards,
+    ts_plan_shards,
+    ts_run_shard,
+    ts_run_shards_local,
+)
+
+
+def main():
+    opts = docopt(__doc__)
+    logging.basicConfig(level=logging.INFO)
+    procs = int(opts["--procs"])
+    if opts["plan"]:
+        plan = ts_plan_shards(opts["<timestream>"], opts["<shard_dir>"],
+                              int(opts["<n_shards>"]), opts["--balance"])
+        sys.stderr.write("Wrote {:d} shards to {}\n".format(
+            len(plan["shards"]), opts["<shard_dir>"]))
+    elif opts["run"]:
+        out = ts_run_shard(opts["<shard_dir>"], int(opts["<index>"]),
+                           opts["<job>"], procs)
+        sys.stderr.write("Wrote {}\n".format(out))
+    elif opts["local"]:
+        workers = opts["--workers"]
+        ts_run_shards_local(opts["<shard_dir>"], opts["<job>"],
+                            int(workers) if workers else None, procs)
+    elif opts["merge"]:
+        ts_merge_shards(opts["<shard_dir>"], opts["<job>"], opts["<output>"])
+        sys.stderr.write("Wrote {}\n".format(opts["<output>"]))
+
+
+if __name__ == "__main__":
+    main()
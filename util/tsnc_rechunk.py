@@ -0,0 +1,37 @@
+"""Rechunk the pixel array of a timestream netCDF4 file, e.g. so that the
+time series of a region can be read without reading every frame.
+
+Usage:
+    tsnc_rechunk.py [options] <input> <output>
+
+Options:
+    -l LAYOUT --layout=LAYOUT   "frame", "time", or chunk sizes as T,Y,X,Z
+                                [default: time]
+    -m MB --memory=MB           Megabytes of pixels to hold at once
+                                [default: 512]
+"""
+
+from docopt import docopt
+import logging
+import sys
+
+from timestream.manipulate.netcdf import ts_rechunk_tsnc
+
+
+def main():
+    opts = docopt(__doc__)
+    layout = opts["--layout"]
+    if layout not in ("frame", "time"):
+        try:
+            layout = tuple(int(x) for x in layout.split(","))
+        except ValueError:
+            sys.exit("Bad layout '{}'".format(layout))
+    logging.basicConfig(level=logging.INFO)
+    chunks = ts_rechunk_tsnc(opts["<input>"], opts["<output>"], layout,
+                             int(opts["--memory"]))
+    sys.stderr.write("Wrote {} with pixel chunks {!r}\n".format(
+        opts["<output>"], chunks))
+
+
+if __name__ == "__main__":
+    main()